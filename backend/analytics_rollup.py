@@ -0,0 +1,19 @@
+"""
+Roll up raw analytics events into daily aggregates and purge old raw rows
+"""
+import argparse
+
+from app.crud.analytics import run_rollup, ANALYTICS_RETENTION_DAYS
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--retention-days', type=int, default=ANALYTICS_RETENTION_DAYS,
+                        help="delete rolled-up raw events older than this many days")
+    args = parser.parse_args()
+    
+    print("🔄 Rolling up analytics events...")
+    
+    result = run_rollup(args.retention_days)
+    
+    print(f"✅ {result['events']} events rolled up in {result['chunks']} chunks, "
+          f"{result['purged']} old events purged")
@@ -0,0 +1,172 @@
+"""
+Async CRUD Operations for Oriental Mini App
+Awaitable versions of every function in app.crud.crud, executed on a
+bounded thread pool so blocking SQLite calls never stall the event loop
+"""
+import asyncio
+import contextvars
+import functools
+import inspect
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from contextvars import ContextVar, Token
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.crud import crud
+from app.models.database import db, UnitOfWork
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of database calls running at once in this worker.
+# Keep it at or below DB_POOL_SIZE so executor threads never wait on the pool.
+DB_MAX_CONCURRENCY = int(os.getenv("DB_MAX_CONCURRENCY", "8"))
+
+_executor: Optional[ThreadPoolExecutor] = None
+# Limits request steps in flight to what the pool can serve, so requests
+# queue here on the event loop instead of blocking executor threads on it
+_step_slots: Optional[asyncio.Semaphore] = None
+_stats = {
+    'submitted': 0,
+    'completed': 0,
+}
+# Seconds the current request has spent waiting on database calls
+_db_time: ContextVar[Optional[List[float]]] = ContextVar('db_time', default=None)
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=DB_MAX_CONCURRENCY,
+            thread_name_prefix="db"
+        )
+    return _executor
+
+
+def _step(uow: UnitOfWork, func: Callable, *args, **kwargs) -> Any:
+    """One step of a request's unit of work, committed before it returns"""
+    committed = False
+    try:
+        result = func(*args, **kwargs)
+        committed = True
+        return result
+    finally:
+        uow.end_step(commit=committed)
+
+
+async def run_db(func: Callable, *args, **kwargs) -> Any:
+    """Run a blocking database call on the DB executor and await its result
+    
+    Inside a request's unit of work the call is a step of it: it waits for
+    a slot, and its writes commit and its connection goes back to the pool
+    before the call returns, so no lock is held between awaits.
+    """
+    global _step_slots
+    uow = db.current_unit_of_work()
+    if uow is None:
+        return await _submit(func, *args, **kwargs)
+    
+    if _step_slots is None:
+        _step_slots = asyncio.Semaphore(min(DB_MAX_CONCURRENCY, db.pool.size))
+    async with _step_slots:
+        return await _submit(_step, uow, func, *args, **kwargs)
+
+
+async def _submit(func: Callable, *args, **kwargs) -> Any:
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    call = functools.partial(ctx.run, func, *args, **kwargs)
+
+    _stats['submitted'] += 1
+    started = time.perf_counter()
+    try:
+        return await loop.run_in_executor(_get_executor(), call)
+    finally:
+        _stats['completed'] += 1
+        db_time = _db_time.get()
+        if db_time is not None:
+            db_time[0] += time.perf_counter() - started
+
+
+def begin_db_timer() -> Tuple[List[float], Token]:
+    """Start adding up database time (queueing included) for this request"""
+    db_time = [0.0]
+    return db_time, _db_time.set(db_time)
+
+
+def end_db_timer(token: Token):
+    _db_time.reset(token)
+
+
+@asynccontextmanager
+async def unit_of_work():
+    """Request-scoped unit of work: every crud call awaited inside it shares
+    one identity map and commits as a step of it (see run_db)
+    
+    Nothing is held between calls, so routes that never touch the database
+    take no slot or connection. Once a call marks the unit rollback-only,
+    later steps roll back and so does the end of the unit, which raises
+    RollbackOnlyError; steps committed before that stay committed.
+    """
+    current = db.current_unit_of_work()
+    if current is not None:
+        yield current
+        return
+    
+    uow = UnitOfWork(db.pool)
+    token = db.bind_unit_of_work(uow)
+    try:
+        yield uow
+    except BaseException:
+        db.unbind_unit_of_work(token)
+        await _complete(uow, False)
+        raise
+    else:
+        db.unbind_unit_of_work(token)
+        await _complete(uow, True)
+
+
+async def _complete(uow: UnitOfWork, commit: bool):
+    # Steps give their connection back, so there is normally nothing left
+    # to commit on the executor
+    if uow.conn is None:
+        uow.complete(commit)
+    else:
+        await run_db(uow.complete, commit)
+
+
+def executor_stats() -> Dict[str, int]:
+    """In-flight and queued database calls for this worker"""
+    in_flight = _stats['submitted'] - _stats['completed']
+    return {
+        'max_concurrency': DB_MAX_CONCURRENCY,
+        'in_flight': in_flight,
+        'running': min(in_flight, DB_MAX_CONCURRENCY),
+        'queued': max(0, in_flight - DB_MAX_CONCURRENCY),
+        'total': _stats['submitted'],
+    }
+
+
+def shutdown():
+    """Wait for pending database calls and stop the executor"""
+    global _executor, _step_slots
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+    _step_slots = None
+
+
+def _make_async(func: Callable) -> Callable:
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_db(func, *args, **kwargs)
+    return wrapper
+
+
+# Export an awaitable twin for every public crud function
+for _name, _func in inspect.getmembers(crud, inspect.isfunction):
+    if _func.__module__ == crud.__name__ and not _name.startswith('_'):
+        globals()[_name] = _make_async(_func)
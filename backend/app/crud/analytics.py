@@ -0,0 +1,151 @@
+"""
+Analytics buffer for Oriental Mini App
+Write-behind queue that batches analytics events into bulk inserts
+"""
+import asyncio
+import logging
+import os
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from app.crud import acrud, crud
+
+logger = logging.getLogger(__name__)
+
+# Flush when this many events are queued...
+ANALYTICS_BATCH_SIZE = int(os.getenv("ANALYTICS_BATCH_SIZE", "200"))
+# ...or this many milliseconds after the last flush, whichever comes first
+ANALYTICS_FLUSH_MS = int(os.getenv("ANALYTICS_FLUSH_MS", "1000"))
+# Events beyond this many pending ones are dropped
+ANALYTICS_QUEUE_SIZE = int(os.getenv("ANALYTICS_QUEUE_SIZE", "10000"))
+
+# Seconds between rollup runs (0 disables the background job)
+ANALYTICS_ROLLUP_INTERVAL = float(os.getenv("ANALYTICS_ROLLUP_INTERVAL", "3600"))
+# Raw events older than this many days are deleted once rolled up
+ANALYTICS_RETENTION_DAYS = int(os.getenv("ANALYTICS_RETENTION_DAYS", "90"))
+
+
+class AnalyticsBuffer:
+    """Bounded in-process queue of analytics events flushed in batches"""
+
+    def __init__(self, batch_size: int = ANALYTICS_BATCH_SIZE,
+                 flush_ms: int = ANALYTICS_FLUSH_MS,
+                 max_size: int = ANALYTICS_QUEUE_SIZE):
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_ms / 1000
+        self.max_size = max_size
+        
+        self._events: deque = deque()
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {
+            'enqueued': 0,
+            'flushed': 0,
+            'dropped': 0,
+            'flushes': 0,
+            'failures': 0,
+        }
+    
+    def log(self, user_id: Optional[int], event_type: str, event_data: str = None) -> bool:
+        """Queue an event; returns False if it was dropped because the queue is full"""
+        created_at = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock:
+            if len(self._events) >= self.max_size:
+                self._stats['dropped'] += 1
+                return False
+            self._events.append((user_id, event_type, event_data, created_at))
+            self._stats['enqueued'] += 1
+            pending = len(self._events)
+        
+        if pending >= self.batch_size and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        return True
+    
+    def flush(self) -> int:
+        """Write queued events with one executemany; returns how many were written"""
+        written = 0
+        while True:
+            with self._lock:
+                count = min(len(self._events), self.batch_size)
+                batch = [self._events.popleft() for _ in range(count)]
+            if not batch:
+                return written
+            
+            try:
+                crud.log_analytics_events(batch)
+            except Exception as e:
+                logger.error(f"Error flushing analytics: {e}")
+                with self._lock:
+                    self._stats['failures'] += 1
+                    # Keep the batch for the next attempt if there is room
+                    room = self.max_size - len(self._events)
+                    self._events.extendleft(reversed(batch[:room]))
+                    self._stats['dropped'] += max(0, len(batch) - room)
+                return written
+            
+            written += len(batch)
+            with self._lock:
+                self._stats['flushed'] += len(batch)
+                self._stats['flushes'] += 1
+    
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await acrud.run_db(self.flush)
+    
+    def start(self):
+        """Start the background flush task on the running event loop"""
+        if self._task is None:
+            self._loop = asyncio.get_running_loop()
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Stop the flush task and write whatever is still queued"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._wakeup = None
+        await acrud.run_db(self.flush)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and drop/overflow counters"""
+        with self._lock:
+            return {
+                **self._stats,
+                'pending': len(self._events),
+                'max_size': self.max_size,
+            }
+
+
+analytics_buffer = AnalyticsBuffer()
+
+
+def run_rollup(retention_days: int = ANALYTICS_RETENTION_DAYS) -> Dict[str, int]:
+    """Roll up new raw events, then apply the retention policy"""
+    result = crud.rollup_analytics()
+    result['purged'] = crud.purge_analytics_events(retention_days)
+    return result
+
+
+async def rollup_periodically(interval: float = ANALYTICS_ROLLUP_INTERVAL):
+    """Background job: roll up and purge analytics every `interval` seconds"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            result = await acrud.run_db(run_rollup)
+            logger.info(f"Analytics rollup: {result}")
+        except Exception as e:
+            logger.error(f"Analytics rollup failed: {e}")
@@ -0,0 +1,116 @@
+"""
+Catalog cache for Oriental Mini App
+Versioned read-through cache for directions, courses and materials
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable
+
+from app.models.database import db
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of cached catalog lookups
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", "4096"))
+# How often (seconds) to look for catalog writes made by other workers
+CATALOG_VERSION_CHECK = float(os.getenv("CATALOG_VERSION_CHECK", "1.0"))
+
+
+def _copy(value: Any) -> Any:
+    """Copy cached rows so callers can decorate them freely"""
+    if isinstance(value, list):
+        return [dict(row) for row in value]
+    if isinstance(value, dict):
+        return dict(value)
+    return value
+
+
+class CatalogCache:
+    """Read-through cache keyed by lookup, invalidated by the catalog version
+    
+    The version lives in app_meta and is bumped in the same transaction as
+    every catalog write, so workers notice each other's writes within
+    CATALOG_VERSION_CHECK seconds. Local writes invalidate immediately.
+    """
+
+    def __init__(self, max_size: int = CATALOG_CACHE_SIZE,
+                 version_check: float = CATALOG_VERSION_CHECK):
+        self.max_size = max_size
+        self.version_check = version_check
+        self.version = 0
+        
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._checked_at = 0.0
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'invalidations': 0,
+        }
+    
+    def _sync_version(self):
+        """Pick up catalog writes committed by other processes"""
+        now = time.monotonic()
+        if now - self._checked_at < self.version_check:
+            return
+        self._checked_at = now
+        self.set_version(db.get_meta('catalog_version'))
+    
+    def current_version(self) -> int:
+        """Catalog version, refreshed from the database when due"""
+        self._sync_version()
+        return self.version
+    
+    def set_version(self, version: int):
+        """Adopt a catalog version, dropping entries if it changed"""
+        with self._lock:
+            if version != self.version:
+                self.version = version
+                self._generation += 1
+                self._entries.clear()
+                self._stats['invalidations'] += 1
+    
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """Return a private copy of the cached value, loading it on a miss"""
+        if self.max_size <= 0:
+            return loader()
+        
+        self._sync_version()
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return _copy(self._entries[key])
+            self._stats['misses'] += 1
+            generation = self._generation
+        
+        value = loader()
+        
+        with self._lock:
+            # Don't store a value read before a concurrent invalidation
+            if generation == self._generation:
+                self._entries[key] = value
+                if len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+                    self._stats['evictions'] += 1
+        return _copy(value)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size"""
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            return {
+                **self._stats,
+                'hit_rate': round(self._stats['hits'] / lookups, 4) if lookups else 0.0,
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'version': self.version,
+            }
+
+
+catalog_cache = CatalogCache()
@@ -5,10 +5,60 @@ All database operations for users, courses, materials, etc.
 from typing import List, Optional, Dict, Any
 from datetime import datetime, date
 from app.models.database import db
+from app.crud.cache import catalog_cache
+from app.crud.leaderboard import rank_index
 import logging
+import threading
 
 logger = logging.getLogger(__name__)
 
+# Users whose streak/last_active was already written today by this process
+_streak_day: Optional[date] = None
+_streak_marked: set = set()
+_streak_lock = threading.Lock()
+
+
+def _streak_written_today(telegram_id: int, today: date) -> bool:
+    """Check the in-process day marker for a user"""
+    global _streak_day
+    with _streak_lock:
+        if _streak_day != today:
+            _streak_day = today
+            _streak_marked.clear()
+        return telegram_id in _streak_marked
+
+
+def _mark_streak_written(telegram_id: int, today: date):
+    with _streak_lock:
+        if _streak_day == today:
+            _streak_marked.add(telegram_id)
+
+
+# Identity map: rows already loaded in the current unit of work
+
+def _identity_get(key) -> Optional[Dict]:
+    uow = db.current_unit_of_work()
+    row = uow.identity.get(key) if uow else None
+    return dict(row) if row else None
+
+
+def _identity_put(key, row: Optional[Dict]):
+    uow = db.current_unit_of_work()
+    if uow and row:
+        uow.identity[key] = dict(row)
+
+
+def _identity_forget(key):
+    uow = db.current_unit_of_work()
+    if uow:
+        uow.identity.pop(key, None)
+
+
+def _catalog_changed(cursor):
+    """Bump the catalog version; drop cached catalog rows once it commits"""
+    version = db.bump_catalog_version(cursor)
+    db.after_commit(lambda: catalog_cache.set_version(version))
+
 
 # ==================== USERS ====================
 
@@ -32,17 +82,70 @@ def create_user(telegram_id: int, username: str = None, full_name: str = None) -
 
 def get_user_by_telegram_id(telegram_id: int) -> Optional[Dict]:
     """Get user by Telegram ID"""
+    cached = _identity_get(('user', telegram_id))
+    if cached:
+        return cached
+    
     try:
         with db.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('SELECT * FROM users WHERE telegram_id = ?', (telegram_id,))
             user = cursor.fetchone()
-            return dict(user) if user else None
+            user = dict(user) if user else None
+            _identity_put(('user', telegram_id), user)
+            return user
     except Exception as e:
         logger.error(f"Error getting user: {e}")
         return None
 
 
+def touch_user(telegram_id: int, username: str = None, full_name: str = None) -> Optional[Dict]:
+    """Get or create user and record today's activity in one statement
+    
+    The streak and last_active are written at most once per user per day in
+    this process; later calls on the same day are a single SELECT.
+    """
+    today = datetime.utcnow().date()
+    try:
+        with db.get_connection() as conn:
+            cursor = conn.cursor()
+            
+            if _streak_written_today(telegram_id, today):
+                cursor.execute('SELECT * FROM users WHERE telegram_id = ?', (telegram_id,))
+                user = cursor.fetchone()
+                if user:
+                    user = dict(user)
+                    _identity_put(('user', telegram_id), user)
+                    return user
+            
+            cursor.execute('''
+                INSERT INTO users (telegram_id, username, full_name)
+                VALUES (?, ?, ?)
+                ON CONFLICT(telegram_id) DO UPDATE SET
+                    streak_days = CASE
+                        WHEN date(last_active) = date('now') THEN streak_days
+                        WHEN date(last_active) = date('now', '-1 day') THEN streak_days + 1
+                        ELSE 1
+                    END,
+                    last_active = CURRENT_TIMESTAMP
+                RETURNING *
+            ''', (telegram_id, username, full_name))
+            rows = cursor.fetchall()
+            
+            user = dict(rows[0]) if rows else None
+            _identity_put(('user', telegram_id), user)
+            db.after_commit(lambda: _mark_streak_written(telegram_id, today))
+            
+            # Streak may have just grown
+            if user and user['streak_days'] > 0:
+                check_and_award_achievements(telegram_id, {'streak'})
+        
+        return user
+    except Exception as e:
+        logger.error(f"Error touching user: {e}")
+        return None
+
+
 def update_user_direction(telegram_id: int, direction_id: int) -> bool:
     """Update user's direction"""
     try:
@@ -52,6 +155,7 @@ def update_user_direction(telegram_id: int, direction_id: int) -> bool:
                 UPDATE users SET direction_id = ?, last_active = CURRENT_TIMESTAMP
                 WHERE telegram_id = ?
             ''', (direction_id, telegram_id))
+            _identity_forget(('user', telegram_id))
             return True
     except Exception as e:
         logger.error(f"Error updating user direction: {e}")
@@ -69,7 +173,13 @@ def update_user_xp(telegram_id: int, xp_points: int) -> bool:
                     level = (xp_points + ?) / 100 + 1,
                     last_active = CURRENT_TIMESTAMP
                 WHERE telegram_id = ?
+                RETURNING id, xp_points
             ''', (xp_points, xp_points, telegram_id))
+            _identity_forget(('user', telegram_id))
+            for row in cursor.fetchall():
+                db.after_commit(
+                    lambda user_id=row['id'], xp=row['xp_points']: rank_index.update(user_id, xp)
+                )
             return True
     except Exception as e:
         logger.error(f"Error updating user XP: {e}")
@@ -107,6 +217,7 @@ def update_user_streak(telegram_id: int) -> int:
                     SET streak_days = ?, last_active = CURRENT_TIMESTAMP
                     WHERE telegram_id = ?
                 ''', (new_streak, telegram_id))
+                _identity_forget(('user', telegram_id))
                 
                 return new_streak
             return 0
@@ -133,6 +244,36 @@ def get_leaderboard(limit: int = 10) -> List[Dict]:
         return []
 
 
+def get_user_rank(user_id: int, around: int = 2) -> Dict:
+    """Get user's exact leaderboard rank and the users ranked next to them"""
+    try:
+        rank = rank_index.rank(user_id)
+        neighbours = rank_index.around(user_id, around)
+        if not neighbours:
+            return {'rank': rank, 'neighbours': []}
+        
+        ranks = {n['id']: n['rank'] for n in neighbours}
+        with db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT id, telegram_id, username, full_name, xp_points, level, streak_days
+                FROM users
+                WHERE id IN ({', '.join('?' * len(ranks))})
+            ''', list(ranks))
+            rows = {row['id']: dict(row) for row in cursor.fetchall()}
+        
+        result = []
+        for n in neighbours:
+            row = rows.get(n['id'])
+            if row:
+                row['rank'] = n['rank']
+                result.append(row)
+        return {'rank': rank, 'neighbours': result}
+    except Exception as e:
+        logger.error(f"Error getting user rank: {e}")
+        return {'rank': None, 'neighbours': []}
+
+
 def get_user_stats(telegram_id: int) -> Optional[Dict]:
     """Get comprehensive user statistics"""
     try:
@@ -147,9 +288,9 @@ def get_user_stats(telegram_id: int) -> Optional[Dict]:
             
             # Completed materials count
             cursor.execute('''
-                SELECT COUNT(*) as completed_count
-                FROM user_progress
-                WHERE user_id = ? AND completed = 1
+                SELECT COALESCE(SUM(completed_materials), 0) as completed_count
+                FROM user_course_progress
+                WHERE user_id = ?
             ''', (user['id'],))
             completed = cursor.fetchone()['completed_count']
             
@@ -185,7 +326,7 @@ def get_user_stats(telegram_id: int) -> Optional[Dict]:
 
 def get_all_directions(active_only: bool = True) -> List[Dict]:
     """Get all directions"""
-    try:
+    def load():
         with db.get_connection() as conn:
             cursor = conn.cursor()
             query = 'SELECT * FROM directions'
@@ -195,11 +336,40 @@ def get_all_directions(active_only: bool = True) -> List[Dict]:
             
             cursor.execute(query)
             return [dict(row) for row in cursor.fetchall()]
+    
+    try:
+        return catalog_cache.get_or_load(('directions', active_only), load)
     except Exception as e:
         logger.error(f"Error getting directions: {e}")
         return []
 
 
+def get_direction_progress(user_id: int) -> Dict[int, Dict]:
+    """Get total and completed material counts per direction for a user
+    
+    Counts only materials of active courses, in a single grouped query.
+    Completed counts come from the user_course_progress counters.
+    """
+    try:
+        with db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT c.direction_id,
+                       SUM((SELECT COUNT(*) FROM materials m WHERE m.course_id = c.id))
+                           as total_materials,
+                       COALESCE(SUM(ucp.completed_materials), 0) as completed_materials
+                FROM courses c
+                LEFT JOIN user_course_progress ucp
+                       ON ucp.course_id = c.id AND ucp.user_id = ?
+                WHERE c.is_active = 1
+                GROUP BY c.direction_id
+            ''', (user_id,))
+            return {row['direction_id']: dict(row) for row in cursor.fetchall()}
+    except Exception as e:
+        logger.error(f"Error getting direction progress: {e}")
+        return {}
+
+
 def create_direction(name: str, description: str = None, icon_url: str = None) -> Optional[int]:
     """Create new direction"""
     try:
@@ -209,7 +379,9 @@ def create_direction(name: str, description: str = None, icon_url: str = None) -
                 INSERT INTO directions (name, description, icon_url)
                 VALUES (?, ?, ?)
             ''', (name, description, icon_url))
-            return cursor.lastrowid
+            new_id = cursor.lastrowid
+            _catalog_changed(cursor)
+            return new_id
     except Exception as e:
         logger.error(f"Error creating direction: {e}")
         return None
@@ -236,6 +408,7 @@ def update_direction(direction_id: int, **kwargs) -> bool:
                 UPDATE directions SET {', '.join(fields)}
                 WHERE id = ?
             ''', values)
+            _catalog_changed(cursor)
             return True
     except Exception as e:
         logger.error(f"Error updating direction: {e}")
@@ -248,6 +421,7 @@ def delete_direction(direction_id: int) -> bool:
         with db.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('DELETE FROM directions WHERE id = ?', (direction_id,))
+            _catalog_changed(cursor)
             return True
     except Exception as e:
         logger.error(f"Error deleting direction: {e}")
@@ -258,7 +432,7 @@ def delete_direction(direction_id: int) -> bool:
 
 def get_courses_by_direction(direction_id: int, active_only: bool = True) -> List[Dict]:
     """Get all courses for a direction"""
-    try:
+    def load():
         with db.get_connection() as conn:
             cursor = conn.cursor()
             query = 'SELECT * FROM courses WHERE direction_id = ?'
@@ -268,6 +442,9 @@ def get_courses_by_direction(direction_id: int, active_only: bool = True) -> Lis
             
             cursor.execute(query, (direction_id,))
             return [dict(row) for row in cursor.fetchall()]
+    
+    try:
+        return catalog_cache.get_or_load(('courses', direction_id, active_only), load)
     except Exception as e:
         logger.error(f"Error getting courses: {e}")
         return []
@@ -275,17 +452,96 @@ def get_courses_by_direction(direction_id: int, active_only: bool = True) -> Lis
 
 def get_course_by_id(course_id: int) -> Optional[Dict]:
     """Get course details"""
-    try:
+    def load():
         with db.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('SELECT * FROM courses WHERE id = ?', (course_id,))
             course = cursor.fetchone()
             return dict(course) if course else None
+    
+    try:
+        return catalog_cache.get_or_load(('course', course_id), load)
     except Exception as e:
         logger.error(f"Error getting course: {e}")
         return None
 
 
+def get_courses_with_progress(direction_id: int, user_id: int) -> List[Dict]:
+    """Get active courses of a direction with the user's material counts"""
+    try:
+        with db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT c.*,
+                       (SELECT COUNT(*) FROM materials m WHERE m.course_id = c.id)
+                           as total_materials,
+                       COALESCE(ucp.completed_materials, 0) as completed_materials
+                FROM courses c
+                LEFT JOIN user_course_progress ucp
+                       ON ucp.course_id = c.id AND ucp.user_id = ?
+                WHERE c.direction_id = ? AND c.is_active = 1
+                ORDER BY c.order_index, c.id
+            ''', (user_id, direction_id))
+            return [dict(row) for row in cursor.fetchall()]
+    except Exception as e:
+        logger.error(f"Error getting courses with progress: {e}")
+        return []
+
+
+def get_course_with_progress(course_id: int, user_id: int) -> Optional[Dict]:
+    """Get course details with its materials and the user's progress on each
+    
+    Course, materials and progress come from one LEFT JOIN. Empty marker
+    columns separate the three column groups in each result row.
+    """
+    try:
+        with db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT c.*, NULL as _material, m.*, NULL as _progress, p.*
+                FROM courses c
+                LEFT JOIN materials m ON m.course_id = c.id
+                LEFT JOIN user_progress p ON p.material_id = m.id AND p.user_id = ?
+                WHERE c.id = ?
+                ORDER BY m.order_index, m.id
+            ''', (user_id, course_id))
+            rows = cursor.fetchall()
+            if not rows:
+                return None
+            
+            names = [col[0] for col in cursor.description]
+            material_at = names.index('_material')
+            progress_at = names.index('_progress')
+            
+            course = dict(zip(names[:material_at], rows[0][:material_at]))
+            materials = []
+            completed = 0
+            for row in rows:
+                if row[material_at + 1] is None:
+                    continue  # course without materials
+                
+                material = dict(zip(names[material_at + 1:progress_at],
+                                    row[material_at + 1:progress_at]))
+                if row[progress_at + 1] is not None:
+                    progress = dict(zip(names[progress_at + 1:], row[progress_at + 1:]))
+                    progress.update(title=material['title'], type=material['type'],
+                                    course_id=material['course_id'])
+                    completed += 1 if progress['completed'] else 0
+                else:
+                    progress = {'completed': False, 'progress_percent': 0, 'last_position': 0}
+                
+                material['progress'] = progress
+                materials.append(material)
+            
+            course['materials'] = materials
+            course['total_materials'] = len(materials)
+            course['completed_materials'] = completed
+            return course
+    except Exception as e:
+        logger.error(f"Error getting course with progress: {e}")
+        return None
+
+
 def create_course(direction_id: int, title: str, language: str, **kwargs) -> Optional[int]:
     """Create new course"""
     try:
@@ -300,7 +556,9 @@ def create_course(direction_id: int, title: str, language: str, **kwargs) -> Opt
                   kwargs.get('description'), kwargs.get('level', 'beginner'),
                   kwargs.get('duration_hours', 0), kwargs.get('thumbnail_url'),
                   kwargs.get('order_index', 0)))
-            return cursor.lastrowid
+            new_id = cursor.lastrowid
+            _catalog_changed(cursor)
+            return new_id
     except Exception as e:
         logger.error(f"Error creating course: {e}")
         return None
@@ -330,6 +588,7 @@ def update_course(course_id: int, **kwargs) -> bool:
                 UPDATE courses SET {', '.join(fields)}
                 WHERE id = ?
             ''', values)
+            _catalog_changed(cursor)
             return True
     except Exception as e:
         logger.error(f"Error updating course: {e}")
@@ -342,6 +601,7 @@ def delete_course(course_id: int) -> bool:
         with db.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('DELETE FROM courses WHERE id = ?', (course_id,))
+            _catalog_changed(cursor)
             return True
     except Exception as e:
         logger.error(f"Error deleting course: {e}")
@@ -352,7 +612,7 @@ def delete_course(course_id: int) -> bool:
 
 def get_materials_by_course(course_id: int) -> List[Dict]:
     """Get all materials for a course"""
-    try:
+    def load():
         with db.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
@@ -361,6 +621,9 @@ def get_materials_by_course(course_id: int) -> List[Dict]:
                 ORDER BY order_index, id
             ''', (course_id,))
             return [dict(row) for row in cursor.fetchall()]
+    
+    try:
+        return catalog_cache.get_or_load(('materials', course_id), load)
     except Exception as e:
         logger.error(f"Error getting materials: {e}")
         return []
@@ -368,12 +631,15 @@ def get_materials_by_course(course_id: int) -> List[Dict]:
 
 def get_material_by_id(material_id: int) -> Optional[Dict]:
     """Get material details"""
-    try:
+    def load():
         with db.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('SELECT * FROM materials WHERE id = ?', (material_id,))
             material = cursor.fetchone()
             return dict(material) if material else None
+    
+    try:
+        return catalog_cache.get_or_load(('material', material_id), load)
     except Exception as e:
         logger.error(f"Error getting material: {e}")
         return None
@@ -394,7 +660,9 @@ def create_material(course_id: int, title: str, type: str, **kwargs) -> Optional
                   kwargs.get('file_size', 0), kwargs.get('duration', 0),
                   kwargs.get('order_index', 0), kwargs.get('is_free', 1),
                   kwargs.get('xp_reward', 10)))
-            return cursor.lastrowid
+            new_id = cursor.lastrowid
+            _catalog_changed(cursor)
+            return new_id
     except Exception as e:
         logger.error(f"Error creating material: {e}")
         return None
@@ -424,6 +692,7 @@ def update_material(material_id: int, **kwargs) -> bool:
                 UPDATE materials SET {', '.join(fields)}
                 WHERE id = ?
             ''', values)
+            _catalog_changed(cursor)
             return True
     except Exception as e:
         logger.error(f"Error updating material: {e}")
@@ -435,7 +704,21 @@ def delete_material(material_id: int) -> bool:
     try:
         with db.get_connection() as conn:
             cursor = conn.cursor()
+            
+            # Completions of this material disappear with it (cascade)
+            cursor.execute('''
+                UPDATE user_course_progress
+                SET completed_materials = completed_materials - 1,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE course_id = (SELECT course_id FROM materials WHERE id = ?)
+                  AND user_id IN (
+                      SELECT user_id FROM user_progress
+                      WHERE material_id = ? AND completed = 1
+                  )
+            ''', (material_id, material_id))
+            
             cursor.execute('DELETE FROM materials WHERE id = ?', (material_id,))
+            _catalog_changed(cursor)
             return True
     except Exception as e:
         logger.error(f"Error deleting material: {e}")
@@ -444,41 +727,193 @@ def delete_material(material_id: int) -> bool:
 
 # ==================== USER PROGRESS ====================
 
+# A NULL progress_percent, completed or last_position leaves the stored
+# value as it is (buffered playback updates never touch completion);
+# completed_at is set when the row becomes completed
+PROGRESS_UPSERT = '''
+    INSERT INTO user_progress 
+    (user_id, material_id, progress_percent, completed, last_position, time_spent,
+     completed_at)
+    VALUES (:user_id, :material_id, COALESCE(:progress_percent, 0), COALESCE(:completed, 0),
+            COALESCE(:last_position, 0), :time_spent,
+            CASE WHEN :completed THEN CURRENT_TIMESTAMP END)
+    ON CONFLICT(user_id, material_id) DO UPDATE SET
+        progress_percent = COALESCE(:progress_percent, progress_percent),
+        completed = COALESCE(:completed, completed),
+        last_position = COALESCE(:last_position, last_position),
+        time_spent = time_spent + excluded.time_spent,
+        completed_at = CASE WHEN :completed AND NOT completed
+                       THEN CURRENT_TIMESTAMP ELSE completed_at END,
+        updated_at = CURRENT_TIMESTAMP
+'''
+
 def update_progress(telegram_id: int, material_id: int, progress_percent: int = 0,
                     completed: bool = False, last_position: int = 0, 
-                    time_spent: int = 0) -> bool:
-    """Update user's progress on a material"""
+                    time_spent: int = 0) -> Optional[Dict]:
+    """Update user's progress on a material
+    
+    A new completion awards its XP and any lesson achievements it unlocks
+    in the same transaction. Returns {'newly_completed': bool,
+    'new_achievements': [...]} on success, None on failure.
+    """
     try:
         user = get_user_by_telegram_id(telegram_id)
         if not user:
-            return False
+            return None
         
         with db.get_connection() as conn:
+            # was_completed decides the counter delta and XP
+            db.lock_for_write(conn)
             cursor = conn.cursor()
             cursor.execute('''
-                INSERT INTO user_progress 
-                (user_id, material_id, progress_percent, completed, last_position, time_spent)
-                VALUES (?, ?, ?, ?, ?, ?)
-                ON CONFLICT(user_id, material_id) DO UPDATE SET
-                    progress_percent = excluded.progress_percent,
-                    completed = excluded.completed,
-                    last_position = excluded.last_position,
-                    time_spent = time_spent + excluded.time_spent,
-                    completed_at = CASE WHEN excluded.completed = 1 
-                                   THEN CURRENT_TIMESTAMP ELSE completed_at END,
-                    updated_at = CURRENT_TIMESTAMP
-            ''', (user['id'], material_id, progress_percent, completed, last_position, time_spent))
+                SELECT completed FROM user_progress
+                WHERE user_id = ? AND material_id = ?
+            ''', (user['id'], material_id))
+            previous = cursor.fetchone()
+            was_completed = bool(previous['completed']) if previous else False
+            
+            cursor.execute(PROGRESS_UPSERT, {
+                'user_id': user['id'],
+                'material_id': material_id,
+                'progress_percent': progress_percent,
+                'completed': bool(completed),
+                'last_position': last_position,
+                'time_spent': time_spent,
+            })
             
-            # Award XP if completed
-            if completed:
+            # Lets clients revalidate cached progress views (ETag)
+            cursor.execute('''
+                UPDATE users SET progress_version = progress_version + 1
+                WHERE id = ?
+            ''', (user['id'],))
+            _identity_forget(('user', telegram_id))
+            
+            # Keep the per-course counter in step with completion flips
+            if bool(completed) != was_completed:
+                cursor.execute('''
+                    INSERT INTO user_course_progress (user_id, course_id, completed_materials)
+                    SELECT ?, course_id, ? FROM materials WHERE id = ?
+                    ON CONFLICT(user_id, course_id) DO UPDATE SET
+                        completed_materials = completed_materials + excluded.completed_materials,
+                        updated_at = CURRENT_TIMESTAMP
+                ''', (user['id'], 1 if completed else -1, material_id))
+            
+            # Award XP when the material becomes completed
+            newly_completed = bool(completed) and not was_completed
+            new_achievements = []
+            if newly_completed:
                 material = get_material_by_id(material_id)
                 if material:
                     update_user_xp(telegram_id, material['xp_reward'])
+                new_achievements = check_and_award_achievements(telegram_id, {'completion'})
             
-            return True
+            return {'newly_completed': newly_completed, 'new_achievements': new_achievements}
     except Exception as e:
         logger.error(f"Error updating progress: {e}")
-        return False
+        return None
+
+
+def update_progress_batch(telegram_id: int, updates: List[Dict]) -> Optional[Dict]:
+    """Apply queued progress updates in one transaction
+    
+    Updates are applied in client_ts order (array order breaks ties), so
+    the result matches sending them one by one: the latest position wins
+    and time_spent accumulates. Updates for unknown materials are skipped;
+    fields set to None keep their stored value (see PROGRESS_UPSERT).
+    
+    Returns {'applied', 'skipped', 'newly_completed', 'new_achievements'}
+    on success, None on failure; like update_progress, completions award
+    their XP and achievements in the same transaction.
+    """
+    try:
+        user = get_user_by_telegram_id(telegram_id)
+        if not user:
+            return None
+        
+        updates = sorted(updates, key=lambda u: u.get('client_ts') or 0)
+        material_ids = sorted({u['material_id'] for u in updates})
+        placeholders = ','.join('?' * len(material_ids))
+        
+        with db.get_connection() as conn:
+            # was_completed decides the counter deltas and XP
+            db.lock_for_write(conn)
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT id, course_id, xp_reward FROM materials
+                WHERE id IN ({placeholders})
+            ''', material_ids)
+            materials = {row['id']: row for row in cursor.fetchall()}
+            
+            cursor.execute(f'''
+                SELECT material_id, completed FROM user_progress
+                WHERE user_id = ? AND material_id IN ({placeholders})
+            ''', [user['id']] + material_ids)
+            was_completed = {row['material_id']: bool(row['completed'])
+                             for row in cursor.fetchall()}
+            
+            rows = []
+            completed = {}
+            for u in updates:
+                if u['material_id'] not in materials:
+                    continue
+                done = u.get('completed')
+                rows.append({
+                    'user_id': user['id'],
+                    'material_id': u['material_id'],
+                    'progress_percent': u.get('progress_percent', 0),
+                    'completed': None if done is None else bool(done),
+                    'last_position': u.get('last_position', 0),
+                    'time_spent': u.get('time_spent', 0),
+                })
+                if done is not None:
+                    completed[u['material_id']] = bool(done)
+            
+            if rows:
+                cursor.executemany(PROGRESS_UPSERT, rows)
+                
+                cursor.execute('''
+                    UPDATE users SET progress_version = progress_version + 1
+                    WHERE id = ?
+                ''', (user['id'],))
+                _identity_forget(('user', telegram_id))
+            
+            # Net completion flips per course, from before to after the batch
+            course_deltas = {}
+            newly_completed = []
+            for material_id, done in completed.items():
+                before = was_completed.get(material_id, False)
+                if done == before:
+                    continue
+                course_id = materials[material_id]['course_id']
+                course_deltas[course_id] = course_deltas.get(course_id, 0) + (1 if done else -1)
+                if done:
+                    newly_completed.append(material_id)
+            
+            if course_deltas:
+                cursor.executemany('''
+                    INSERT INTO user_course_progress (user_id, course_id, completed_materials)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT(user_id, course_id) DO UPDATE SET
+                        completed_materials = completed_materials + excluded.completed_materials,
+                        updated_at = CURRENT_TIMESTAMP
+                ''', [(user['id'], course_id, delta)
+                      for course_id, delta in course_deltas.items() if delta])
+            
+            xp = sum(materials[m]['xp_reward'] or 0 for m in newly_completed)
+            if xp:
+                update_user_xp(telegram_id, xp)
+            new_achievements = (check_and_award_achievements(telegram_id, {'completion'})
+                                if newly_completed else [])
+            
+            return {
+                'applied': len(rows),
+                'skipped': [m for m in material_ids if m not in materials],
+                'newly_completed': newly_completed,
+                'new_achievements': new_achievements
+            }
+    except Exception as e:
+        logger.error(f"Error updating progress batch: {e}")
+        return None
 
 
 def get_user_progress(telegram_id: int, course_id: int = None) -> List[Dict]:
@@ -578,62 +1013,82 @@ def get_user_favorites(telegram_id: int) -> List[Dict]:
 
 # ==================== ACHIEVEMENTS ====================
 
-def check_and_award_achievements(telegram_id: int) -> List[Dict]:
-    """Check and award achievements to user"""
-    user = get_user_by_telegram_id(telegram_id)
-    if not user:
-        return []
+# Events that can change the outcome of each achievement condition type
+ACHIEVEMENT_EVENTS = {
+    'complete_first': {'completion'},
+    'complete_lessons': {'completion'},
+    'streak': {'streak'},
+}
+
+# Achievement rules, loaded once per process from the achievements table.
+# Only migrations write that table, and they run before the first query;
+# rules changed by hand take effect on restart.
+_achievement_rules: Optional[List[Dict]] = None
+
+
+def _get_achievement_rules(cursor) -> List[Dict]:
+    global _achievement_rules
+    if _achievement_rules is None:
+        cursor.execute('SELECT * FROM achievements ORDER BY id')
+        _achievement_rules = [dict(row) for row in cursor.fetchall()]
+    return _achievement_rules
+
+
+def check_and_award_achievements(telegram_id: int, events: set = None) -> List[Dict]:
+    """Check and award achievements to user
     
+    Only rules whose condition can be affected by one of `events` (see
+    ACHIEVEMENT_EVENTS) are evaluated; None evaluates every rule. Counters
+    are gathered in one query, and awards plus XP go in one transaction.
+    """
     awarded = []
     
     try:
         with db.get_connection() as conn:
             cursor = conn.cursor()
             
-            # Get all achievements not yet unlocked
+            rules = [
+                rule for rule in _get_achievement_rules(cursor)
+                if events is None or ACHIEVEMENT_EVENTS.get(rule['condition_type'], set()) & events
+            ]
+            if not rules:
+                return []
+            
             cursor.execute('''
-                SELECT a.* FROM achievements a
-                WHERE NOT EXISTS (
-                    SELECT 1 FROM user_achievements ua
-                    WHERE ua.user_id = ? AND ua.achievement_id = a.id
-                )
-            ''', (user['id'],))
+                SELECT u.id, u.streak_days,
+                       (SELECT COALESCE(SUM(completed_materials), 0)
+                        FROM user_course_progress WHERE user_id = u.id) as completed_count,
+                       (SELECT group_concat(achievement_id)
+                        FROM user_achievements WHERE user_id = u.id) as unlocked
+                FROM users u
+                WHERE u.telegram_id = ?
+            ''', (telegram_id,))
+            user = cursor.fetchone()
+            if not user:
+                return []
+            
+            unlocked = {int(a) for a in (user['unlocked'] or '').split(',') if a}
+            counters = {
+                'complete_first': user['completed_count'],
+                'complete_lessons': user['completed_count'],
+                'streak': user['streak_days'],
+            }
             
-            achievements = cursor.fetchall()
+            for rule in rules:
+                if rule['id'] in unlocked or rule['condition_type'] not in counters:
+                    continue
+                if counters[rule['condition_type']] >= (rule['condition_value'] or 1):
+                    awarded.append(dict(rule))
             
-            for ach in achievements:
-                should_award = False
-                
-                if ach['condition_type'] == 'complete_first':
-                    cursor.execute('''
-                        SELECT COUNT(*) as count FROM user_progress
-                        WHERE user_id = ? AND completed = 1
-                    ''', (user['id'],))
-                    count = cursor.fetchone()['count']
-                    should_award = count >= 1
-                
-                elif ach['condition_type'] == 'complete_lessons':
-                    cursor.execute('''
-                        SELECT COUNT(*) as count FROM user_progress
-                        WHERE user_id = ? AND completed = 1
-                    ''', (user['id'],))
-                    count = cursor.fetchone()['count']
-                    should_award = count >= ach['condition_value']
-                
-                elif ach['condition_type'] == 'streak':
-                    should_award = user['streak_days'] >= ach['condition_value']
+            if awarded:
+                cursor.executemany('''
+                    INSERT OR IGNORE INTO user_achievements 
+                    (user_id, achievement_id)
+                    VALUES (?, ?)
+                ''', [(user['id'], ach['id']) for ach in awarded])
                 
-                if should_award:
-                    cursor.execute('''
-                        INSERT OR IGNORE INTO user_achievements 
-                        (user_id, achievement_id)
-                        VALUES (?, ?)
-                    ''', (user['id'], ach['id']))
-                    
-                    # Award XP
-                    update_user_xp(telegram_id, ach['xp_reward'])
-                    
-                    awarded.append(dict(ach))
+                # Award XP
+                update_user_xp(telegram_id, sum(ach['xp_reward'] for ach in awarded))
         
         return awarded
     except Exception as e:
@@ -681,8 +1136,159 @@ def log_analytics_event(telegram_id: int, event_type: str, event_data: str = Non
         logger.error(f"Error logging analytics: {e}")
 
 
+def log_analytics_events(events: List[tuple]) -> int:
+    """Insert buffered analytics events in one transaction
+    
+    Each event is (user_id, event_type, event_data, created_at).
+    """
+    if not events:
+        return 0
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany('''
+            INSERT INTO analytics_events (user_id, event_type, event_data, created_at)
+            VALUES (?, ?, ?, ?)
+        ''', events)
+        return len(events)
+
+
+def rollup_analytics(batch_size: int = 10000) -> Dict[str, int]:
+    """Fold new analytics_events rows into analytics_daily
+    
+    Works in id order from the stored watermark, one transaction per
+    chunk, so an interrupted run resumes where it stopped.
+    """
+    chunks = 0
+    events = 0
+    while True:
+        with db.get_connection() as conn:
+            cursor = conn.cursor()
+            
+            # Take the write lock first so concurrent workers can't fold the same chunk
+            cursor.execute('''
+                UPDATE app_meta SET value = value WHERE key = 'analytics_rollup_watermark'
+            ''')
+            cursor.execute('''
+                SELECT value FROM app_meta WHERE key = 'analytics_rollup_watermark'
+            ''')
+            watermark = cursor.fetchone()['value']
+            
+            cursor.execute('''
+                SELECT MAX(id) as upper, COUNT(*) as count FROM (
+                    SELECT id FROM analytics_events
+                    WHERE id > ?
+                    ORDER BY id
+                    LIMIT ?
+                )
+            ''', (watermark, batch_size))
+            chunk = cursor.fetchone()
+            if not chunk['count']:
+                break
+            
+            cursor.execute('''
+                INSERT INTO analytics_daily (day, event_type, material_id, direction_id, events)
+                SELECT date(e.created_at), e.event_type, e.material_id,
+                       COALESCE(c.direction_id, 0), COUNT(*)
+                FROM (
+                    SELECT created_at, event_type,
+                           CASE WHEN event_data LIKE 'material_id:%'
+                                THEN CAST(substr(event_data, 13) AS INTEGER)
+                                ELSE 0 END as material_id
+                    FROM analytics_events
+                    WHERE id > ? AND id <= ?
+                ) e
+                LEFT JOIN materials m ON m.id = e.material_id
+                LEFT JOIN courses c ON c.id = m.course_id
+                WHERE 1
+                GROUP BY 1, 2, 3, 4
+                ON CONFLICT(day, event_type, material_id, direction_id) DO UPDATE SET
+                    events = events + excluded.events
+            ''', (watermark, chunk['upper']))
+            
+            cursor.execute('''
+                UPDATE app_meta SET value = ? WHERE key = 'analytics_rollup_watermark'
+            ''', (chunk['upper'],))
+            
+            chunks += 1
+            events += chunk['count']
+    
+    return {'chunks': chunks, 'events': events}
+
+
+def purge_analytics_events(retention_days: int, batch_size: int = 5000) -> int:
+    """Delete raw events older than the retention window that are already rolled up"""
+    deleted = 0
+    while True:
+        with db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                DELETE FROM analytics_events
+                WHERE id IN (
+                    SELECT id FROM analytics_events
+                    WHERE id <= (SELECT value FROM app_meta
+                                 WHERE key = 'analytics_rollup_watermark')
+                      AND created_at < datetime('now', ?)
+                    ORDER BY id
+                    LIMIT ?
+                )
+            ''', (f'-{int(retention_days)} days', batch_size))
+            if cursor.rowcount <= 0:
+                return deleted
+            deleted += cursor.rowcount
+
+
+def get_analytics_summary(days: int = 30) -> Dict:
+    """Analytics for the admin dashboard, read from the daily rollups"""
+    try:
+        with db.get_connection() as conn:
+            cursor = conn.cursor()
+            since = f'-{int(days)} days'
+            
+            cursor.execute('''
+                SELECT day, event_type, SUM(events) as events
+                FROM analytics_daily
+                WHERE day >= date('now', ?)
+                GROUP BY day, event_type
+                ORDER BY day
+            ''', (since,))
+            daily = [dict(row) for row in cursor.fetchall()]
+            
+            cursor.execute('''
+                SELECT a.material_id, m.title, SUM(a.events) as views
+                FROM analytics_daily a
+                LEFT JOIN materials m ON m.id = a.material_id
+                WHERE a.day >= date('now', ?)
+                  AND a.event_type = 'material_view' AND a.material_id != 0
+                GROUP BY a.material_id
+                ORDER BY views DESC
+                LIMIT 10
+            ''', (since,))
+            top_materials = [dict(row) for row in cursor.fetchall()]
+            
+            cursor.execute('''
+                SELECT a.direction_id, d.name, SUM(a.events) as views
+                FROM analytics_daily a
+                LEFT JOIN directions d ON d.id = a.direction_id
+                WHERE a.day >= date('now', ?)
+                  AND a.event_type = 'material_view' AND a.direction_id != 0
+                GROUP BY a.direction_id
+                ORDER BY views DESC
+            ''', (since,))
+            directions = [dict(row) for row in cursor.fetchall()]
+            
+            return {
+                'days': days,
+                'daily': daily,
+                'top_materials': top_materials,
+                'directions': directions
+            }
+    except Exception as e:
+        logger.error(f"Error getting analytics summary: {e}")
+        return {}
+
+
 def get_admin_stats() -> Dict:
-    """Get statistics for admin dashboard"""
+    """Compute statistics for admin dashboard (served via app.crud.stats)"""
     try:
         with db.get_connection() as conn:
             cursor = conn.cursor()
@@ -691,10 +1297,11 @@ def get_admin_stats() -> Dict:
             cursor.execute('SELECT COUNT(*) as count FROM users')
             total_users = cursor.fetchone()['count']
             
-            # Active users (last 7 days)
+            # Active users (last 7 days); compares the raw column so
+            # idx_users_last_active can serve it
             cursor.execute('''
                 SELECT COUNT(*) as count FROM users
-                WHERE date(last_active) >= date('now', '-7 days')
+                WHERE last_active >= date('now', '-7 days')
             ''')
             active_users = cursor.fetchone()['count']
             
@@ -704,7 +1311,8 @@ def get_admin_stats() -> Dict:
             
             # Total completions
             cursor.execute('''
-                SELECT COUNT(*) as count FROM user_progress WHERE completed = 1
+                SELECT COALESCE(SUM(completed_materials), 0) as count
+                FROM user_course_progress
             ''')
             total_completions = cursor.fetchone()['count']
             
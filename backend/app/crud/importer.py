@@ -0,0 +1,419 @@
+"""
+Bulk content import for Oriental Mini App
+Loads directions, courses and materials from JSON, JSON Lines or CSV in
+chunked transactions, upserting by natural key
+"""
+import csv
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, IO, Iterator, List, Optional, Tuple
+
+from app.crud.cache import catalog_cache
+from app.models.database import db, UnitOfWork
+
+logger = logging.getLogger(__name__)
+
+# Rows written per transaction
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+# Validation errors kept in the report
+MAX_IMPORT_ERRORS = 100
+
+MATERIAL_TYPES = ('video', 'audio', 'pdf', 'text', 'quiz')
+IMPORT_FORMATS = ('json', 'jsonl', 'csv')
+
+DIRECTION_FIELDS = ('description', 'icon_url', 'order_index', 'is_active')
+COURSE_FIELDS = ('language', 'description', 'level', 'duration_hours',
+                 'thumbnail_url', 'order_index', 'is_active')
+MATERIAL_FIELDS = ('type', 'description', 'file_id', 'file_url', 'file_size',
+                   'duration', 'order_index', 'is_free', 'xp_reward')
+INTEGER_FIELDS = {'order_index', 'is_active', 'duration_hours', 'file_size',
+                  'duration', 'is_free', 'xp_reward'}
+
+# Flat (CSV / JSON Lines) column -> (level, field)
+FLAT_COLUMNS = {
+    'direction': ('direction', 'name'),
+    'direction_description': ('direction', 'description'),
+    'direction_icon_url': ('direction', 'icon_url'),
+    'direction_order_index': ('direction', 'order_index'),
+    'course': ('course', 'title'),
+    'language': ('course', 'language'),
+    'level': ('course', 'level'),
+    'course_description': ('course', 'description'),
+    'duration_hours': ('course', 'duration_hours'),
+    'thumbnail_url': ('course', 'thumbnail_url'),
+    'course_order_index': ('course', 'order_index'),
+    'material': ('material', 'title'),
+    'type': ('material', 'type'),
+    'description': ('material', 'description'),
+    'file_id': ('material', 'file_id'),
+    'file_url': ('material', 'file_url'),
+    'file_size': ('material', 'file_size'),
+    'duration': ('material', 'duration'),
+    'order_index': ('material', 'order_index'),
+    'is_free': ('material', 'is_free'),
+    'xp_reward': ('material', 'xp_reward'),
+}
+
+Row = Dict[str, Optional[Dict[str, Any]]]
+
+
+class ContentRowError(ValueError):
+    """A content row that can't be imported"""
+
+
+# ==================== PARSING ====================
+
+def _flat_row(record: Dict[str, Any]) -> Row:
+    row: Row = {'direction': {}, 'course': {}, 'material': {}}
+    for column, value in record.items():
+        if column in FLAT_COLUMNS and value not in (None, ''):
+            level, field = FLAT_COLUMNS[column]
+            row[level][field] = value
+    return {level: fields or None for level, fields in row.items()}
+
+
+def _read_csv(stream: IO[str]) -> Iterator[Row]:
+    for record in csv.DictReader(stream):
+        yield _flat_row(record)
+
+
+def _read_jsonl(stream: IO[str]) -> Iterator[Row]:
+    for line in stream:
+        if line.strip():
+            yield _flat_row(json.loads(line))
+
+
+def _read_json(stream: IO[str]) -> Iterator[Row]:
+    """Flatten {"directions": [{..., "courses": [{..., "materials": [...]}]}]}"""
+    tree = json.load(stream)
+    directions = tree.get('directions', []) if isinstance(tree, dict) else tree
+    for direction in directions:
+        courses = direction.get('courses') or []
+        direction = {k: v for k, v in direction.items() if k != 'courses'}
+        if not courses:
+            yield {'direction': direction, 'course': None, 'material': None}
+        for course in courses:
+            materials = course.get('materials') or []
+            course = {k: v for k, v in course.items() if k != 'materials'}
+            if not materials:
+                yield {'direction': direction, 'course': course, 'material': None}
+            for material in materials:
+                yield {'direction': direction, 'course': course, 'material': material}
+
+
+_READERS = {
+    'json': _read_json,
+    'jsonl': _read_jsonl,
+    'csv': _read_csv,
+}
+
+
+def detect_format(filename: str) -> Optional[str]:
+    """Import format from a file name's extension"""
+    extension = os.path.splitext(filename or '')[1].lower().lstrip('.')
+    if extension == 'ndjson':
+        return 'jsonl'
+    return extension if extension in IMPORT_FORMATS else None
+
+
+# ==================== VALIDATION ====================
+
+def _pick(fields: Dict[str, Any], allowed: Tuple[str, ...]) -> Dict[str, Any]:
+    values = {}
+    for field in allowed:
+        value = fields.get(field)
+        if value in (None, ''):
+            continue
+        if field in INTEGER_FIELDS:
+            if isinstance(value, bool):
+                value = int(value)
+            elif isinstance(value, str) and value.lower() in ('true', 'false'):
+                value = int(value.lower() == 'true')
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                raise ContentRowError(f"{field} must be an integer")
+        values[field] = value
+    return values
+
+
+def validate_row(row: Row) -> Row:
+    """Normalise a parsed row, raising ContentRowError if it is incomplete"""
+    direction = row.get('direction') or {}
+    course = row.get('course')
+    material = row.get('material')
+    
+    name = str(direction.get('name') or '').strip()
+    if not name:
+        raise ContentRowError("direction name is required")
+    result: Row = {
+        'direction': {'name': name, **_pick(direction, DIRECTION_FIELDS)},
+        'course': None,
+        'material': None,
+    }
+    
+    if course is None:
+        if material is not None:
+            raise ContentRowError("material without a course")
+        return result
+    
+    title = str(course.get('title') or '').strip()
+    if not title:
+        raise ContentRowError("course title is required")
+    result['course'] = {'title': title, **_pick(course, COURSE_FIELDS)}
+    
+    if material is not None:
+        title = str(material.get('title') or '').strip()
+        if not title:
+            raise ContentRowError("material title is required")
+        fields = _pick(material, MATERIAL_FIELDS)
+        if fields.get('type') is not None and fields['type'] not in MATERIAL_TYPES:
+            raise ContentRowError(f"unknown material type '{fields['type']}'")
+        result['material'] = {'title': title, **fields}
+    
+    return result
+
+
+# ==================== WRITING ====================
+
+class ContentImporter:
+    """Upserts content rows by natural key
+    
+    Directions are matched by name, courses by (direction, title) and
+    materials by (course, title). Matched rows only get the fields present
+    in the import; new courses need a language and new materials a type.
+    """
+    
+    def __init__(self, batch_size: int = IMPORT_BATCH_SIZE, dry_run: bool = False):
+        self.batch_size = max(1, batch_size)
+        self.dry_run = dry_run
+        
+        self.directions: Dict[str, int] = {}
+        self.courses: Dict[Tuple[int, str], int] = {}
+        self.materials: Dict[Tuple[int, str], int] = {}
+        self.report: Dict[str, Any] = {
+            'rows': 0,
+            'skipped': 0,
+            'errors': [],
+            'dry_run': dry_run,
+        }
+        # Natural keys created / updated per table, so rows repeated across
+        # chunks are counted once
+        self._touched = {table: (set(), set())
+                         for table in ('directions', 'courses', 'materials')}
+    
+    def _error(self, line: int, message: str):
+        self.report['skipped'] += 1
+        if len(self.report['errors']) < MAX_IMPORT_ERRORS:
+            self.report['errors'].append({'row': line, 'error': message})
+    
+    def _load_keys(self, cursor):
+        cursor.execute('SELECT id, name FROM directions')
+        self.directions = {row['name']: row['id'] for row in cursor.fetchall()}
+        cursor.execute('SELECT id, direction_id, title FROM courses')
+        self.courses = {(row['direction_id'], row['title']): row['id']
+                        for row in cursor.fetchall()}
+        cursor.execute('SELECT id, course_id, title FROM materials')
+        self.materials = {(row['course_id'], row['title']): row['id']
+                          for row in cursor.fetchall()}
+    
+    @staticmethod
+    def _updates(table: str, fields: Tuple[str, ...], items: List[Tuple[int, Dict]]):
+        """UPDATE statement and parameters that keep columns missing from the row"""
+        sql = f'''
+            UPDATE {table} SET {', '.join(f"{f} = COALESCE(?, {f})" for f in fields)}
+            WHERE id = ?
+        '''
+        return sql, [tuple(values.get(f) for f in fields) + (row_id,)
+                     for row_id, values in items]
+    
+    def _write_directions(self, cursor, rows: List[Row]):
+        new, existing = {}, {}
+        for row in rows:
+            direction = row['direction']
+            target = existing if direction['name'] in self.directions else new
+            target.setdefault(direction['name'], {}).update(direction)
+        
+        if new:
+            cursor.executemany(f'''
+                INSERT INTO directions (name, {', '.join(DIRECTION_FIELDS)})
+                VALUES (?, ?, ?, COALESCE(?, 0), COALESCE(?, 1))
+            ''', [(d['name'],) + tuple(d.get(f) for f in DIRECTION_FIELDS)
+                  for d in new.values()])
+            placeholders = ','.join('?' * len(new))
+            cursor.execute(f'SELECT id, name FROM directions WHERE name IN ({placeholders})',
+                           list(new))
+            self.directions.update({row['name']: row['id'] for row in cursor.fetchall()})
+        if existing:
+            cursor.executemany(*self._updates('directions', DIRECTION_FIELDS, [
+                (self.directions[name], values) for name, values in existing.items()
+            ]))
+        
+        self._touched['directions'][0].update(new)
+        self._touched['directions'][1].update(existing)
+    
+    def _write_courses(self, cursor, rows: List[Tuple[int, Row]]):
+        new, existing = {}, {}
+        for line, row in rows:
+            key = (self.directions[row['direction']['name']], row['course']['title'])
+            if key in self.courses:
+                existing.setdefault(key, {}).update(row['course'])
+            elif key in new or row['course'].get('language'):
+                new.setdefault(key, {}).update(row['course'])
+            else:
+                self._error(line, "new course needs a language")
+        
+        if new:
+            cursor.executemany(f'''
+                INSERT INTO courses (direction_id, title, {', '.join(COURSE_FIELDS)})
+                VALUES (?, ?, ?, ?, COALESCE(?, 'beginner'), COALESCE(?, 0), ?,
+                        COALESCE(?, 0), COALESCE(?, 1))
+            ''', [key + tuple(c.get(f) for f in COURSE_FIELDS) for key, c in new.items()])
+            direction_ids = sorted({key[0] for key in new})
+            placeholders = ','.join('?' * len(direction_ids))
+            cursor.execute(f'''
+                SELECT id, direction_id, title FROM courses
+                WHERE direction_id IN ({placeholders})
+            ''', direction_ids)
+            self.courses.update({(row['direction_id'], row['title']): row['id']
+                                 for row in cursor.fetchall()})
+        if existing:
+            cursor.executemany(*self._updates('courses', COURSE_FIELDS, [
+                (self.courses[key], values) for key, values in existing.items()
+            ]))
+        
+        self._touched['courses'][0].update(new)
+        self._touched['courses'][1].update(existing)
+    
+    def _write_materials(self, cursor, rows: List[Tuple[int, Row]]):
+        new, existing = {}, {}
+        for line, row in rows:
+            course_key = (self.directions[row['direction']['name']], row['course']['title'])
+            if course_key not in self.courses:
+                continue  # the course itself was rejected
+            key = (self.courses[course_key], row['material']['title'])
+            if key in self.materials:
+                existing.setdefault(key, {}).update(row['material'])
+            elif key in new or row['material'].get('type'):
+                new.setdefault(key, {}).update(row['material'])
+            else:
+                self._error(line, "new material needs a type")
+        
+        if new:
+            cursor.executemany(f'''
+                INSERT INTO materials (course_id, title, {', '.join(MATERIAL_FIELDS)})
+                VALUES (?, ?, ?, ?, ?, ?, COALESCE(?, 0), COALESCE(?, 0),
+                        COALESCE(?, 0), COALESCE(?, 1), COALESCE(?, 10))
+            ''', [key + tuple(m.get(f) for f in MATERIAL_FIELDS) for key, m in new.items()])
+            course_ids = sorted({key[0] for key in new})
+            placeholders = ','.join('?' * len(course_ids))
+            cursor.execute(f'''
+                SELECT id, course_id, title FROM materials
+                WHERE course_id IN ({placeholders})
+            ''', course_ids)
+            self.materials.update({(row['course_id'], row['title']): row['id']
+                                   for row in cursor.fetchall()})
+        if existing:
+            cursor.executemany(*self._updates('materials', MATERIAL_FIELDS, [
+                (self.materials[key], values) for key, values in existing.items()
+            ]))
+        
+        self._touched['materials'][0].update(new)
+        self._touched['materials'][1].update(existing)
+    
+    def _write_chunk(self, cursor, chunk: List[Tuple[int, Row]]):
+        self._write_directions(cursor, [row for _, row in chunk])
+        self._write_courses(cursor, [(line, row) for line, row in chunk if row['course']])
+        self._write_materials(cursor, [(line, row) for line, row in chunk if row['material']])
+        
+        version = db.bump_catalog_version(cursor)
+        db.after_commit(lambda: catalog_cache.set_version(version))
+    
+    def run(self, rows: Iterator[Row]) -> Dict[str, Any]:
+        """Validate and write rows in chunks of batch_size
+        
+        Each chunk commits on its own, unless this is a dry run: then
+        everything runs in one transaction that is rolled back, so the
+        report shows what the import would do.
+        """
+        started = time.monotonic()
+        chunk: List[Tuple[int, Row]] = []
+        
+        # Inside a request the import continues its unit of work (and its
+        # connection); a second connection would wait on the request's own
+        # write lock. What the caller wrote so far is committed first.
+        uow = db.current_unit_of_work()
+        token = None
+        if uow is None:
+            uow = UnitOfWork(db.pool)
+            token = db.bind_unit_of_work(uow)
+        else:
+            uow.commit()
+        
+        try:
+            self._load_keys(uow.connection().cursor())
+            
+            line = 0
+            rows = iter(rows)
+            while True:
+                try:
+                    raw = next(rows)
+                except StopIteration:
+                    break
+                except (ValueError, TypeError, AttributeError, csv.Error) as e:
+                    # Malformed input can't be resynchronised, so stop here
+                    self._error(line + 1, f"parse error: {e}")
+                    break
+                line += 1
+                self.report['rows'] += 1
+                
+                try:
+                    chunk.append((line, validate_row(raw)))
+                except ContentRowError as e:
+                    self._error(line, str(e))
+                    continue
+                
+                if len(chunk) >= self.batch_size:
+                    self._write_chunk(uow.connection().cursor(), chunk)
+                    chunk = []
+                    if not self.dry_run:
+                        uow.commit()
+            
+            if chunk:
+                self._write_chunk(uow.connection().cursor(), chunk)
+            if self.dry_run:
+                uow.rollback()
+            else:
+                uow.commit()
+        except BaseException:
+            uow.rollback()
+            raise
+        finally:
+            if token is not None:
+                db.unbind_unit_of_work(token)
+                uow.complete(commit=False)
+        
+        for table, (created, updated) in self._touched.items():
+            self.report[table] = {
+                'created': len(created),
+                'updated': len(updated - created),
+            }
+        self.report['seconds'] = round(time.monotonic() - started, 3)
+        return self.report
+
+
+def import_content(stream: IO[str], format: str, dry_run: bool = False,
+                   batch_size: int = IMPORT_BATCH_SIZE) -> Dict[str, Any]:
+    """Import a content file; returns counts of created/updated rows and errors"""
+    if format not in _READERS:
+        raise ValueError(f"Unsupported import format: {format}")
+    importer = ContentImporter(batch_size=batch_size, dry_run=dry_run)
+    report = importer.run(_READERS[format](stream))
+    logger.info(
+        f"{'Dry-run import' if dry_run else 'Imported'} {report['rows']} rows: "
+        f"{report['materials']['created']} materials created, "
+        f"{report['materials']['updated']} updated, {report['skipped']} skipped"
+    )
+    return report
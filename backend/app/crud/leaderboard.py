@@ -0,0 +1,131 @@
+"""
+Leaderboard rank index for Oriental Mini App
+In-memory order-statistics over users' XP for exact rank lookups
+"""
+import bisect
+import logging
+import os
+import threading
+import time
+from array import array
+from typing import Dict, List, Optional
+
+from app.models.database import db
+
+logger = logging.getLogger(__name__)
+
+# How often (seconds) to reload from the database to pick up XP awarded
+# by other workers. Writes made by this worker are applied immediately.
+LEADERBOARD_RESYNC = float(os.getenv("LEADERBOARD_RESYNC", "60"))
+
+# Most neighbours returned on each side of a user; they are fetched with
+# one bound variable each
+LEADERBOARD_MAX_AROUND = 50
+
+# Keys pack (xp descending, user id ascending) into one sortable integer
+_XP_LIMIT = 1 << 30
+_ID_BITS = 32
+
+
+def _key(xp: int, user_id: int) -> int:
+    return ((_XP_LIMIT - min(xp, _XP_LIMIT - 1)) << _ID_BITS) | user_id
+
+
+def _user_id(key: int) -> int:
+    return key & ((1 << _ID_BITS) - 1)
+
+
+class RankIndex:
+    """Sorted array of users with XP, ranked like the leaderboard
+
+    Rank is 1 + the number of users with strictly more XP, so ties share a
+    rank. Only users with xp_points > 0 are indexed, matching
+    get_leaderboard; everyone else ranks just after them.
+    """
+
+    def __init__(self, resync_interval: float = LEADERBOARD_RESYNC):
+        self.resync_interval = resync_interval
+        self._keys = array('q')
+        self._xp: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        # Held while a load is in progress
+        self._load_lock = threading.Lock()
+        self._loaded_at: Optional[float] = None
+
+    def _stale(self) -> bool:
+        return time.monotonic() - self._loaded_at > self.resync_interval
+
+    def _ensure_loaded(self):
+        if self._loaded_at is None:
+            # Nothing to serve yet: wait for the first load
+            with self._load_lock:
+                if self._loaded_at is None:
+                    self.load()
+        elif self._stale() and self._load_lock.acquire(blocking=False):
+            # One thread resyncs; the others keep using the current index
+            try:
+                if self._stale():
+                    self.load()
+            finally:
+                self._load_lock.release()
+
+    def load(self):
+        """Rebuild the index from the users table"""
+        with db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT id, xp_points FROM users WHERE xp_points > 0')
+            xp = {row['id']: row['xp_points'] for row in cursor.fetchall()}
+
+        keys = array('q', sorted(_key(points, user_id) for user_id, points in xp.items()))
+        with self._lock:
+            self._keys = keys
+            self._xp = xp
+            self._loaded_at = time.monotonic()
+
+    def update(self, user_id: int, xp_points: int):
+        """Move a user to their new XP total"""
+        with self._lock:
+            if self._loaded_at is None:
+                return  # loaded from the database on first use
+
+            old = self._xp.pop(user_id, None)
+            if old is not None:
+                at = bisect.bisect_left(self._keys, _key(old, user_id))
+                del self._keys[at]
+            if xp_points > 0:
+                self._xp[user_id] = xp_points
+                bisect.insort(self._keys, _key(xp_points, user_id))
+
+    def rank(self, user_id: int) -> int:
+        """1-based competition rank of a user"""
+        self._ensure_loaded()
+        with self._lock:
+            xp = self._xp.get(user_id)
+            if xp is None:
+                return len(self._keys) + 1
+            return bisect.bisect_left(self._keys, _key(xp, 0)) + 1
+
+    def around(self, user_id: int, count: int) -> List[Dict[str, int]]:
+        """Users within `count` positions of a user, with their ranks"""
+        count = max(0, min(count, LEADERBOARD_MAX_AROUND))
+        self._ensure_loaded()
+        with self._lock:
+            xp = self._xp.get(user_id)
+            position = (bisect.bisect_left(self._keys, _key(xp, user_id))
+                        if xp is not None else len(self._keys))
+
+            neighbours = []
+            for key in self._keys[max(0, position - count):position + count + 1]:
+                neighbour_id = _user_id(key)
+                neighbour_xp = self._xp[neighbour_id]
+                neighbours.append({
+                    'id': neighbour_id,
+                    'rank': bisect.bisect_left(self._keys, _key(neighbour_xp, 0)) + 1,
+                })
+            return neighbours
+
+    def size(self) -> int:
+        return len(self._keys)
+
+
+rank_index = RankIndex()
@@ -0,0 +1,244 @@
+"""
+Progress coalescing for Oriental Mini App
+Merges high-frequency playback updates per (user, material) and writes
+them in periodic batches
+"""
+import asyncio
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.crud import acrud, crud
+from app.models.database import db
+
+logger = logging.getLogger(__name__)
+
+# How often (ms) pending updates are written (0 disables coalescing)
+PROGRESS_FLUSH_MS = int(os.getenv("PROGRESS_FLUSH_MS", "5000"))
+# Flush early once this many (user, material) pairs are pending
+PROGRESS_BUFFER_SIZE = int(os.getenv("PROGRESS_BUFFER_SIZE", "10000"))
+# Flushes an entry may fail before it is dropped
+PROGRESS_FLUSH_ATTEMPTS = 3
+
+
+class ProgressBuffer:
+    """Pending progress per (telegram_id, material_id)
+    
+    Repeated updates merge into one entry: time_spent is summed and the
+    latest position and percent win. Completions are never buffered; the
+    caller writes them through after taking the pending entry with take().
+    
+    Buffered entries never change the completion flag. A flush writes one
+    user per transaction, holding the write lock while it checks for
+    write-throughs: an entry taken by one while the flush was running only
+    adds its time, so it can't roll the position back.
+    """
+
+    def __init__(self, flush_ms: int = PROGRESS_FLUSH_MS,
+                 max_size: int = PROGRESS_BUFFER_SIZE):
+        self.flush_interval = flush_ms / 1000
+        self.max_size = max_size
+        
+        self._pending: Dict[Tuple[int, int], Dict[str, Any]] = {}
+        # Entries the running flush is writing, and those of them that a
+        # write-through has since replaced
+        self._in_flight: Dict[Tuple[int, int], Dict[str, Any]] = {}
+        self._superseded = set()
+        # Buffered updates per user since their last write, for ETags
+        self._revisions: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {
+            'received': 0,
+            'written': 0,
+            'flushes': 0,
+            'failures': 0,
+            'dropped': 0,
+        }
+    
+    @property
+    def enabled(self) -> bool:
+        return self.flush_interval > 0 and self._task is not None
+    
+    def _merge(self, key: Tuple[int, int], update: Dict[str, Any]):
+        entry = self._pending.get(key)
+        if entry is None:
+            self._pending[key] = dict(update)
+        else:
+            entry['progress_percent'] = update['progress_percent']
+            entry['last_position'] = update['last_position']
+            entry['time_spent'] += update['time_spent']
+    
+    def add(self, telegram_id: int, material_id: int, progress_percent: int = 0,
+            last_position: int = 0, time_spent: int = 0):
+        """Queue a non-completing progress update"""
+        with self._lock:
+            self._merge((telegram_id, material_id), {
+                'material_id': material_id,
+                'progress_percent': progress_percent,
+                'completed': None,
+                'last_position': last_position,
+                'time_spent': time_spent,
+            })
+            self._revisions[telegram_id] = self._revisions.get(telegram_id, 0) + 1
+            self._stats['received'] += 1
+            pending = len(self._pending)
+        
+        if pending >= self.max_size and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+    
+    def peek(self, telegram_id: int, material_id: int) -> Optional[Dict[str, Any]]:
+        """Pending update for a material, for read-your-writes overlays"""
+        key = (telegram_id, material_id)
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is None and key not in self._superseded:
+                entry = self._in_flight.get(key)
+            return dict(entry) if entry else None
+    
+    def revision(self, telegram_id: int) -> int:
+        """Changes to a user's progress not yet reflected in progress_version"""
+        with self._lock:
+            return self._revisions.get(telegram_id, 0)
+    
+    def take(self, telegram_id: int, material_id: int = None) -> List[Dict[str, Any]]:
+        """Remove and return a user's pending updates (one material or all)
+        so the caller can write them together with its own
+        
+        Give them back with restore() if that write fails.
+        """
+        with self._lock:
+            self._revisions.pop(telegram_id, None)
+            if material_id is not None:
+                self._supersede(telegram_id, [material_id])
+                entry = self._pending.pop((telegram_id, material_id), None)
+                return [entry] if entry else []
+            keys = [key for key in self._pending if key[0] == telegram_id]
+            return [self._pending.pop(key) for key in keys]
+    
+    def supersede(self, telegram_id: int, material_ids: List[int]):
+        """Note a write-through for these materials, so an in-flight flush
+        adds only the time of its older entries for them"""
+        with self._lock:
+            self._supersede(telegram_id, material_ids)
+    
+    def _supersede(self, telegram_id: int, material_ids: List[int]):
+        for material_id in material_ids:
+            if (telegram_id, material_id) in self._in_flight:
+                self._superseded.add((telegram_id, material_id))
+    
+    def restore(self, telegram_id: int, entries: List[Dict[str, Any]]):
+        """Put back entries taken for a write that did not commit"""
+        with self._lock:
+            self._restore({(telegram_id, e['material_id']): e for e in entries})
+    
+    def _restore(self, entries: Dict[Tuple[int, int], Dict[str, Any]]):
+        # Updates that arrived meanwhile are newer; fold ours in underneath
+        for key, entry in entries.items():
+            newer = self._pending.get(key)
+            self._pending[key] = dict(entry)
+            if newer is not None:
+                self._merge(key, newer)
+            self._revisions[key[0]] = self._revisions.get(key[0], 0) + 1
+    
+    def _claim(self, keys: List[Tuple[int, int]]) -> List[Dict[str, Any]]:
+        """In-flight entries to write; superseded ones only add their time"""
+        with self._lock:
+            return [
+                dict(self._in_flight[key], progress_percent=None, last_position=None)
+                if key in self._superseded else self._in_flight[key]
+                for key in keys
+            ]
+    
+    def flush(self) -> int:
+        """Write pending updates, one transaction per user; returns how many"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._in_flight, self._superseded = pending, set()
+        if not pending:
+            return 0
+        
+        by_user: Dict[int, List[Tuple[int, int]]] = {}
+        for key in pending:
+            by_user.setdefault(key[0], []).append(key)
+        
+        written = 0
+        failed: Dict[Tuple[int, int], Dict[str, Any]] = {}
+        for telegram_id, keys in by_user.items():
+            try:
+                with db.unit_of_work() as uow:
+                    # Write-throughs for this user now wait for us, or have
+                    # already marked what they replaced
+                    db.lock_for_write(uow.connection())
+                    if crud.update_progress_batch(telegram_id, self._claim(keys)) is None:
+                        raise RuntimeError("progress batch failed")
+                written += len(keys)
+            except Exception as e:
+                logger.error(f"Error flushing progress for user {telegram_id}: {e}")
+                for key in keys:
+                    failed[key] = dict(pending[key], attempts=pending[key].get('attempts', 0) + 1)
+        
+        with self._lock:
+            retry = {key: entry for key, entry in failed.items()
+                     if entry['attempts'] < PROGRESS_FLUSH_ATTEMPTS}
+            # A write-through replaced these positions; retry only the time
+            for key in retry.keys() & self._superseded:
+                retry[key] = dict(retry[key], progress_percent=None, last_position=None)
+            self._in_flight, self._superseded = {}, set()
+            dropped = len(failed) - len(retry)
+            self._restore(retry)
+            for telegram_id in by_user:
+                if not any(key[0] == telegram_id for key in self._pending):
+                    self._revisions.pop(telegram_id, None)
+            self._stats['written'] += written
+            self._stats['flushes'] += 1
+            self._stats['failures'] += len(failed)
+            self._stats['dropped'] += dropped
+        
+        if dropped:
+            logger.error(f"Dropped {dropped} progress updates after "
+                         f"{PROGRESS_FLUSH_ATTEMPTS} failed flushes")
+        return written
+    
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await acrud.run_db(self.flush)
+    
+    def start(self):
+        """Start the background flush task on the running event loop"""
+        if self._task is None and self.flush_interval > 0:
+            self._loop = asyncio.get_running_loop()
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Stop the flush task and write whatever is still pending"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._wakeup = None
+        await acrud.run_db(self.flush)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Pending entries and how many updates were merged away"""
+        with self._lock:
+            return {
+                **self._stats,
+                'pending': len(self._pending),
+                'max_size': self.max_size,
+            }
+
+
+progress_buffer = ProgressBuffer()
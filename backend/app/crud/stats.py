@@ -0,0 +1,84 @@
+"""
+Admin statistics snapshot for Oriental Mini App
+Dashboard figures computed in the background and served from memory
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from app.crud import acrud, crud
+
+logger = logging.getLogger(__name__)
+
+# Seconds between background refreshes (0 disables the background job)
+ADMIN_STATS_REFRESH = float(os.getenv("ADMIN_STATS_REFRESH", "60"))
+
+
+class StatsSnapshot:
+    """Last computed admin statistics and when they were generated
+    
+    Refreshed by a background task every `refresh_interval` seconds. A read
+    that finds no snapshot, or one more than two intervals old (the task is
+    disabled or stuck), recomputes it inline.
+    """
+
+    def __init__(self, refresh_interval: float = ADMIN_STATS_REFRESH):
+        self.refresh_interval = refresh_interval
+        
+        self._stats: Optional[Dict[str, Any]] = None
+        self._refreshed_at = 0.0
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+    
+    def refresh(self) -> Dict[str, Any]:
+        """Recompute the statistics and replace the snapshot"""
+        stats = crud.get_admin_stats()
+        if not stats:
+            return self._stats or {}
+        
+        stats['generated_at'] = datetime.utcnow().isoformat(timespec='seconds') + 'Z'
+        with self._lock:
+            self._stats = stats
+            self._refreshed_at = time.monotonic()
+        return stats
+    
+    def get(self) -> Dict[str, Any]:
+        """Current snapshot, refreshed inline only when missing or stale"""
+        with self._lock:
+            stats = self._stats
+            age = time.monotonic() - self._refreshed_at
+        
+        max_age = 2 * self.refresh_interval if self.refresh_interval > 0 else 60
+        if stats is None or age > max_age:
+            return self.refresh()
+        return stats
+    
+    async def _run(self):
+        while True:
+            try:
+                await acrud.run_db(self.refresh)
+            except Exception as e:
+                logger.error(f"Admin stats refresh failed: {e}")
+            await asyncio.sleep(self.refresh_interval)
+    
+    def start(self):
+        """Start the background refresh task on the running event loop"""
+        if self._task is None and self.refresh_interval > 0:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Stop the background refresh task"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+admin_stats = StatsSnapshot()
@@ -2,19 +2,34 @@
 Oriental Mini App - FastAPI Backend
 Main application with all API endpoints
 """
-from fastapi import FastAPI, HTTPException, Depends, Header, UploadFile, File
+from fastapi import FastAPI, HTTPException, Depends, Header, Request, Response, UploadFile, File, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from typing import Optional, List
+from fastapi.responses import JSONResponse, PlainTextResponse
+from fastapi.routing import APIRoute
+from typing import Callable, Optional, List
+import asyncio
 import hashlib
 import hmac
+import io
 import json
 import logging
 import os
+import time
+from collections import OrderedDict
+from functools import lru_cache
 from urllib.parse import parse_qs
 
-from app.crud import crud
-from app.models.database import db
+from app.crud import acrud
+from app.crud.analytics import analytics_buffer, rollup_periodically, ANALYTICS_ROLLUP_INTERVAL
+from app.crud.cache import catalog_cache
+from app.crud.importer import IMPORT_FORMATS, detect_format, import_content
+from app.crud.leaderboard import LEADERBOARD_MAX_AROUND
+from app.crud.progress import progress_buffer
+from app.crud.stats import admin_stats
+from app.metrics import MetricsMiddleware, registry as metrics_registry
+from app.models import instrumentation
+from app.models.database import db, RollbackOnlyError
+from app.schemas import ProgressBatch
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -25,12 +40,42 @@ BOT_TOKEN = os.getenv("BOT_TOKEN", "")
 if not BOT_TOKEN:
     logger.warning("BOT_TOKEN environment variable not set!")
 
+# Bearer token required on /metrics when set
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# Verified initData cache size and how long a session may be served from it
+INIT_DATA_CACHE_SIZE = int(os.getenv("INIT_DATA_CACHE_SIZE", "10000"))
+INIT_DATA_MAX_AGE = int(os.getenv("INIT_DATA_MAX_AGE", "86400"))
+
+class UnitOfWorkRoute(APIRoute):
+    """Route that runs its dependencies and endpoint in one unit of work;
+    each database call commits as a step of it before it returns (see
+    acrud.unit_of_work), so nothing is left to commit after the response"""
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+        
+        async def unit_of_work_handler(request: Request) -> Response:
+            async with acrud.unit_of_work():
+                return await handler(request)
+        
+        return unit_of_work_handler
+
+
 # FastAPI app
 app = FastAPI(
     title="Oriental University Mini App API",
     description="Backend API for educational Telegram Mini App",
     version="1.0.0"
 )
+app.router.route_class = UnitOfWorkRoute
+
+
+@app.exception_handler(RollbackOnlyError)
+async def rollback_only_handler(request: Request, exc: RollbackOnlyError):
+    """A failed step discarded the request's writes: never report success"""
+    logger.error(f"{request.method} {request.url.path}: {exc}")
+    return JSONResponse(status_code=500, content={"detail": "Failed to save changes"})
 
 # CORS middleware - configure allowed origins for production
 ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "*").split(",")
@@ -43,10 +88,79 @@ app.add_middleware(
 )
 
 
+class SQLTimingMiddleware:
+    """Collects per-request SQL totals while instrumentation is enabled and
+    reports them in a Server-Timing header"""
+
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not instrumentation.is_enabled():
+            await self.app(scope, receive, send)
+            return
+        
+        stats, token = instrumentation.begin_request()
+        
+        async def send_with_timing(message):
+            if message['type'] == 'http.response.start':
+                timing = f'db;dur={stats.time_ms:.3f};desc="{stats.statements} statements"'
+                message = {
+                    **message,
+                    'headers': list(message.get('headers', [])) + [
+                        (b'server-timing', timing.encode())
+                    ],
+                }
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            instrumentation.end_request(token)
+
+
+app.add_middleware(SQLTimingMiddleware)
+app.add_middleware(MetricsMiddleware, routes=app.router.routes)
+
+
 # ==================== AUTHENTICATION ====================
 
+@lru_cache(maxsize=4)
+def _webapp_secret_key(bot_token: str) -> bytes:
+    """HMAC key derived from the bot token, computed once per token"""
+    return hmac.new(
+        "WebAppData".encode(),
+        bot_token.encode(),
+        hashlib.sha256
+    ).digest()
+
+
+# Verified initData strings -> (user data, auth_date), in LRU order.
+# Keyed by the whole string so a cached hash can never vouch for other fields.
+_init_data_cache: "OrderedDict[str, tuple]" = OrderedDict()
+_init_data_stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0}
+
+
+def init_data_cache_stats() -> dict:
+    """Verified initData cache counters"""
+    return {**_init_data_stats, 'size': len(_init_data_cache), 'max_size': INIT_DATA_CACHE_SIZE}
+
+
 def verify_telegram_web_app_data(init_data: str) -> dict:
     """Verify Telegram Mini App init data"""
+    cached = _init_data_cache.get(init_data)
+    if cached is not None:
+        user_data, auth_date = cached
+        if time.time() - auth_date <= INIT_DATA_MAX_AGE:
+            _init_data_cache.move_to_end(init_data)
+            _init_data_stats['hits'] += 1
+            return user_data
+        # Session went stale, drop it and verify from scratch
+        _init_data_cache.pop(init_data, None)
+        _init_data_stats['expired'] += 1
+    
+    _init_data_stats['misses'] += 1
+    
     try:
         parsed_data = parse_qs(init_data)
         
@@ -64,30 +178,32 @@ def verify_telegram_web_app_data(init_data: str) -> dict:
         data_check_string = '\n'.join(check_items)
         
         # Calculate hash
-        secret_key = hmac.new(
-            "WebAppData".encode(),
-            BOT_TOKEN.encode(),
-            hashlib.sha256
-        ).digest()
-        
         calculated_hash = hmac.new(
-            secret_key,
+            _webapp_secret_key(BOT_TOKEN),
             data_check_string.encode(),
             hashlib.sha256
         ).hexdigest()
         
         # Verify hash
-        if calculated_hash != received_hash:
+        if not hmac.compare_digest(calculated_hash, received_hash):
             raise ValueError("Invalid hash")
         
         # Parse user data
         user_data = json.loads(parsed_data.get('user', ['{}'])[0])
         
-        return user_data
-        
     except Exception as e:
         logger.error(f"Telegram auth verification failed: {e}")
         raise HTTPException(status_code=401, detail="Authentication failed")
+    
+    # Remember fresh sessions only
+    auth_date = int(parsed_data.get('auth_date', ['0'])[0] or 0)
+    if INIT_DATA_CACHE_SIZE > 0 and time.time() - auth_date <= INIT_DATA_MAX_AGE:
+        _init_data_cache[init_data] = (user_data, auth_date)
+        if len(_init_data_cache) > INIT_DATA_CACHE_SIZE:
+            _init_data_cache.popitem(last=False)
+            _init_data_stats['evictions'] += 1
+    
+    return user_data
 
 
 async def get_current_user(authorization: str = Header(None)):
@@ -102,22 +218,50 @@ async def get_current_user(authorization: str = Header(None)):
     if not telegram_id:
         raise HTTPException(status_code=401, detail="Invalid user data")
     
-    # Get or create user
-    user = crud.get_user_by_telegram_id(telegram_id)
+    # Get or create user, updating last active and streak once a day
+    user = await acrud.touch_user(
+        telegram_id=telegram_id,
+        username=user_data.get('username'),
+        full_name=user_data.get('first_name', '') + ' ' + user_data.get('last_name', '')
+    )
     if not user:
-        crud.create_user(
-            telegram_id=telegram_id,
-            username=user_data.get('username'),
-            full_name=user_data.get('first_name', '') + ' ' + user_data.get('last_name', '')
-        )
-        user = crud.get_user_by_telegram_id(telegram_id)
-    
-    # Update last active and streak
-    crud.update_user_streak(telegram_id)
+        raise HTTPException(status_code=503, detail="User lookup failed")
     
     return user
 
 
+# ==================== CONDITIONAL RESPONSES ====================
+
+async def progress_etag(current_user: dict) -> str:
+    """ETag for views built from the catalog plus the user's progress"""
+    catalog_version = await acrud.run_db(catalog_cache.current_version)
+    etag = (
+        f'W/"c{catalog_version}-u{current_user["id"]}'
+        f'-p{current_user.get("progress_version") or 0}'
+    )
+    buffered = progress_buffer.revision(current_user['telegram_id'])
+    if buffered:
+        etag += f'-b{buffered}'
+    return etag + '"'
+
+
+def etag_headers(etag: str) -> dict:
+    """Per-user responses that clients must revalidate before reuse"""
+    return {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """304 response when If-None-Match already names this ETag"""
+    if_none_match = request.headers.get('if-none-match')
+    if not if_none_match:
+        return None
+    
+    tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+    if '*' in tags or etag.removeprefix('W/') in tags:
+        return Response(status_code=304, headers=etag_headers(etag))
+    return None
+
+
 # ==================== PUBLIC ENDPOINTS ====================
 
 @app.get("/")
@@ -128,14 +272,90 @@ async def root():
 
 @app.get("/api/health")
 async def health_check():
-    """Detailed health check"""
+    """Detailed health check with a timed database round trip"""
+    try:
+        latency_ms = await acrud.run_db(db.ping)
+    except Exception as e:
+        logger.error(f"Health check database probe failed: {e}")
+        return JSONResponse(status_code=503, content={
+            "status": "unhealthy",
+            "database": "unavailable",
+            "pool": db.pool_stats(),
+            "version": "1.0.0"
+        })
+    
     return {
         "status": "healthy",
         "database": "connected",
+        "database_latency_ms": round(latency_ms, 3),
+        "pool": db.pool_stats(),
+        "executor": acrud.executor_stats(),
+        "auth_cache": init_data_cache_stats(),
+        "catalog_cache": catalog_cache.stats(),
+        "analytics_queue": analytics_buffer.stats(),
+        "progress_buffer": progress_buffer.stats(),
+        "startup": startup_info,
         "version": "1.0.0"
     }
 
 
+def _runtime_metrics():
+    """Pool, executor, cache and queue figures read at scrape time"""
+    pool = db.pool_stats()
+    executor = acrud.executor_stats()
+    caches = {'catalog': catalog_cache.stats(), 'init_data': init_data_cache_stats()}
+    analytics = analytics_buffer.stats()
+    progress = progress_buffer.stats()
+    
+    yield ('db_pool_connections', 'gauge', 'Pooled SQLite connections by state',
+           [({'state': state}, pool[state]) for state in ('in_use', 'idle', 'open', 'size')])
+    yield ('db_pool_checkouts_total', 'counter', 'Connection checkouts',
+           [({}, pool['checkouts'])])
+    yield ('db_pool_waits_total', 'counter', 'Checkouts that had to wait for a connection',
+           [({}, pool['waits'])])
+    yield ('db_pool_timeouts_total', 'counter', 'Checkouts that timed out',
+           [({}, pool['timeouts'])])
+    yield ('db_executor_calls', 'gauge', 'Database calls on the executor by state',
+           [({'state': 'running'}, executor['running']),
+            ({'state': 'queued'}, executor['queued'])])
+    yield ('cache_lookups_total', 'counter', 'Cache lookups by cache and result',
+           [({'cache': name, 'result': result}, stats[key])
+            for name, stats in caches.items()
+            for result, key in (('hit', 'hits'), ('miss', 'misses'))])
+    yield ('cache_hit_ratio', 'gauge', 'Cache hit ratio since start',
+           [({'cache': name}, round(stats['hits'] / max(1, stats['hits'] + stats['misses']), 4))
+            for name, stats in caches.items()])
+    yield ('cache_entries', 'gauge', 'Cached entries',
+           [({'cache': name}, stats['size']) for name, stats in caches.items()])
+    yield ('queue_depth', 'gauge', 'Pending items in write-behind queues',
+           [({'queue': 'analytics'}, analytics['pending']),
+            ({'queue': 'progress'}, progress['pending'])])
+    yield ('analytics_events_dropped_total', 'counter', 'Analytics events dropped on overflow',
+           [({}, analytics['dropped'])])
+    if startup_info:
+        yield ('db_schema_version', 'gauge', 'Schema version (PRAGMA user_version)',
+               [({}, startup_info['schema_version'])])
+        yield ('app_startup_seconds', 'gauge', 'Time spent in the startup hook',
+               [({}, startup_info['startup_ms'] / 1000)])
+
+
+metrics_registry.add_collector(_runtime_metrics)
+
+
+async def metrics_endpoint(request: Request) -> Response:
+    """Prometheus scrape endpoint"""
+    if METRICS_TOKEN and request.headers.get('authorization') != f'Bearer {METRICS_TOKEN}':
+        return PlainTextResponse('Unauthorized', status_code=401)
+    return PlainTextResponse(
+        metrics_registry.render(),
+        media_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+
+# Plain route: scrapes must not wait for a unit-of-work slot
+app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
+
+
 # ==================== AUTH ENDPOINTS ====================
 
 @app.post("/api/auth/login")
@@ -146,14 +366,11 @@ async def login(init_data: str):
         telegram_id = user_data.get('id')
         
         # Get or create user
-        user = crud.get_user_by_telegram_id(telegram_id)
-        if not user:
-            crud.create_user(
-                telegram_id=telegram_id,
-                username=user_data.get('username'),
-                full_name=user_data.get('first_name', '') + ' ' + user_data.get('last_name', '')
-            )
-            user = crud.get_user_by_telegram_id(telegram_id)
+        user = await acrud.touch_user(
+            telegram_id=telegram_id,
+            username=user_data.get('username'),
+            full_name=user_data.get('first_name', '') + ' ' + user_data.get('last_name', '')
+        )
         
         return {"success": True, "user": user}
         
@@ -165,37 +382,28 @@ async def login(init_data: str):
 @app.get("/api/auth/me")
 async def get_me(current_user: dict = Depends(get_current_user)):
     """Get current user info"""
-    stats = crud.get_user_stats(current_user['telegram_id'])
+    stats = await acrud.get_user_stats(current_user['telegram_id'])
     return {"success": True, "user": stats}
 
 
 # ==================== DIRECTIONS ENDPOINTS ====================
 
 @app.get("/api/directions")
-async def get_directions(current_user: dict = Depends(get_current_user)):
+async def get_directions(request: Request, current_user: dict = Depends(get_current_user)):
     """Get all active directions"""
-    directions = crud.get_all_directions(active_only=True)
+    etag = await progress_etag(current_user)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    
+    directions = await acrud.get_all_directions(active_only=True)
+    progress = await acrud.get_direction_progress(current_user['id'])
     
     # Add user's progress for each direction
     for direction in directions:
-        courses = crud.get_courses_by_direction(direction['id'])
-        total_materials = sum(
-            len(crud.get_materials_by_course(course['id'])) 
-            for course in courses
-        )
-        
-        completed_materials = 0
-        for course in courses:
-            materials = crud.get_materials_by_course(course['id'])
-            for material in materials:
-                progress = crud.get_user_progress(
-                    current_user['telegram_id'], 
-                    course['id']
-                )
-                completed_materials += sum(
-                    1 for p in progress 
-                    if p['material_id'] == material['id'] and p['completed']
-                )
+        counts = progress.get(direction['id'], {})
+        total_materials = counts.get('total_materials', 0)
+        completed_materials = counts.get('completed_materials', 0)
         
         direction['total_materials'] = total_materials
         direction['completed_materials'] = completed_materials
@@ -204,7 +412,10 @@ async def get_directions(current_user: dict = Depends(get_current_user)):
             if total_materials > 0 else 0
         )
     
-    return {"success": True, "directions": directions}
+    return JSONResponse(
+        {"success": True, "directions": directions},
+        headers=etag_headers(etag)
+    )
 
 
 @app.get("/api/directions/{direction_id}")
@@ -213,7 +424,7 @@ async def get_direction(
     current_user: dict = Depends(get_current_user)
 ):
     """Get direction details"""
-    directions = crud.get_all_directions(active_only=False)
+    directions = await acrud.get_all_directions(active_only=False)
     direction = next((d for d in directions if d['id'] == direction_id), None)
     
     if not direction:
@@ -233,7 +444,7 @@ async def create_direction_endpoint(
     if not current_user.get('is_admin'):
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    direction_id = crud.create_direction(name, description, icon_url)
+    direction_id = await acrud.create_direction(name, description, icon_url)
     if not direction_id:
         raise HTTPException(status_code=400, detail="Failed to create direction")
     
@@ -266,7 +477,7 @@ async def update_direction_endpoint(
     if is_active is not None:
         update_data['is_active'] = is_active
     
-    success = crud.update_direction(direction_id, **update_data)
+    success = await acrud.update_direction(direction_id, **update_data)
     if not success:
         raise HTTPException(status_code=400, detail="Failed to update direction")
     
@@ -282,7 +493,7 @@ async def delete_direction_endpoint(
     if not current_user.get('is_admin'):
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    success = crud.delete_direction(direction_id)
+    success = await acrud.delete_direction(direction_id)
     if not success:
         raise HTTPException(status_code=400, detail="Failed to delete direction")
     
@@ -294,56 +505,50 @@ async def delete_direction_endpoint(
 @app.get("/api/courses")
 async def get_courses(
     direction_id: int,
+    request: Request,
     current_user: dict = Depends(get_current_user)
 ):
     """Get courses by direction"""
-    courses = crud.get_courses_by_direction(direction_id, active_only=True)
+    etag = await progress_etag(current_user)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    
+    courses = await acrud.get_courses_with_progress(direction_id, current_user['id'])
     
-    # Add progress info
+    # Add progress percent
     for course in courses:
-        materials = crud.get_materials_by_course(course['id'])
-        progress_list = crud.get_user_progress(
-            current_user['telegram_id'],
-            course['id']
-        )
-        
-        course['total_materials'] = len(materials)
-        course['completed_materials'] = sum(1 for p in progress_list if p['completed'])
         course['progress_percent'] = (
             (course['completed_materials'] / course['total_materials'] * 100)
             if course['total_materials'] > 0 else 0
         )
     
-    return {"success": True, "courses": courses}
+    return JSONResponse(
+        {"success": True, "courses": courses},
+        headers=etag_headers(etag)
+    )
 
 
 @app.get("/api/courses/{course_id}")
 async def get_course(
     course_id: int,
+    request: Request,
     current_user: dict = Depends(get_current_user)
 ):
     """Get course details with materials"""
-    course = crud.get_course_by_id(course_id)
+    etag = await progress_etag(current_user)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    
+    course = await acrud.get_course_with_progress(course_id, current_user['id'])
     if not course:
         raise HTTPException(status_code=404, detail="Course not found")
     
-    materials = crud.get_materials_by_course(course_id)
-    progress_list = crud.get_user_progress(current_user['telegram_id'], course_id)
-    
-    # Add progress to each material
-    progress_dict = {p['material_id']: p for p in progress_list}
-    for material in materials:
-        material['progress'] = progress_dict.get(material['id'], {
-            'completed': False,
-            'progress_percent': 0,
-            'last_position': 0
-        })
-    
-    course['materials'] = materials
-    course['total_materials'] = len(materials)
-    course['completed_materials'] = sum(1 for p in progress_list if p['completed'])
-    
-    return {"success": True, "course": course}
+    return JSONResponse(
+        {"success": True, "course": course},
+        headers=etag_headers(etag)
+    )
 
 
 @app.post("/api/courses")
@@ -361,7 +566,7 @@ async def create_course_endpoint(
     if not current_user.get('is_admin'):
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    course_id = crud.create_course(
+    course_id = await acrud.create_course(
         direction_id, title, language,
         description=description, level=level,
         duration_hours=duration_hours, thumbnail_url=thumbnail_url
@@ -381,13 +586,13 @@ async def get_material(
     current_user: dict = Depends(get_current_user)
 ):
     """Get material details"""
-    material = crud.get_material_by_id(material_id)
+    material = await acrud.get_material_by_id(material_id)
     if not material:
         raise HTTPException(status_code=404, detail="Material not found")
     
     # Get user's progress
-    course = crud.get_course_by_id(material['course_id'])
-    progress_list = crud.get_user_progress(
+    course = await acrud.get_course_by_id(material['course_id'])
+    progress_list = await acrud.get_user_progress(
         current_user['telegram_id'],
         course['id']
     )
@@ -397,11 +602,22 @@ async def get_material(
         {'completed': False, 'progress_percent': 0, 'last_position': 0}
     )
     
+    # Show playback progress that is still waiting to be written; buffered
+    # heartbeats never change completion, so the stored flag stands
+    pending = progress_buffer.peek(current_user['telegram_id'], material_id)
+    if pending:
+        material_progress = {
+            **material_progress,
+            **{field: pending[field] for field in ('progress_percent', 'last_position')
+               if pending[field] is not None},
+            'time_spent': (material_progress.get('time_spent') or 0) + pending['time_spent'],
+        }
+    
     material['progress'] = material_progress
     
-    # Log view event
-    crud.log_analytics_event(
-        current_user['telegram_id'],
+    # Log view event (written in batches by the analytics buffer)
+    analytics_buffer.log(
+        current_user['id'],
         'material_view',
         f"material_id:{material_id}"
     )
@@ -418,8 +634,29 @@ async def update_material_progress(
     time_spent: int = 0,
     current_user: dict = Depends(get_current_user)
 ):
-    """Update user's progress on a material"""
-    success = crud.update_progress(
+    """Update user's progress on a material
+    
+    Playback updates are coalesced and written every PROGRESS_FLUSH_MS;
+    completions are written immediately.
+    """
+    if not completed and progress_buffer.enabled:
+        progress_buffer.add(
+            current_user['telegram_id'],
+            material_id,
+            progress_percent=progress_percent,
+            last_position=last_position,
+            time_spent=time_spent
+        )
+        return {"success": True, "new_achievements": []}
+    
+    # Fold in playback time still waiting in the buffer; it goes back if
+    # the write rolls back
+    taken = progress_buffer.take(current_user['telegram_id'], material_id)
+    db.after_rollback(lambda: progress_buffer.restore(current_user['telegram_id'], taken))
+    for pending in taken:
+        time_spent += pending['time_spent']
+    
+    result = await acrud.update_progress(
         current_user['telegram_id'],
         material_id,
         progress_percent=progress_percent,
@@ -428,15 +665,40 @@ async def update_material_progress(
         time_spent=time_spent
     )
     
-    if not success:
+    if not result:
         raise HTTPException(status_code=400, detail="Failed to update progress")
     
-    # Check for achievements
-    new_achievements = crud.check_and_award_achievements(current_user['telegram_id'])
+    return {
+        "success": True,
+        "new_achievements": result['new_achievements']
+    }
+
+
+@app.post("/api/progress/batch")
+async def update_progress_batch_endpoint(
+    batch: ProgressBatch,
+    current_user: dict = Depends(get_current_user)
+):
+    """Apply queued progress updates (e.g. playback heartbeats) at once"""
+    # Buffered updates are older than anything the client sends now; they
+    # go back if the write rolls back
+    pending = progress_buffer.take(current_user['telegram_id'])
+    progress_buffer.supersede(current_user['telegram_id'],
+                              [update.material_id for update in batch.updates])
+    db.after_rollback(lambda: progress_buffer.restore(current_user['telegram_id'], pending))
+    result = await acrud.update_progress_batch(
+        current_user['telegram_id'],
+        pending + [update.model_dump() for update in batch.updates]
+    )
+    
+    if result is None:
+        raise HTTPException(status_code=400, detail="Failed to update progress")
     
     return {
         "success": True,
-        "new_achievements": new_achievements
+        "applied": result['applied'],
+        "skipped": result['skipped'],
+        "new_achievements": result['new_achievements']
     }
 
 
@@ -455,7 +717,7 @@ async def create_material_endpoint(
     if not current_user.get('is_admin'):
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    material_id = crud.create_material(
+    material_id = await acrud.create_material(
         course_id, title, type,
         description=description, file_id=file_id,
         file_url=file_url, duration=duration
@@ -467,6 +729,33 @@ async def create_material_endpoint(
     return {"success": True, "material_id": material_id}
 
 
+@app.post("/api/admin/import")
+async def import_content_endpoint(
+    file: UploadFile = File(...),
+    format: Optional[str] = None,
+    dry_run: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
+    """Bulk import directions, courses and materials (admin only)
+    
+    Accepts a JSON content tree, JSON Lines or CSV file. Rows are upserted
+    by name/title; with dry_run nothing is saved.
+    """
+    if not current_user.get('is_admin'):
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    format = format or detect_format(file.filename)
+    if format not in IMPORT_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported format, use one of: {', '.join(IMPORT_FORMATS)}"
+        )
+    
+    stream = io.TextIOWrapper(file.file, encoding='utf-8-sig', newline='')
+    report = await acrud.run_db(import_content, stream, format, dry_run)
+    return {"success": True, "report": report}
+
+
 # ==================== USER ENDPOINTS ====================
 
 @app.get("/api/user/progress")
@@ -475,7 +764,7 @@ async def get_user_progress_endpoint(
     current_user: dict = Depends(get_current_user)
 ):
     """Get user's learning progress"""
-    progress = crud.get_user_progress(current_user['telegram_id'], course_id)
+    progress = await acrud.get_user_progress(current_user['telegram_id'], course_id)
     return {"success": True, "progress": progress}
 
 
@@ -485,7 +774,7 @@ async def update_user_direction(
     current_user: dict = Depends(get_current_user)
 ):
     """Update user's selected direction"""
-    success = crud.update_user_direction(
+    success = await acrud.update_user_direction(
         current_user['telegram_id'],
         direction_id
     )
@@ -501,7 +790,7 @@ async def update_user_direction(
 @app.get("/api/favorites")
 async def get_favorites(current_user: dict = Depends(get_current_user)):
     """Get user's favorite materials"""
-    favorites = crud.get_user_favorites(current_user['telegram_id'])
+    favorites = await acrud.get_user_favorites(current_user['telegram_id'])
     return {"success": True, "favorites": favorites}
 
 
@@ -511,7 +800,7 @@ async def add_favorite(
     current_user: dict = Depends(get_current_user)
 ):
     """Add material to favorites"""
-    success = crud.add_to_favorites(current_user['telegram_id'], material_id)
+    success = await acrud.add_to_favorites(current_user['telegram_id'], material_id)
     if not success:
         raise HTTPException(status_code=400, detail="Failed to add favorite")
     
@@ -524,7 +813,7 @@ async def remove_favorite(
     current_user: dict = Depends(get_current_user)
 ):
     """Remove material from favorites"""
-    success = crud.remove_from_favorites(current_user['telegram_id'], material_id)
+    success = await acrud.remove_from_favorites(current_user['telegram_id'], material_id)
     if not success:
         raise HTTPException(status_code=400, detail="Failed to remove favorite")
     
@@ -536,29 +825,25 @@ async def remove_favorite(
 @app.get("/api/leaderboard")
 async def get_leaderboard_endpoint(
     limit: int = 10,
+    around: int = Query(2, ge=0, le=LEADERBOARD_MAX_AROUND),
     current_user: dict = Depends(get_current_user)
 ):
-    """Get top users leaderboard"""
-    leaderboard = crud.get_leaderboard(limit)
-    
-    # Find current user's position
-    user_position = None
-    for idx, user in enumerate(leaderboard, 1):
-        if user['telegram_id'] == current_user['telegram_id']:
-            user_position = idx
-            break
+    """Get top users leaderboard with the current user's rank"""
+    leaderboard = await acrud.get_leaderboard(limit)
+    user_rank = await acrud.get_user_rank(current_user['id'], around)
     
     return {
         "success": True,
         "leaderboard": leaderboard,
-        "user_position": user_position
+        "user_position": user_rank['rank'],
+        "neighbours": user_rank['neighbours']
     }
 
 
 @app.get("/api/achievements")
 async def get_achievements(current_user: dict = Depends(get_current_user)):
     """Get user's achievements"""
-    achievements = crud.get_user_achievements(current_user['telegram_id'])
+    achievements = await acrud.get_user_achievements(current_user['telegram_id'])
     return {"success": True, "achievements": achievements}
 
 
@@ -570,24 +855,97 @@ async def get_admin_stats_endpoint(current_user: dict = Depends(get_current_user
     if not current_user.get('is_admin'):
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    stats = crud.get_admin_stats()
+    stats = await acrud.run_db(admin_stats.get)
     return {"success": True, "stats": stats}
 
 
+@app.get("/api/admin/analytics")
+async def get_admin_analytics_endpoint(
+    days: int = 30,
+    current_user: dict = Depends(get_current_user)
+):
+    """Get analytics from the daily rollups"""
+    if not current_user.get('is_admin'):
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    analytics = await acrud.get_analytics_summary(days)
+    return {"success": True, "analytics": analytics}
+
+
+@app.get("/api/admin/sql")
+async def get_sql_stats_endpoint(
+    top: int = 20,
+    current_user: dict = Depends(get_current_user)
+):
+    """Most expensive SQL statements and recent slow queries"""
+    if not current_user.get('is_admin'):
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    return {"success": True, "sql": instrumentation.sql_stats(top)}
+
+
+@app.put("/api/admin/sql")
+async def set_sql_instrumentation_endpoint(
+    enabled: bool,
+    slow_ms: Optional[float] = None,
+    reset: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
+    """Switch SQL instrumentation on or off for this worker"""
+    if not current_user.get('is_admin'):
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    if reset:
+        instrumentation.reset_stats()
+    instrumentation.set_enabled(enabled, slow_ms)
+    return {"success": True, "enabled": enabled}
+
+
 # ==================== STARTUP ====================
 
+# Periodic jobs started on startup and cancelled on shutdown
+background_tasks: List[asyncio.Task] = []
+# Schema version and how long startup took, for /api/health and /metrics
+startup_info = {}
+
+
 @app.on_event("startup")
 async def startup_event():
     """Initialize database on startup"""
     logger.info("🚀 Starting Oriental Mini App API...")
-    
-    # Initialize database
-    db.create_tables()
-    
-    # Seed initial data if needed
-    db.seed_initial_data()
-    
-    logger.info("✅ API started successfully!")
+    started = time.perf_counter()
+    
+    # Open the database and apply pending migrations (including seed
+    # data); a current schema costs a single PRAGMA read
+    schema = await acrud.run_db(db.migrate)
+    
+    analytics_buffer.start()
+    progress_buffer.start()
+    admin_stats.start()
+    if ANALYTICS_ROLLUP_INTERVAL > 0:
+        background_tasks.append(asyncio.create_task(rollup_periodically()))
+    
+    startup_info.update({
+        'schema_version': schema['version'],
+        'migrations_applied': schema['applied'],
+        'startup_ms': round((time.perf_counter() - started) * 1000, 3),
+    })
+    logger.info(f"✅ API started in {startup_info['startup_ms']}ms "
+                f"(schema v{schema['version']}, {len(schema['applied'])} migrations applied)")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush buffered writes, drain the DB executor and close pooled connections"""
+    for task in background_tasks:
+        task.cancel()
+    background_tasks.clear()
+    
+    await admin_stats.stop()
+    await progress_buffer.stop()
+    await analytics_buffer.stop()
+    acrud.shutdown()
+    db.close()
 
 
 if __name__ == "__main__":
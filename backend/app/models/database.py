@@ -2,298 +2,603 @@
 Oriental University Mini App - Database Models
 SQLite database with complete schema for educational platform
 """
+import os
+import queue
 import sqlite3
+import threading
+import time
 import logging
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Callable, Hashable
 from datetime import datetime
 from contextlib import contextmanager
+from contextvars import ContextVar, Token
+
+from app.models.instrumentation import InstrumentedConnection
+from app.models.migrations import ACHIEVEMENTS, LATEST_VERSION, apply_migrations
 
 logger = logging.getLogger(__name__)
 
+DATABASE_PATH = os.getenv("DATABASE_PATH", "oriental_miniapp.db")
+
+# Connection pool sizing
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+
+# Source rows copied per transaction by migrate_from_old_db
+MIGRATION_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "1000"))
+
+# PRAGMA profile applied once to every new connection (order matters:
+# journal_mode must be switched before anything else touches the file)
+DEFAULT_PRAGMAS = {
+    'journal_mode': os.getenv("DB_JOURNAL_MODE", "WAL"),
+    'synchronous': os.getenv("DB_SYNCHRONOUS", "NORMAL"),
+    'busy_timeout': int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000")),
+    'cache_size': int(os.getenv("DB_CACHE_SIZE", "-16000")),  # negative = KiB
+    'mmap_size': int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024))),
+    'foreign_keys': 'ON',
+}
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection becomes free within the checkout timeout"""
+
+
+class ConnectionPool:
+    """Bounded pool of SQLite connections shared between threads"""
+
+    def __init__(self, db_path: str, size: int = DB_POOL_SIZE,
+                 timeout: float = DB_POOL_TIMEOUT, pragmas: Dict[str, Any] = None,
+                 on_first_connect: Callable[[sqlite3.Connection], None] = None):
+        self.db_path = db_path
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.pragmas = dict(DEFAULT_PRAGMAS if pragmas is None else pragmas)
+        # Runs once, on the first connection this pool opens, before any
+        # caller gets to use it (schema migrations)
+        self.on_first_connect = on_first_connect
+        self._prepared = on_first_connect is None
+        self._prepare_lock = threading.Lock()
+        
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._open = 0
+        self._in_use = 0
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time_ms': 0.0,
+            'timeouts': 0,
+        }
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Open a new connection and apply the PRAGMA profile"""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False,
+                               factory=InstrumentedConnection)
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+    
+    def acquire(self) -> sqlite3.Connection:
+        """Check out a connection, opening a new one while under the size limit"""
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+        
+        if conn is None:
+            with self._lock:
+                can_open = self._open < self.size
+                if can_open:
+                    self._open += 1
+            
+            if can_open:
+                conn = None
+                try:
+                    conn = self._connect()
+                    self._prepare(conn)
+                except Exception:
+                    if conn is not None:
+                        conn.close()
+                    with self._lock:
+                        self._open -= 1
+                    raise
+            else:
+                started = time.perf_counter()
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self._stats['timeouts'] += 1
+                    raise PoolTimeoutError(
+                        f"No database connection available after {self.timeout}s"
+                    )
+                finally:
+                    with self._lock:
+                        self._stats['waits'] += 1
+                        self._stats['wait_time_ms'] += (time.perf_counter() - started) * 1000
+        
+        with self._lock:
+            self._stats['checkouts'] += 1
+            self._in_use += 1
+        return conn
+    
+    def _prepare(self, conn: sqlite3.Connection):
+        if self._prepared:
+            return
+        with self._prepare_lock:
+            if not self._prepared:
+                self.on_first_connect(conn)
+                self._prepared = True
+    
+    def release(self, conn: sqlite3.Connection):
+        """Return a connection to the pool"""
+        with self._lock:
+            self._in_use -= 1
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+    
+    def close(self):
+        """Close all idle connections"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._open -= 1
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Pool counters for sizing under load"""
+        with self._lock:
+            return {
+                **self._stats,
+                'wait_time_ms': round(self._stats['wait_time_ms'], 3),
+                'size': self.size,
+                'open': self._open,
+                'in_use': self._in_use,
+                'idle': self._open - self._in_use,
+            }
+
+
+class RollbackOnlyError(Exception):
+    """Raised when asked to commit a unit of work that a failed step marked
+    rollback-only; its changes have been rolled back"""
+
+
+class UnitOfWork:
+    """One pooled connection, one commit and an identity map
+    
+    The connection is checked out lazily on first use. Any database error
+    inside the unit marks it rollback-only, so a failed step never
+    commits half of the work.
+    
+    A unit can also commit in steps (requests do, see acrud.run_db): each
+    step ends with end_step(), which commits and returns the connection,
+    while the identity map and the rollback-only mark carry over.
+    """
+
+    def __init__(self, pool: ConnectionPool):
+        self.pool = pool
+        self.conn: Optional[sqlite3.Connection] = None
+        self.identity: Dict[Hashable, Any] = {}
+        self.rollback_only = False
+        self._after_commit: List[Callable[[], None]] = []
+        self._after_rollback: List[Callable[[], None]] = []
+    
+    def connection(self) -> sqlite3.Connection:
+        if self.conn is None:
+            self.conn = self.pool.acquire()
+        return self.conn
+    
+    def after_commit(self, callback: Callable[[], None]):
+        """Run a callback once this unit has committed"""
+        self._after_commit.append(callback)
+    
+    def after_rollback(self, callback: Callable[[], None]):
+        """Run a callback if this unit rolls back instead of committing"""
+        self._after_rollback.append(callback)
+    
+    def commit(self):
+        """Commit the work so far; the unit and its connection stay open"""
+        if self.rollback_only:
+            raise RollbackOnlyError("Unit of work is marked rollback-only")
+        if self.conn is not None:
+            self.conn.commit()
+        callbacks, self._after_commit = self._after_commit, []
+        self._after_rollback = []
+        self._run_callbacks(callbacks)
+    
+    def rollback(self):
+        """Discard the work since the last commit; the unit stays open"""
+        if self.conn is not None:
+            self.conn.rollback()
+        callbacks, self._after_rollback = self._after_rollback, []
+        self._after_commit = []
+        self.identity.clear()
+        self.rollback_only = False
+        self._run_callbacks(callbacks)
+    
+    def end_step(self, commit: bool = True):
+        """Commit this step's writes (roll them back if the unit is
+        rollback-only) and hand the connection back to the pool"""
+        if self.conn is None:
+            return
+        try:
+            if commit and not self.rollback_only:
+                self.commit()
+            else:
+                rollback_only = self.rollback_only
+                self.rollback()
+                self.rollback_only = rollback_only
+        except Exception as e:
+            self.conn.rollback()
+            self.rollback_only = True
+            logger.error(f"Database error: {e}")
+            raise
+        finally:
+            self.pool.release(self.conn)
+            self.conn = None
+    
+    def complete(self, commit: bool = True):
+        """Commit (or roll back) and hand the connection back to the pool
+        
+        A commit of a rollback-only unit rolls back and raises
+        RollbackOnlyError, so the caller can't report the work as saved.
+        """
+        committed = False
+        discarded = commit and self.rollback_only
+        try:
+            if self.conn is not None:
+                try:
+                    if commit and not self.rollback_only:
+                        self.conn.commit()
+                        committed = True
+                    else:
+                        self.conn.rollback()
+                except Exception as e:
+                    self.conn.rollback()
+                    logger.error(f"Database error: {e}")
+                    raise
+                finally:
+                    self.pool.release(self.conn)
+                    self.conn = None
+            else:
+                committed = commit and not self.rollback_only
+        finally:
+            self._run_callbacks(self._after_commit if committed else self._after_rollback)
+        if discarded:
+            raise RollbackOnlyError("A database error marked the unit of work rollback-only; "
+                                    "its changes were rolled back")
+    
+    @staticmethod
+    def _run_callbacks(callbacks: List[Callable[[], None]]):
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Unit of work callback failed: {e}")
+
+
+# Unit of work bound to the current request, task or thread
+_current_uow: ContextVar[Optional[UnitOfWork]] = ContextVar('unit_of_work', default=None)
+
 
 class Database:
-    def __init__(self, db_path: str = 'oriental_miniapp.db'):
+    """Pooled access to the application database
+    
+    Nothing touches the file until the first connection is checked out;
+    that checkout brings the schema up to date (see app.models.migrations).
+    """
+
+    def __init__(self, db_path: str = DATABASE_PATH, pool_size: int = DB_POOL_SIZE,
+                 pool_timeout: float = DB_POOL_TIMEOUT, pragmas: Dict[str, Any] = None):
         self.db_path = db_path
-        self.create_tables()
+        self.pool = ConnectionPool(db_path, pool_size, pool_timeout, pragmas,
+                                   on_first_connect=self._migrate)
+        self.schema: Dict[str, Any] = {}
     
     @contextmanager
     def get_connection(self):
-        """Context manager for database connections"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
+        """Context manager for database connections
+        
+        Inside a unit of work this is the unit's connection and nothing is
+        committed here. Otherwise the block runs as its own unit of work.
+        """
+        uow = _current_uow.get()
+        if uow is None:
+            with self.unit_of_work() as uow:
+                yield uow.connection()
+            return
+        
         try:
-            yield conn
-            conn.commit()
+            yield uow.connection()
+        except Exception:
+            uow.rollback_only = True
+            raise
+    
+    @contextmanager
+    def unit_of_work(self):
+        """Share one connection and one commit across all nested crud calls"""
+        uow = _current_uow.get()
+        if uow is not None:
+            yield uow
+            return
+        
+        uow = UnitOfWork(self.pool)
+        token = _current_uow.set(uow)
+        try:
+            yield uow
         except Exception as e:
-            conn.rollback()
+            _current_uow.reset(token)
             logger.error(f"Database error: {e}")
+            uow.complete(commit=False)
             raise
-        finally:
-            conn.close()
+        else:
+            _current_uow.reset(token)
+            uow.complete(commit=True)
     
-    def create_tables(self):
-        """Create all database tables"""
+    def bind_unit_of_work(self, uow: UnitOfWork) -> Token:
+        """Make `uow` current for this context (see acrud.unit_of_work)"""
+        return _current_uow.set(uow)
+    
+    def unbind_unit_of_work(self, token: Token):
+        _current_uow.reset(token)
+    
+    def current_unit_of_work(self) -> Optional[UnitOfWork]:
+        return _current_uow.get()
+    
+    def after_commit(self, callback: Callable[[], None]):
+        """Run a callback once the current unit of work commits"""
+        uow = _current_uow.get()
+        if uow is None:
+            callback()
+        else:
+            uow.after_commit(callback)
+    
+    def after_rollback(self, callback: Callable[[], None]):
+        """Run a callback if the current unit of work rolls back"""
+        uow = _current_uow.get()
+        if uow is not None:
+            uow.after_rollback(callback)
+    
+    def lock_for_write(self, conn: sqlite3.Connection):
+        """Take the write lock before reads that decide what to write
+        
+        sqlite3 only opens a transaction at the first DML statement, so a
+        SELECT before it sees whatever another writer commits next. BEGIN
+        IMMEDIATE closes that gap; an open transaction already holds the
+        lock (it has written).
+        """
+        if not conn.in_transaction:
+            conn.execute('BEGIN IMMEDIATE')
+    
+    def pool_stats(self) -> Dict[str, Any]:
+        """Connection pool statistics"""
+        return self.pool.get_stats()
+    
+    def close(self):
+        """Close pooled connections"""
+        self.pool.close()
+    
+    def _migrate(self, conn: sqlite3.Connection):
+        self.schema = apply_migrations(conn)
+    
+    def migrate(self) -> Dict[str, Any]:
+        """Open the database now instead of on first use
+        
+        Returns the schema version, the migrations this process applied and
+        how long the check took.
+        """
+        with self.get_connection() as conn:
+            conn.execute('SELECT 1').fetchone()
+        return {**self.schema, 'latest': LATEST_VERSION}
+    
+    def ping(self) -> float:
+        """Round-trip a trivial query; returns the latency in milliseconds"""
+        started = time.perf_counter()
+        with self.get_connection() as conn:
+            conn.execute('SELECT 1').fetchone()
+        return (time.perf_counter() - started) * 1000
+    
+    def get_meta(self, key: str, default: int = 0) -> int:
+        """Read a value from app_meta"""
+        with self.get_connection() as conn:
+            row = conn.execute('SELECT value FROM app_meta WHERE key = ?', (key,)).fetchone()
+            return row['value'] if row else default
+    
+    def bump_catalog_version(self, cursor: sqlite3.Cursor) -> int:
+        """Increment the catalog version inside the caller's transaction"""
+        cursor.execute('''
+            UPDATE app_meta SET value = value + 1
+            WHERE key = 'catalog_version'
+            RETURNING value
+        ''')
+        row = cursor.fetchall()
+        return row[0]['value'] if row else 0
+    
+    def rebuild_course_progress(self) -> Dict[str, int]:
+        """Recompute user_course_progress from user_progress
+        
+        Returns the number of summary rows and how many of the previous
+        rows were missing, stale or left over.
+        """
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            
-            # Users table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    telegram_id BIGINT UNIQUE NOT NULL,
-                    username TEXT,
-                    full_name TEXT,
-                    direction_id INTEGER,
-                    xp_points INTEGER DEFAULT 0,
-                    level INTEGER DEFAULT 1,
-                    streak_days INTEGER DEFAULT 0,
-                    last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    is_admin BOOLEAN DEFAULT 0,
-                    FOREIGN KEY (direction_id) REFERENCES directions(id)
-                )
-            ''')
-            
-            # Directions (yo'nalishlar) table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS directions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL UNIQUE,
-                    description TEXT,
-                    icon_url TEXT,
-                    order_index INTEGER DEFAULT 0,
-                    is_active BOOLEAN DEFAULT 1,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Courses table
+            cursor.execute('DROP TABLE IF EXISTS temp.course_progress_rebuild')
             cursor.execute('''
-                CREATE TABLE IF NOT EXISTS courses (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    direction_id INTEGER NOT NULL,
-                    title TEXT NOT NULL,
-                    description TEXT,
-                    level TEXT DEFAULT 'beginner',
-                    language TEXT NOT NULL,
-                    duration_hours INTEGER DEFAULT 0,
-                    thumbnail_url TEXT,
-                    order_index INTEGER DEFAULT 0,
-                    is_active BOOLEAN DEFAULT 1,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (direction_id) REFERENCES directions(id) ON DELETE CASCADE
-                )
+                CREATE TEMP TABLE course_progress_rebuild AS
+                SELECT p.user_id, m.course_id, COUNT(*) as completed_materials
+                FROM user_progress p
+                JOIN materials m ON p.material_id = m.id
+                WHERE p.completed = 1
+                GROUP BY p.user_id, m.course_id
             ''')
             
-            # Materials (darsliklar) table
+            # Rows that are missing, stale or extra in the summary table
             cursor.execute('''
-                CREATE TABLE IF NOT EXISTS materials (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    course_id INTEGER NOT NULL,
-                    title TEXT NOT NULL,
-                    description TEXT,
-                    type TEXT NOT NULL,
-                    file_id TEXT,
-                    file_url TEXT,
-                    file_size INTEGER DEFAULT 0,
-                    duration INTEGER DEFAULT 0,
-                    order_index INTEGER DEFAULT 0,
-                    is_free BOOLEAN DEFAULT 1,
-                    xp_reward INTEGER DEFAULT 10,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (course_id) REFERENCES courses(id) ON DELETE CASCADE
-                )
+                SELECT (
+                    SELECT COUNT(*) FROM (
+                        SELECT user_id, course_id, completed_materials
+                        FROM course_progress_rebuild
+                        EXCEPT
+                        SELECT user_id, course_id, completed_materials
+                        FROM user_course_progress
+                    )
+                ) + (
+                    SELECT COUNT(*) FROM user_course_progress s
+                    WHERE s.completed_materials != 0 AND NOT EXISTS (
+                        SELECT 1 FROM course_progress_rebuild r
+                        WHERE r.user_id = s.user_id AND r.course_id = s.course_id
+                    )
+                ) as count
             ''')
+            mismatched = cursor.fetchone()['count']
             
-            # User progress table
+            cursor.execute('DELETE FROM user_course_progress')
             cursor.execute('''
-                CREATE TABLE IF NOT EXISTS user_progress (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    material_id INTEGER NOT NULL,
-                    completed BOOLEAN DEFAULT 0,
-                    progress_percent INTEGER DEFAULT 0,
-                    last_position INTEGER DEFAULT 0,
-                    time_spent INTEGER DEFAULT 0,
-                    completed_at TIMESTAMP,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-                    FOREIGN KEY (material_id) REFERENCES materials(id) ON DELETE CASCADE,
-                    UNIQUE(user_id, material_id)
-                )
+                INSERT INTO user_course_progress (user_id, course_id, completed_materials)
+                SELECT user_id, course_id, completed_materials FROM course_progress_rebuild
             ''')
+            rows = cursor.rowcount
+            cursor.execute('DROP TABLE course_progress_rebuild')
             
-            # Favorites table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS favorites (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    material_id INTEGER NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-                    FOREIGN KEY (material_id) REFERENCES materials(id) ON DELETE CASCADE,
-                    UNIQUE(user_id, material_id)
-                )
-            ''')
+            logger.info(f"✅ Rebuilt user_course_progress: {rows} rows, {mismatched} mismatched")
+            return {'rows': rows, 'mismatched': mismatched}
+    
+    # ==================== MIGRATION FROM OLD DB ====================
+    
+    def _migrate_stage(self, old_conn: sqlite3.Connection, stage: str, query: str,
+                       write: Callable[[sqlite3.Cursor, List[sqlite3.Row]], None],
+                       batch_size: int) -> int:
+        """Copy one source query in chunks, committing a checkpoint with each
+        
+        `query` must select the source rowid as `rid`, filter on
+        `rowid > ?` and order by rowid, so a rerun continues after the last
+        committed chunk.
+        """
+        key = f'migration:{stage}'
+        checkpoint = self.get_meta(key, 0)
+        if checkpoint:
+            logger.info(f"Resuming {stage} after source row {checkpoint}")
+        
+        old_cursor = old_conn.cursor()
+        old_cursor.execute(query, (checkpoint,))
+        
+        started = time.monotonic()
+        done = 0
+        while True:
+            rows = old_cursor.fetchmany(batch_size)
+            if not rows:
+                break
             
-            # Achievements table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS achievements (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    description TEXT,
-                    icon_url TEXT,
-                    xp_reward INTEGER DEFAULT 0,
-                    condition_type TEXT NOT NULL,
-                    condition_value INTEGER DEFAULT 1,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
+            with self.unit_of_work() as uow:
+                cursor = uow.connection().cursor()
+                write(cursor, rows)
+                cursor.execute('''
+                    INSERT INTO app_meta (key, value) VALUES (?, ?)
+                    ON CONFLICT(key) DO UPDATE SET value = excluded.value
+                ''', (key, rows[-1]['rid']))
             
-            # User achievements table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS user_achievements (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    achievement_id INTEGER NOT NULL,
-                    unlocked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-                    FOREIGN KEY (achievement_id) REFERENCES achievements(id) ON DELETE CASCADE,
-                    UNIQUE(user_id, achievement_id)
-                )
-            ''')
+            done += len(rows)
+            elapsed = time.monotonic() - started
+            logger.info(f"Migrating {stage}: {done} rows "
+                        f"({done / elapsed if elapsed else 0:.0f} rows/sec)")
+        
+        return done
+    
+    def migrate_from_old_db(self, old_db_path: str = 'bot_data.db',
+                            batch_size: int = MIGRATION_BATCH_SIZE,
+                            resume: bool = False):
+        """Migrate data from old bot database
+        
+        Source rows are streamed with fetchmany and written in chunks of
+        `batch_size`, each in its own transaction together with a
+        checkpoint. With `resume`, an interrupted run continues from the
+        checkpoints instead of starting over.
+        """
+        try:
+            old_conn = sqlite3.connect(old_db_path)
+            old_conn.row_factory = sqlite3.Row
             
-            # Daily challenges table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS daily_challenges (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    date DATE UNIQUE NOT NULL,
-                    challenge_type TEXT NOT NULL,
-                    target_value INTEGER DEFAULT 1,
-                    xp_reward INTEGER DEFAULT 50,
-                    description TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
+            if not resume:
+                with self.get_connection() as conn:
+                    conn.execute("DELETE FROM app_meta WHERE key LIKE 'migration:%'")
             
-            # User challenges progress
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS user_challenges (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    challenge_id INTEGER NOT NULL,
-                    progress INTEGER DEFAULT 0,
-                    completed BOOLEAN DEFAULT 0,
-                    completed_at TIMESTAMP,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-                    FOREIGN KEY (challenge_id) REFERENCES daily_challenges(id) ON DELETE CASCADE,
-                    UNIQUE(user_id, challenge_id)
-                )
-            ''')
+            # Faculties become directions...
+            def write_directions(cursor, rows):
+                cursor.executemany('''
+                    INSERT OR IGNORE INTO directions (id, name, description, is_active)
+                    VALUES (?, ?, ?, 1)
+                ''', [(f['id'], f['name'], f"Yo'nalish: {f['name']}") for f in rows])
+                self.bump_catalog_version(cursor)
             
-            # Notes table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS notes (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    material_id INTEGER NOT NULL,
-                    content TEXT NOT NULL,
-                    timestamp INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-                    FOREIGN KEY (material_id) REFERENCES materials(id) ON DELETE CASCADE
-                )
-            ''')
+            # ...each with a default English course, found again by
+            # (direction name, title) rather than by guessing ids
+            def write_courses(cursor, rows):
+                cursor.executemany('''
+                    INSERT INTO courses (direction_id, title, description, language, level)
+                    SELECT d.id, ?, 'Ingliz tili darslari', 'english', 'beginner'
+                    FROM directions d
+                    WHERE d.name = ?
+                      AND NOT EXISTS (SELECT 1 FROM courses c
+                                      WHERE c.direction_id = d.id AND c.title = ?)
+                ''', [(f"English - {f['name']}", f['name'], f"English - {f['name']}")
+                      for f in rows])
+                self.bump_catalog_version(cursor)
             
-            # Analytics events table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS analytics_events (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    event_type TEXT NOT NULL,
-                    event_data TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE SET NULL
-                )
-            ''')
+            # Lessons become materials of their faculty's course
+            def write_materials(cursor, rows):
+                cursor.executemany('''
+                    INSERT INTO materials 
+                    (course_id, title, description, type, file_id, order_index)
+                    SELECT c.id, ?, ?, ?, ?, ?
+                    FROM courses c
+                    JOIN directions d ON d.id = c.direction_id
+                    WHERE d.name = ? AND c.title = ?
+                ''', [(l['title'], l['description'], l['file_type'] or 'document',
+                       l['file_id'], l['lesson_number'] or 0,
+                       l['faculty_name'], f"English - {l['faculty_name']}") for l in rows])
+                self.bump_catalog_version(cursor)
             
-            # Create indexes for better performance
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_telegram_id ON users(telegram_id)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_courses_direction ON courses(direction_id)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_materials_course ON materials(course_id)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_progress_user ON user_progress(user_id)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_progress_material ON user_progress(material_id)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_favorites_user ON favorites(user_id)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_analytics_type ON analytics_events(event_type)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_analytics_date ON analytics_events(created_at)')
+            def write_users(cursor, rows):
+                cursor.executemany('''
+                    INSERT OR IGNORE INTO users 
+                    (telegram_id, username, full_name, direction_id)
+                    VALUES (?, ?, ?, (SELECT id FROM directions WHERE name = ?))
+                ''', [(u['user_id'], u['username'], u['full_name'], u['faculty_name'])
+                      for u in rows])
             
-            logger.info("✅ All database tables created successfully")
-    
-    # ==================== MIGRATION FROM OLD DB ====================
-    
-    def migrate_from_old_db(self, old_db_path: str = 'bot_data.db'):
-        """Migrate data from old bot database"""
-        try:
-            old_conn = sqlite3.connect(old_db_path)
-            old_conn.row_factory = sqlite3.Row
-            old_cursor = old_conn.cursor()
+            stages = [
+                ('directions', '''
+                    SELECT rowid AS rid, id, name FROM faculties
+                    WHERE rowid > ? ORDER BY rowid
+                ''', write_directions),
+                ('courses', '''
+                    SELECT rowid AS rid, name FROM faculties
+                    WHERE rowid > ? ORDER BY rowid
+                ''', write_courses),
+                ('materials', '''
+                    SELECT l.rowid AS rid, l.title, l.file_id, l.file_type,
+                           l.description, l.lesson_number, f.name AS faculty_name
+                    FROM lessons l
+                    JOIN faculties f ON f.id = l.faculty_id
+                    WHERE l.rowid > ? ORDER BY l.rowid
+                ''', write_materials),
+                ('users', '''
+                    SELECT u.rowid AS rid, u.user_id, u.username, u.full_name,
+                           f.name AS faculty_name
+                    FROM users u
+                    LEFT JOIN faculties f ON f.id = u.faculty_id
+                    WHERE u.rowid > ? ORDER BY u.rowid
+                ''', write_users),
+            ]
             
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                
-                # Migrate faculties to directions
-                logger.info("Migrating faculties to directions...")
-                old_cursor.execute('SELECT id, name FROM faculties')
-                for faculty in old_cursor.fetchall():
-                    cursor.execute('''
-                        INSERT OR IGNORE INTO directions (id, name, description, is_active)
-                        VALUES (?, ?, ?, 1)
-                    ''', (faculty['id'], faculty['name'], f"Yo'nalish: {faculty['name']}"))
-                
-                # Migrate lessons to materials
-                logger.info("Migrating lessons to materials...")
-                old_cursor.execute('SELECT id, name FROM faculties')
-                faculties = {f['id']: f['name'] for f in old_cursor.fetchall()}
-                
-                for faculty_id, faculty_name in faculties.items():
-                    # Create a default course for each faculty
-                    cursor.execute('''
-                        INSERT OR IGNORE INTO courses 
-                        (direction_id, title, description, language, level)
-                        VALUES (?, ?, ?, ?, ?)
-                    ''', (faculty_id, f"English - {faculty_name}", 
-                          "Ingliz tili darslari", "english", "beginner"))
-                    
-                    course_id = cursor.lastrowid or faculty_id
-                    
-                    # Migrate lessons
-                    old_cursor.execute('''
-                        SELECT title, file_id, file_type, description, lesson_number
-                        FROM lessons WHERE faculty_id = ?
-                    ''', (faculty_id,))
-                    
-                    for lesson in old_cursor.fetchall():
-                        cursor.execute('''
-                            INSERT INTO materials 
-                            (course_id, title, description, type, file_id, order_index)
-                            VALUES (?, ?, ?, ?, ?, ?)
-                        ''', (course_id, lesson['title'], lesson['description'],
-                              lesson['file_type'] or 'document', lesson['file_id'],
-                              lesson['lesson_number'] or 0))
-                
-                # Migrate users
-                logger.info("Migrating users...")
-                old_cursor.execute('SELECT user_id, username, full_name, faculty_id FROM users')
-                for user in old_cursor.fetchall():
-                    cursor.execute('''
-                        INSERT OR IGNORE INTO users 
-                        (telegram_id, username, full_name, direction_id)
-                        VALUES (?, ?, ?, ?)
-                    ''', (user['user_id'], user['username'], 
-                          user['full_name'], user['faculty_id']))
+            for stage, query, write in stages:
+                logger.info(f"Migrating {stage}...")
+                self._migrate_stage(old_conn, stage, query, write, max(1, batch_size))
             
             old_conn.close()
             logger.info("✅ Migration completed successfully!")
@@ -310,24 +615,15 @@ class Database:
         with self.get_connection() as conn:
             cursor = conn.cursor()
             
-            # Initial achievements
-            achievements_data = [
-                ("Birinchi qadam", "Birinchi darsni yakunlang", "🎯", 50, "complete_first", 1),
-                ("O'quvchi", "10 ta darsni yakunlang", "📚", 100, "complete_lessons", 10),
-                ("Qat'iyatli", "7 kun ketma-ket faollik", "🔥", 200, "streak", 7),
-                ("Ustoz", "50 ta darsni yakunlang", "🎓", 500, "complete_lessons", 50),
-                ("Yulduz", "100 ta darsni yakunlang", "⭐", 1000, "complete_lessons", 100),
-            ]
-            
-            for ach in achievements_data:
-                cursor.execute('''
-                    INSERT OR IGNORE INTO achievements 
-                    (name, description, icon_url, xp_reward, condition_type, condition_value)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', ach)
+            # Initial achievements (names are unique since migration 2)
+            cursor.executemany('''
+                INSERT OR IGNORE INTO achievements 
+                (name, description, icon_url, xp_reward, condition_type, condition_value)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', ACHIEVEMENTS)
             
             logger.info("✅ Initial data seeded successfully")
 
 
-# Global database instance
+# Global database instance; opened lazily on first use
 db = Database()
@@ -0,0 +1,280 @@
+"""
+SQL instrumentation for Oriental Mini App
+Per-statement timing, row counts and calling function for every pooled
+connection, with a slow-query log and per-request aggregates
+"""
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar, Token
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+slow_logger = logging.getLogger("app.sql.slow")
+
+# Off by default; flip at runtime with set_enabled()
+SQL_INSTRUMENTATION = os.getenv("SQL_INSTRUMENTATION", "0") == "1"
+# Statements slower than this (ms) go to the slow-query log
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "50"))
+# Distinct (caller, statement) pairs tracked
+SQL_STATS_SIZE = 500
+
+_state = {
+    'enabled': SQL_INSTRUMENTATION,
+    'slow_ms': SLOW_QUERY_MS,
+}
+_lock = threading.Lock()
+_statements: Dict[Tuple[str, str], Dict[str, Any]] = {}
+_slow_queries: deque = deque(maxlen=100)
+
+_THIS_MODULE = __name__
+_SKIP_MODULES = (_THIS_MODULE, 'contextlib')
+
+
+class RequestSQLStats:
+    """SQL totals for one request, filled in while it runs"""
+
+    __slots__ = ('statements', 'time_ms', 'rows', 'slow')
+
+    def __init__(self):
+        self.statements = 0
+        self.time_ms = 0.0
+        self.rows = 0
+        self.slow = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'statements': self.statements,
+            'time_ms': round(self.time_ms, 3),
+            'rows': self.rows,
+            'slow': self.slow,
+        }
+
+
+_request_stats: ContextVar[Optional[RequestSQLStats]] = ContextVar('request_sql_stats', default=None)
+
+
+# ==================== SWITCHES ====================
+
+def is_enabled() -> bool:
+    return _state['enabled']
+
+
+def set_enabled(enabled: bool, slow_ms: float = None):
+    """Turn instrumentation on or off for connections in this process"""
+    _state['enabled'] = bool(enabled)
+    if slow_ms is not None:
+        _state['slow_ms'] = float(slow_ms)
+    logger.info(f"SQL instrumentation {'enabled' if enabled else 'disabled'} "
+                f"(slow query threshold {_state['slow_ms']}ms)")
+
+
+def begin_request() -> Tuple[RequestSQLStats, Token]:
+    """Collect SQL totals for the current request (see end_request)"""
+    stats = RequestSQLStats()
+    return stats, _request_stats.set(stats)
+
+
+def end_request(token: Token):
+    _request_stats.reset(token)
+
+
+def current_request_stats() -> Optional[RequestSQLStats]:
+    return _request_stats.get()
+
+
+# ==================== RECORDING ====================
+
+def _caller() -> str:
+    """The first frame outside this module, e.g. app.crud.crud.get_user_stats"""
+    frame = sys._getframe(2)
+    while frame is not None and frame.f_globals.get('__name__') in _SKIP_MODULES:
+        frame = frame.f_back
+    if frame is None:
+        return '?'
+    return f"{frame.f_globals.get('__name__')}.{frame.f_code.co_name}"
+
+
+def _explain(conn: sqlite3.Connection, sql: str, params) -> List[str]:
+    verb = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ''
+    if verb not in ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE'):
+        return []
+    try:
+        cursor = sqlite3.Cursor(conn)
+        cursor.row_factory = None
+        rows = cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+        return [row[-1] for row in rows]
+    except sqlite3.Error as e:
+        return [f'(plan unavailable: {e})']
+
+
+class _Statement:
+    """One execution, updated as its rows are fetched"""
+
+    __slots__ = ('sql', 'params', 'caller', 'time_ms', 'rows', 'logged')
+
+    def __init__(self, sql: str, params, caller: str):
+        self.sql = sql
+        self.params = params
+        self.caller = caller
+        self.time_ms = 0.0
+        self.rows = 0
+        self.logged = False
+
+
+def _record(conn: sqlite3.Connection, statement: _Statement, elapsed_ms: float,
+            rows: int, first: bool):
+    statement.time_ms += elapsed_ms
+    statement.rows += rows
+
+    request = _request_stats.get()
+    if request is not None:
+        request.time_ms += elapsed_ms
+        request.rows += rows
+        if first:
+            request.statements += 1
+
+    key = (statement.caller, statement.sql)
+    with _lock:
+        entry = _statements.get(key)
+        if entry is None and len(_statements) < SQL_STATS_SIZE:
+            entry = _statements[key] = {'count': 0, 'time_ms': 0.0, 'max_ms': 0.0, 'rows': 0}
+        if entry is not None:
+            if first:
+                entry['count'] += 1
+            entry['time_ms'] += elapsed_ms
+            entry['rows'] += rows
+            entry['max_ms'] = max(entry['max_ms'], statement.time_ms)
+
+    if statement.time_ms >= _state['slow_ms'] and not statement.logged:
+        statement.logged = True
+        plan = _explain(conn, statement.sql, statement.params)
+        sql = ' '.join(statement.sql.split())
+        if request is not None:
+            request.slow += 1
+        with _lock:
+            _slow_queries.append({
+                'at': time.time(),
+                'caller': statement.caller,
+                'sql': sql,
+                'time_ms': round(statement.time_ms, 3),
+                'rows': statement.rows,
+                'plan': plan,
+            })
+        slow_logger.warning(
+            f"{statement.time_ms:.1f}ms {statement.caller}: {sql}"
+            + (f" | plan: {'; '.join(plan)}" if plan else '')
+        )
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Times execute and fetch calls while instrumentation is enabled"""
+
+    _statement: Optional[_Statement] = None
+
+    def _run(self, method, sql: str, params, caller: str, explain_params):
+        statement = _Statement(sql, explain_params, caller)
+        started = time.perf_counter()
+        try:
+            return method(sql, params)
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            self._statement = statement
+            rows = self.rowcount if self.rowcount > 0 else 0
+            _record(self.connection, statement, elapsed, rows, True)
+
+    def execute(self, sql: str, params=()):
+        if not _state['enabled']:
+            return super().execute(sql, params)
+        return self._run(super().execute, sql, params, _caller(), params)
+
+    def executemany(self, sql: str, seq_of_params):
+        if not _state['enabled']:
+            return super().executemany(sql, seq_of_params)
+        # Plans need concrete parameters, which an iterator can't give twice
+        return self._run(super().executemany, sql, seq_of_params, _caller(), None)
+
+    def _fetched(self, started: float, rows: int):
+        if self._statement is not None:
+            elapsed = (time.perf_counter() - started) * 1000
+            _record(self.connection, self._statement, elapsed, rows, False)
+
+    def fetchone(self):
+        if self._statement is None:
+            return super().fetchone()
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(started, 1 if row is not None else 0)
+        return row
+
+    def fetchmany(self, size: int = None):
+        if self._statement is None:
+            return super().fetchmany(self.arraysize if size is None else size)
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(started, len(rows))
+        return rows
+
+    def fetchall(self):
+        if self._statement is None:
+            return super().fetchall()
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(started, len(rows))
+        return rows
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection factory whose cursors report to this module
+
+    With instrumentation disabled cursors are plain sqlite3 cursors, so the
+    only cost is one Python call per cursor.
+    """
+
+    def cursor(self, factory=None):
+        if factory is None:
+            factory = InstrumentedCursor if _state['enabled'] else sqlite3.Cursor
+        return super().cursor(factory)
+
+    def execute(self, sql: str, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql: str, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+
+# ==================== REPORTING ====================
+
+def sql_stats(top: int = 20) -> Dict[str, Any]:
+    """Most expensive statements by total time, plus recent slow queries"""
+    with _lock:
+        statements = [
+            {
+                'caller': caller,
+                'sql': ' '.join(sql.split()),
+                **entry,
+                'time_ms': round(entry['time_ms'], 3),
+                'max_ms': round(entry['max_ms'], 3),
+                'avg_ms': round(entry['time_ms'] / entry['count'], 3) if entry['count'] else 0.0,
+            }
+            for (caller, sql), entry in _statements.items()
+        ]
+        slow = list(_slow_queries)
+
+    statements.sort(key=lambda s: s['time_ms'], reverse=True)
+    return {
+        'enabled': _state['enabled'],
+        'slow_ms': _state['slow_ms'],
+        'statements': statements[:top],
+        'slow_queries': slow[-top:],
+    }
+
+
+def reset_stats():
+    with _lock:
+        _statements.clear()
+        _slow_queries.clear()
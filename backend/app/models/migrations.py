@@ -0,0 +1,421 @@
+"""
+Schema migrations for Oriental Mini App
+Ordered, numbered steps tracked in PRAGMA user_version; a database that
+is already current costs a single PRAGMA read
+"""
+import logging
+import sqlite3
+import time
+from typing import Any, Callable, Dict, List, NamedTuple
+
+logger = logging.getLogger(__name__)
+
+# name, description, icon, xp reward, condition type, condition value
+ACHIEVEMENTS = [
+    ("Birinchi qadam", "Birinchi darsni yakunlang", "🎯", 50, "complete_first", 1),
+    ("O'quvchi", "10 ta darsni yakunlang", "📚", 100, "complete_lessons", 10),
+    ("Qat'iyatli", "7 kun ketma-ket faollik", "🔥", 200, "streak", 7),
+    ("Ustoz", "50 ta darsni yakunlang", "🎓", 500, "complete_lessons", 50),
+    ("Yulduz", "100 ta darsni yakunlang", "⭐", 1000, "complete_lessons", 100),
+]
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    apply: Callable[[sqlite3.Cursor], None]
+
+
+MIGRATIONS: List[Migration] = []
+
+
+def migration(version: int, description: str):
+    """Register a schema step; versions must be added in increasing order"""
+    def register(func: Callable[[sqlite3.Cursor], None]):
+        if MIGRATIONS and version <= MIGRATIONS[-1].version:
+            raise ValueError(f"Migration {version} registered after {MIGRATIONS[-1].version}")
+        MIGRATIONS.append(Migration(version, description, func))
+        return func
+    return register
+
+
+# ==================== MIGRATIONS ====================
+# Never edit a migration that has shipped; add a new one instead.
+
+@migration(1, "Baseline schema")
+def _baseline(cursor: sqlite3.Cursor):
+    """Tables and indexes as previously created by Database.create_tables
+    
+    Every statement is idempotent, so databases created before versioning
+    (user_version 0) pass through this step unchanged.
+    """
+    # Users table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id BIGINT UNIQUE NOT NULL,
+            username TEXT,
+            full_name TEXT,
+            direction_id INTEGER,
+            xp_points INTEGER DEFAULT 0,
+            level INTEGER DEFAULT 1,
+            streak_days INTEGER DEFAULT 0,
+            last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_admin BOOLEAN DEFAULT 0,
+            progress_version INTEGER DEFAULT 0,
+            FOREIGN KEY (direction_id) REFERENCES directions(id)
+        )
+    ''')
+    
+    # Databases created before progress_version existed
+    cursor.execute('PRAGMA table_info(users)')
+    if 'progress_version' not in {col['name'] for col in cursor.fetchall()}:
+        cursor.execute('ALTER TABLE users ADD COLUMN progress_version INTEGER DEFAULT 0')
+    
+    # Directions (yo'nalishlar) table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS directions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            description TEXT,
+            icon_url TEXT,
+            order_index INTEGER DEFAULT 0,
+            is_active BOOLEAN DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Courses table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS courses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            direction_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            description TEXT,
+            level TEXT DEFAULT 'beginner',
+            language TEXT NOT NULL,
+            duration_hours INTEGER DEFAULT 0,
+            thumbnail_url TEXT,
+            order_index INTEGER DEFAULT 0,
+            is_active BOOLEAN DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (direction_id) REFERENCES directions(id) ON DELETE CASCADE
+        )
+    ''')
+    
+    # Materials (darsliklar) table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS materials (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            course_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            description TEXT,
+            type TEXT NOT NULL,
+            file_id TEXT,
+            file_url TEXT,
+            file_size INTEGER DEFAULT 0,
+            duration INTEGER DEFAULT 0,
+            order_index INTEGER DEFAULT 0,
+            is_free BOOLEAN DEFAULT 1,
+            xp_reward INTEGER DEFAULT 10,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (course_id) REFERENCES courses(id) ON DELETE CASCADE
+        )
+    ''')
+    
+    # User progress table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_progress (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            material_id INTEGER NOT NULL,
+            completed BOOLEAN DEFAULT 0,
+            progress_percent INTEGER DEFAULT 0,
+            last_position INTEGER DEFAULT 0,
+            time_spent INTEGER DEFAULT 0,
+            completed_at TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY (material_id) REFERENCES materials(id) ON DELETE CASCADE,
+            UNIQUE(user_id, material_id)
+        )
+    ''')
+    
+    # Per-user completed material counters, maintained by crud.update_progress
+    cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_course_progress'"
+    )
+    backfill_course_progress = cursor.fetchone() is None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_course_progress (
+            user_id INTEGER NOT NULL,
+            course_id INTEGER NOT NULL,
+            completed_materials INTEGER DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, course_id),
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY (course_id) REFERENCES courses(id) ON DELETE CASCADE
+        )
+    ''')
+    
+    # Favorites table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS favorites (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            material_id INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY (material_id) REFERENCES materials(id) ON DELETE CASCADE,
+            UNIQUE(user_id, material_id)
+        )
+    ''')
+    
+    # Achievements table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS achievements (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            description TEXT,
+            icon_url TEXT,
+            xp_reward INTEGER DEFAULT 0,
+            condition_type TEXT NOT NULL,
+            condition_value INTEGER DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # User achievements table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_achievements (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            achievement_id INTEGER NOT NULL,
+            unlocked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY (achievement_id) REFERENCES achievements(id) ON DELETE CASCADE,
+            UNIQUE(user_id, achievement_id)
+        )
+    ''')
+    
+    # Daily challenges table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_challenges (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date DATE UNIQUE NOT NULL,
+            challenge_type TEXT NOT NULL,
+            target_value INTEGER DEFAULT 1,
+            xp_reward INTEGER DEFAULT 50,
+            description TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # User challenges progress
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_challenges (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            challenge_id INTEGER NOT NULL,
+            progress INTEGER DEFAULT 0,
+            completed BOOLEAN DEFAULT 0,
+            completed_at TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY (challenge_id) REFERENCES daily_challenges(id) ON DELETE CASCADE,
+            UNIQUE(user_id, challenge_id)
+        )
+    ''')
+    
+    # Notes table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS notes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            material_id INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            timestamp INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY (material_id) REFERENCES materials(id) ON DELETE CASCADE
+        )
+    ''')
+    
+    # Analytics events table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS analytics_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            event_type TEXT NOT NULL,
+            event_data TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE SET NULL
+        )
+    ''')
+    
+    # Daily analytics aggregates (0 = no material / direction)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS analytics_daily (
+            day DATE NOT NULL,
+            event_type TEXT NOT NULL,
+            material_id INTEGER NOT NULL DEFAULT 0,
+            direction_id INTEGER NOT NULL DEFAULT 0,
+            events INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, event_type, material_id, direction_id)
+        )
+    ''')
+    
+    # Small key/value table for counters such as the catalog version
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS app_meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO app_meta (key, value) VALUES ('catalog_version', 1)")
+    cursor.execute(
+        "INSERT OR IGNORE INTO app_meta (key, value) VALUES ('analytics_rollup_watermark', 0)"
+    )
+    
+    # Create indexes for better performance
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_telegram_id ON users(telegram_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_xp ON users(xp_points)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_last_active ON users(last_active)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_courses_direction ON courses(direction_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_materials_course ON materials(course_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_progress_user ON user_progress(user_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_progress_material ON user_progress(material_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_favorites_user ON favorites(user_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_analytics_type ON analytics_events(event_type)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_analytics_date ON analytics_events(created_at)')
+    
+    if backfill_course_progress:
+        cursor.execute('''
+            INSERT INTO user_course_progress (user_id, course_id, completed_materials)
+            SELECT p.user_id, m.course_id, COUNT(*)
+            FROM user_progress p
+            JOIN materials m ON p.material_id = m.id
+            WHERE p.completed = 1
+            GROUP BY p.user_id, m.course_id
+        ''')
+
+
+@migration(2, "Unique achievement names and seeded achievements")
+def _unique_achievements(cursor: sqlite3.Cursor):
+    """Startup used to re-insert the achievements on every run, since
+    INSERT OR IGNORE had no constraint to trip on. Keep the oldest copy of
+    each name, move unlocks over to it and make names unique."""
+    keepers = 'SELECT MIN(id) FROM achievements GROUP BY name'
+    cursor.execute(f'''
+        UPDATE OR IGNORE user_achievements
+        SET achievement_id = (
+            SELECT MIN(k.id) FROM achievements k
+            JOIN achievements a ON a.name = k.name
+            WHERE a.id = user_achievements.achievement_id
+        )
+        WHERE achievement_id NOT IN ({keepers})
+    ''')
+    cursor.execute(f'DELETE FROM user_achievements WHERE achievement_id NOT IN ({keepers})')
+    cursor.execute(f'DELETE FROM achievements WHERE id NOT IN ({keepers})')
+    if cursor.rowcount > 0:
+        logger.info(f"Removed {cursor.rowcount} duplicate achievements")
+    
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_achievements_name ON achievements(name)')
+    cursor.executemany('''
+        INSERT OR IGNORE INTO achievements
+        (name, description, icon_url, xp_reward, condition_type, condition_value)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', ACHIEVEMENTS)
+
+
+@migration(3, "Composite indexes for the hot catalog and favorites queries")
+def _composite_indexes(cursor: sqlite3.Cursor):
+    """Chosen with index_advisor.py against a generated dataset
+    
+    The ordered lists (materials of a course, courses of a direction,
+    a user's favorites) sorted in a temp B-tree on every request; these
+    indexes return rows already in order (rowid breaks order_index ties).
+    Each replaces a single-column index that is its prefix. Two indexes
+    that duplicated UNIQUE constraints are dropped to save writes on the
+    busiest tables.
+    """
+    cursor.execute('DROP INDEX IF EXISTS idx_materials_course')
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_materials_course_order ON materials(course_id, order_index)'
+    )
+    cursor.execute('DROP INDEX IF EXISTS idx_courses_direction')
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_courses_direction_order ON courses(direction_id, order_index)'
+    )
+    cursor.execute('DROP INDEX IF EXISTS idx_favorites_user')
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_favorites_user_created ON favorites(user_id, created_at)'
+    )
+    
+    # Same leading columns as UNIQUE(telegram_id) and UNIQUE(user_id, material_id)
+    cursor.execute('DROP INDEX IF EXISTS idx_users_telegram_id')
+    cursor.execute('DROP INDEX IF EXISTS idx_progress_user')
+    
+    # On an analyzed database the planner would keep preferring the old
+    # indexes it has statistics for
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'")
+    if cursor.fetchone():
+        for index in ('idx_materials_course_order', 'idx_courses_direction_order',
+                      'idx_favorites_user_created'):
+            cursor.execute(f'ANALYZE {index}')
+
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+# ==================== RUNNER ====================
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def apply_migrations(conn: sqlite3.Connection) -> Dict[str, Any]:
+    """Apply every migration newer than the database's user_version
+    
+    Each step runs in its own IMMEDIATE transaction together with the
+    user_version bump, so an interrupted upgrade resumes at the failed
+    step and concurrent workers never apply the same step twice.
+    """
+    started = time.perf_counter()
+    version = schema_version(conn)
+    applied = []
+    
+    if version > LATEST_VERSION:
+        logger.warning(f"Database schema v{version} is newer than this code (v{LATEST_VERSION})")
+    
+    for step in MIGRATIONS:
+        if step.version <= version:
+            continue
+        step_started = time.perf_counter()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Another process may have upgraded while we waited for the lock
+            version = schema_version(conn)
+            if step.version <= version:
+                conn.rollback()
+                continue
+            step.apply(conn.cursor())
+            conn.execute(f'PRAGMA user_version = {step.version}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.error(f"❌ Migration {step.version} ({step.description}) failed")
+            raise
+        version = step.version
+        applied.append(step.version)
+        logger.info(f"✅ Migration {step.version} applied: {step.description} "
+                    f"({(time.perf_counter() - step_started) * 1000:.1f}ms)")
+    
+    return {
+        'version': version,
+        'applied': applied,
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 3),
+    }
@@ -0,0 +1 @@
+from app.schemas.progress import ProgressBatch, ProgressUpdate
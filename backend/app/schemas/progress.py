@@ -0,0 +1,26 @@
+"""
+Progress request schemas for Oriental Mini App
+"""
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
+
+# Largest number of updates accepted in one batch request
+MAX_PROGRESS_BATCH = 500
+
+
+class ProgressUpdate(BaseModel):
+    """One progress report for a material, as queued by the client"""
+    material_id: int
+    progress_percent: int = Field(0, ge=0, le=100)
+    # Left out (None) keeps the stored completion, so heartbeats can't undo it
+    completed: Optional[bool] = None
+    last_position: int = Field(0, ge=0)
+    time_spent: int = Field(0, ge=0)
+    # When the client recorded the update (ms since epoch); orders the batch
+    client_ts: Optional[int] = None
+
+
+class ProgressBatch(BaseModel):
+    """Queued progress updates flushed in a single request"""
+    updates: List[ProgressUpdate] = Field(..., min_length=1, max_length=MAX_PROGRESS_BATCH)
@@ -0,0 +1,380 @@
+"""
+In-process HTTP benchmark for the Mini App API
+
+Drives app.main through an ASGI client with locally minted Telegram
+initData, replaying the user journeys the frontend makes: home,
+directions, courses, course detail, material view, progress heartbeats,
+favorites and leaderboard. Reports p50/p95/p99 latency, throughput and SQL
+statements per request for every endpoint, saves the results as JSON and
+compares them with a stored baseline.
+
+    cd backend
+    python -m benchmarks.api_bench --concurrency 32 --duration 30
+    python -m benchmarks.api_bench --db loadtest.db --save-baseline
+
+Without --db a temporary database with a small catalog is used. A --db
+database is copied to a temporary directory first: the benchmark writes
+progress, favorites and new users, and the original stays untouched.
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlencode
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+DEFAULT_RESULTS = os.path.join(BENCH_DIR, 'results')
+BOT_TOKEN = '123456:BENCHMARK'
+
+# Statements executed on behalf of the request being measured
+_statements: ContextVar[Optional[List[int]]] = ContextVar('bench_statements', default=None)
+
+
+def mint_init_data(telegram_id: int, bot_token: str = BOT_TOKEN) -> str:
+    """Telegram WebApp initData signed the way verify_telegram_webapp_data expects"""
+    fields = {
+        'auth_date': str(int(time.time())),
+        'query_id': f'bench{telegram_id}',
+        'user': json.dumps({
+            'id': telegram_id,
+            'first_name': 'Bench',
+            'last_name': str(telegram_id),
+            'username': f'bench{telegram_id}',
+        }),
+    }
+    data_check_string = '\n'.join(f'{k}={v}' for k, v in sorted(fields.items()))
+    secret_key = hmac.new(b'WebAppData', bot_token.encode(), hashlib.sha256).digest()
+    fields['hash'] = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode(fields)
+
+
+def count_statements(sql: str):
+    counter = _statements.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+def copy_database(path: str) -> str:
+    """Snapshot a database (WAL included) into a temporary directory"""
+    copy = os.path.join(tempfile.mkdtemp(), os.path.basename(path))
+    source = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    target = sqlite3.connect(copy)
+    try:
+        source.backup(target)
+    finally:
+        source.close()
+        target.close()
+    return copy
+
+
+def seed_catalog(crud):
+    """Small catalog for runs against an empty database"""
+    for d in range(3):
+        direction_id = crud.create_direction(f"Bench direction {d}")
+        for c in range(4):
+            course_id = crud.create_course(direction_id, f"Bench course {d}.{c}", 'english')
+            for m in range(10):
+                crud.create_material(course_id, f"Bench lesson {d}.{c}.{m}", 'video',
+                                     order_index=m)
+
+
+def load_catalog(db) -> Dict[int, Dict[int, List[int]]]:
+    """direction -> course -> material ids, active content only"""
+    catalog: Dict[int, Dict[int, List[int]]] = {}
+    with db.get_connection() as conn:
+        rows = conn.execute('''
+            SELECT c.direction_id, c.id as course_id, m.id as material_id
+            FROM courses c
+            JOIN directions d ON d.id = c.direction_id
+            JOIN materials m ON m.course_id = c.id
+            WHERE c.is_active = 1 AND d.is_active = 1
+        ''').fetchall()
+    for row in rows:
+        catalog.setdefault(row['direction_id'], {}) \
+               .setdefault(row['course_id'], []).append(row['material_id'])
+    return catalog
+
+
+def pick_users(db, count: int, rng: random.Random) -> List[int]:
+    """Telegram ids of existing users, topped up with new ones"""
+    with db.get_connection() as conn:
+        ids = [row['telegram_id'] for row in conn.execute(
+            'SELECT telegram_id FROM users ORDER BY id'
+        ).fetchall()]
+    ids = rng.sample(ids, min(count, len(ids)))
+    return ids + [900_000_000 + i for i in range(count - len(ids))]
+
+
+class Recorder:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+        self.statements: Dict[str, List[int]] = {}
+        self.errors: Dict[str, int] = {}
+        self.enabled = False
+    
+    def add(self, name: str, seconds: float, statements: int, ok: bool):
+        if not self.enabled:
+            return
+        self.samples.setdefault(name, []).append(seconds * 1000)
+        self.statements.setdefault(name, []).append(statements)
+        if not ok:
+            self.errors[name] = self.errors.get(name, 0) + 1
+    
+    def summary(self, wall_seconds: float) -> Dict[str, Dict[str, Any]]:
+        results = {}
+        for name, samples in sorted(self.samples.items()):
+            cuts = statistics.quantiles(samples, n=100) if len(samples) > 1 else samples * 99
+            results[name] = {
+                'requests': len(samples),
+                'errors': self.errors.get(name, 0),
+                'rps': round(len(samples) / wall_seconds, 1),
+                'mean_ms': round(statistics.fmean(samples), 3),
+                'p50_ms': round(cuts[49], 3),
+                'p95_ms': round(cuts[94], 3),
+                'p99_ms': round(cuts[98], 3),
+                'statements': round(statistics.fmean(self.statements[name]), 2),
+            }
+        return results
+
+
+async def request(client, recorder: Recorder, name: str, method: str, url: str, **kwargs):
+    counter = [0]
+    token = _statements.set(counter)
+    started = time.perf_counter()
+    try:
+        response = await client.request(method, url, **kwargs)
+        ok = response.status_code < 400
+    except Exception:
+        ok = False
+    finally:
+        _statements.reset(token)
+    recorder.add(name, time.perf_counter() - started, counter[0], ok)
+
+
+async def journey(client, recorder: Recorder, headers: Dict[str, str],
+                  catalog, rng: random.Random, heartbeats: int):
+    """One pass through the app, in the order the frontend makes the calls"""
+    await request(client, recorder, 'home', 'GET', '/api/auth/me', headers=headers)
+    await request(client, recorder, 'directions', 'GET', '/api/directions', headers=headers)
+    
+    direction_id = rng.choice(list(catalog))
+    await request(client, recorder, 'courses', 'GET', '/api/courses',
+                  params={'direction_id': direction_id}, headers=headers)
+    
+    course_id = rng.choice(list(catalog[direction_id]))
+    await request(client, recorder, 'course_detail', 'GET', f'/api/courses/{course_id}',
+                  headers=headers)
+    
+    material_id = rng.choice(catalog[direction_id][course_id])
+    await request(client, recorder, 'material', 'GET', f'/api/materials/{material_id}',
+                  headers=headers)
+    
+    for beat in range(1, heartbeats + 1):
+        completed = beat == heartbeats and rng.random() < 0.3
+        await request(client, recorder, 'progress', 'POST',
+                      f'/api/materials/{material_id}/progress',
+                      params={'progress_percent': 100 if completed else beat * 10,
+                              'last_position': beat * 15, 'time_spent': 15,
+                              'completed': completed},
+                      headers=headers)
+    
+    if rng.random() < 0.2:
+        await request(client, recorder, 'favorite_add', 'POST',
+                      f'/api/favorites/{material_id}', headers=headers)
+    await request(client, recorder, 'favorites', 'GET', '/api/favorites', headers=headers)
+    await request(client, recorder, 'leaderboard', 'GET', '/api/leaderboard', headers=headers)
+
+
+async def run(args) -> Dict[str, Any]:
+    # The app reads its configuration at import time
+    if args.db:
+        if not os.path.exists(args.db):
+            sys.exit(f"❌ {args.db} does not exist")
+        os.environ['DATABASE_PATH'] = copy_database(args.db)
+    else:
+        os.environ['DATABASE_PATH'] = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ['BOT_TOKEN'] = BOT_TOKEN
+    os.environ.setdefault('ADMIN_STATS_REFRESH', '0')
+    sys.path.insert(0, os.path.dirname(BENCH_DIR))
+    
+    import httpx
+    from app.crud import crud
+    from app.main import app
+    from app.models.database import db
+    
+    # app.main configures INFO logging; keep httpx from logging every request
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    
+    # Count statements on every pooled connection opened from now on
+    connect = db.pool._connect
+    
+    def traced_connect():
+        conn = connect()
+        conn.set_trace_callback(count_statements)
+        return conn
+    
+    db.pool._connect = traced_connect
+    db.pool.close()
+    
+    rng = random.Random(args.seed)
+    catalog = load_catalog(db)
+    if not catalog:
+        seed_catalog(crud)
+        catalog = load_catalog(db)
+    users = pick_users(db, args.users, rng)
+    
+    recorder = Recorder()
+    deadline = 0.0
+    
+    async def virtual_user(index: int):
+        user_rng = random.Random(args.seed * 1000 + index)
+        telegram_id = users[index % len(users)]
+        headers = {'Authorization': f'tma {mint_init_data(telegram_id)}'}
+        while time.monotonic() < deadline:
+            await journey(client, recorder, headers, catalog, user_rng, args.heartbeats)
+    
+    await app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+            print(f"🔥 Warming up for {args.warmup}s...")
+            deadline = time.monotonic() + args.warmup
+            await asyncio.gather(*(virtual_user(i) for i in range(args.concurrency)))
+            
+            print(f"⏱️  Measuring {args.concurrency} virtual users for {args.duration}s...")
+            recorder.enabled = True
+            started = time.monotonic()
+            deadline = started + args.duration
+            await asyncio.gather(*(virtual_user(i) for i in range(args.concurrency)))
+            wall = time.monotonic() - started
+    finally:
+        await app.router.shutdown()
+    
+    endpoints = recorder.summary(wall)
+    total = sum(e['requests'] for e in endpoints.values())
+    return {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'concurrency': args.concurrency,
+            'duration_s': round(wall, 2),
+            'users': len(users),
+            'heartbeats': args.heartbeats,
+            'seed': args.seed,
+            'database': args.db or 'temporary',
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+        },
+        'total': {
+            'requests': total,
+            'errors': sum(e['errors'] for e in endpoints.values()),
+            'rps': round(total / wall, 1),
+        },
+        'endpoints': endpoints,
+    }
+
+
+def print_results(results: Dict[str, Any]):
+    print(f"\n{'endpoint':<15}{'reqs':>8}{'err':>6}{'rps':>9}{'p50':>9}{'p95':>9}"
+          f"{'p99':>9}{'sql':>7}")
+    for name, e in results['endpoints'].items():
+        print(f"{name:<15}{e['requests']:>8}{e['errors']:>6}{e['rps']:>9.1f}"
+              f"{e['p50_ms']:>9.2f}{e['p95_ms']:>9.2f}{e['p99_ms']:>9.2f}{e['statements']:>7.1f}")
+    total = results['total']
+    print(f"{'total':<15}{total['requests']:>8}{total['errors']:>6}{total['rps']:>9.1f}")
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Print the change against the baseline; returns the regressions found"""
+    regressions = []
+    print(f"\nvs baseline {baseline['meta']['timestamp']} (tolerance {tolerance:.0%})")
+    for key in ('concurrency', 'users', 'heartbeats', 'database'):
+        if baseline['meta'].get(key) != results['meta'][key]:
+            print(f"   note: {key} differs ({baseline['meta'].get(key)} -> {results['meta'][key]})")
+    print(f"{'endpoint':<15}{'p50':>10}{'p95':>10}{'p99':>10}{'rps':>10}{'sql':>8}")
+    
+    change = lambda new, old: (new - old) / old if old else 0.0
+    for name, e in results['endpoints'].items():
+        base = baseline['endpoints'].get(name)
+        if base is None:
+            print(f"{name:<15}{'(new)':>10}")
+            continue
+        deltas = {key: change(e[key], base[key])
+                  for key in ('p50_ms', 'p95_ms', 'p99_ms', 'rps')}
+        print(f"{name:<15}{deltas['p50_ms']:>+10.1%}{deltas['p95_ms']:>+10.1%}"
+              f"{deltas['p99_ms']:>+10.1%}{deltas['rps']:>+10.1%}"
+              f"{e['statements'] - base['statements']:>+8.1f}")
+        
+        if deltas['p95_ms'] > tolerance:
+            regressions.append(f"{name}: p95 {base['p95_ms']}ms -> {e['p95_ms']}ms")
+        if deltas['rps'] < -tolerance:
+            regressions.append(f"{name}: throughput {base['rps']} -> {e['rps']} req/s")
+        if e['statements'] > base['statements'] + 0.5:
+            regressions.append(f"{name}: {base['statements']} -> {e['statements']} statements")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--db', help="database to run a copy of (e.g. from generate_dataset.py)")
+    parser.add_argument('--concurrency', type=int, default=16, help="virtual users")
+    parser.add_argument('--users', type=int, default=200, help="distinct Telegram users")
+    parser.add_argument('--duration', type=float, default=10, help="measured seconds")
+    parser.add_argument('--warmup', type=float, default=2, help="unmeasured seconds first")
+    parser.add_argument('--heartbeats', type=int, default=3,
+                        help="progress updates per material view")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="results file (default: results/<timestamp>.json)")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="baseline to compare with")
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="store these results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="allowed relative slowdown before flagging a regression")
+    parser.add_argument('--fail-on-regression', action='store_true',
+                        help="exit with status 1 when a regression is found")
+    args = parser.parse_args()
+    
+    results = asyncio.run(run(args))
+    print_results(results)
+    
+    output = args.output or os.path.join(
+        DEFAULT_RESULTS, datetime.utcnow().strftime('%Y%m%dT%H%M%SZ') + '.json'
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\n💾 Results saved to {output}")
+    
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"   ⚠️ {regression}")
+    
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"📌 Baseline saved to {args.baseline}")
+    
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
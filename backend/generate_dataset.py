@@ -0,0 +1,281 @@
+"""
+Generate a large synthetic dataset for load and capacity testing
+
+Sizes default to production scale (200 directions, 5k courses, 100k
+materials, 500k users, 20M progress rows); use --scale to shrink them all
+at once. The same --seed always produces the same data.
+"""
+import argparse
+import bisect
+import itertools
+import math
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+from app.models.database import Database
+
+MATERIAL_TYPES = [('video', 40), ('audio', 20), ('pdf', 20), ('text', 15), ('quiz', 5)]
+LANGUAGES = ['english', 'russian', 'uzbek', 'korean', 'german']
+LEVELS = ['beginner', 'intermediate', 'advanced']
+
+# Tables filled here; their secondary indexes are rebuilt after loading
+TABLES = ('directions', 'courses', 'materials', 'users', 'user_progress',
+          'favorites', 'analytics_events')
+
+
+def zipf_cum_weights(n: int, s: float):
+    """Cumulative Zipf weights for ranks 1..n"""
+    return list(itertools.accumulate(1 / (rank ** s) for rank in range(1, n + 1)))
+
+
+def timestamp(now: datetime, days_back: float) -> str:
+    return (now - timedelta(days=days_back)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class Report:
+    def __init__(self):
+        self.started = time.monotonic()
+    
+    def table(self, name: str, rows: int, started: float):
+        elapsed = time.monotonic() - started
+        print(f"   {name}: {rows:,} rows in {elapsed:.1f}s "
+              f"({rows / elapsed if elapsed else 0:,.0f} rows/sec)")
+
+
+def bulk_connection(path: str) -> sqlite3.Connection:
+    """Connection tuned for a one-off load: no journal, no fsync"""
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA foreign_keys = OFF')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    conn.execute('PRAGMA cache_size = -262144')  # 256 MiB
+    return conn
+
+
+def drop_indexes(conn: sqlite3.Connection):
+    """Drop secondary indexes on the loaded tables; returns their DDL"""
+    placeholders = ','.join('?' * len(TABLES))
+    indexes = conn.execute(f'''
+        SELECT name, sql FROM sqlite_master
+        WHERE type = 'index' AND sql IS NOT NULL AND tbl_name IN ({placeholders})
+    ''', TABLES).fetchall()
+    for name, _ in indexes:
+        conn.execute(f'DROP INDEX {name}')
+    return [sql for _, sql in indexes]
+
+
+def insert(conn: sqlite3.Connection, report: Report, table: str, sql: str, rows) -> int:
+    """executemany over a row generator inside one transaction"""
+    started = time.monotonic()
+    counter = itertools.count()
+    
+    def counted():
+        for row in rows:
+            next(counter)
+            yield row
+    
+    conn.execute('BEGIN')
+    conn.executemany(sql, counted())
+    conn.execute('COMMIT')
+    
+    count = next(counter)
+    report.table(table, count, started)
+    return count
+
+
+def generate(args):
+    rng = random.Random(args.seed)
+    now = datetime.utcnow().replace(microsecond=0)
+    scale = lambda n: max(1, int(n * args.scale))
+    
+    n_directions = scale(args.directions)
+    n_courses = max(n_directions, scale(args.courses))
+    n_materials = max(n_courses, scale(args.materials))
+    n_users = scale(args.users)
+    n_progress = scale(args.progress)
+    n_favorites = scale(args.favorites)
+    n_events = scale(args.events)
+    
+    if os.path.exists(args.db):
+        if not args.force:
+            sys.exit(f"❌ {args.db} already exists, pass --force to replace it")
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+    
+    print(f"🏗️  Generating dataset in {args.db} (seed {args.seed})...")
+    report = Report()
+    
+    # Schema and achievements come from the application itself
+    database = Database(args.db, pool_size=1)
+    database.seed_initial_data()
+    database.close()
+    
+    conn = bulk_connection(args.db)
+    index_ddl = drop_indexes(conn)
+    
+    # Catalog: courses spread over directions, materials over courses
+    course_direction = [d + 1 for d in range(n_directions)]
+    course_direction += [rng.randint(1, n_directions) for _ in range(n_courses - n_directions)]
+    material_course = [c + 1 for c in range(n_courses)]
+    material_course += [rng.randint(1, n_courses) for _ in range(n_materials - n_courses)]
+    material_course.sort()
+    types, type_weights = zip(*MATERIAL_TYPES)
+    material_xp = [rng.choice((10, 10, 10, 15, 20)) for _ in range(n_materials)]
+    
+    insert(conn, report, 'directions', '''
+        INSERT INTO directions (id, name, description, icon_url, order_index)
+        VALUES (?, ?, ?, ?, ?)
+    ''', ((d, f"Direction {d}", f"Synthetic direction {d}", '🎓', d)
+          for d in range(1, n_directions + 1)))
+    
+    insert(conn, report, 'courses', '''
+        INSERT INTO courses (id, direction_id, title, description, level, language,
+                             duration_hours, order_index)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', ((c, course_direction[c - 1], f"Course {c}", f"Synthetic course {c}",
+           rng.choice(LEVELS), rng.choice(LANGUAGES), rng.randint(1, 40), c)
+          for c in range(1, n_courses + 1)))
+    
+    insert(conn, report, 'materials', '''
+        INSERT INTO materials (id, course_id, title, description, type, file_url,
+                               file_size, duration, order_index, xp_reward)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', ((m, material_course[m - 1], f"Lesson {m}", f"Synthetic lesson {m}",
+           rng.choices(types, type_weights)[0], f"https://cdn.example.com/m/{m}",
+           rng.randint(10_000, 50_000_000), rng.randint(60, 3600), m, material_xp[m - 1])
+          for m in range(1, n_materials + 1)))
+    
+    # Popularity: Zipf over a shuffled material order, so popular lessons
+    # are scattered across the catalog
+    popular = list(range(1, n_materials + 1))
+    rng.shuffle(popular)
+    cum_weights = zipf_cum_weights(n_materials, args.zipf)
+    total_weight = cum_weights[-1]
+    
+    def pick_material() -> int:
+        return popular[bisect.bisect_left(cum_weights, rng.random() * total_weight)]
+    
+    # Per-user activity is log-normal: most users touch a few lessons,
+    # a long tail touches hundreds
+    sigma = 1.2
+    mu = math.log(max(n_progress / n_users, 1e-9)) - sigma ** 2 / 2
+    user_xp = [0] * (n_users + 1)
+    
+    def progress_rows():
+        for user_id in range(1, n_users + 1):
+            count = min(n_materials, round(rng.lognormvariate(mu, sigma)))
+            if not count:
+                continue
+            # Popular lessons repeat, so keep drawing (within reason) until
+            # the user has `count` distinct ones
+            materials = set()
+            for _ in range(4 * count):
+                materials.add(pick_material())
+                if len(materials) == count:
+                    break
+            materials = sorted(materials)
+            for material_id in materials:
+                completed = rng.random() < args.completion_rate
+                if completed:
+                    user_xp[user_id] += material_xp[material_id - 1]
+                updated = timestamp(now, rng.random() * 180)
+                yield (user_id, material_id, completed,
+                       100 if completed else rng.randint(0, 95),
+                       rng.randint(0, 3600), rng.randint(0, 3600),
+                       updated if completed else None, updated, updated)
+    
+    insert(conn, report, 'user_progress', '''
+        INSERT INTO user_progress (user_id, material_id, completed, progress_percent,
+                                   last_position, time_spent, completed_at,
+                                   created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', progress_rows())
+    
+    # Users last, so their XP matches the completions generated above
+    insert(conn, report, 'users', '''
+        INSERT INTO users (id, telegram_id, username, full_name, direction_id, xp_points,
+                           level, streak_days, last_active, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', ((u, 1_000_000_000 + u, f"user{u}", f"User {u}", rng.randint(1, n_directions),
+           user_xp[u], user_xp[u] // 100 + 1,
+           rng.choices((0, 1, 2, 3, 7, 14, 30), (30, 25, 15, 10, 10, 7, 3))[0],
+           timestamp(now, rng.expovariate(1 / 10)), timestamp(now, 180 + rng.random() * 365))
+          for u in range(1, n_users + 1)))
+    
+    def favorite_rows():
+        seen = set()
+        for _ in range(n_favorites):
+            key = (rng.randint(1, n_users), pick_material())
+            if key not in seen:
+                seen.add(key)
+                yield key + (timestamp(now, rng.random() * 180),)
+    
+    insert(conn, report, 'favorites', '''
+        INSERT INTO favorites (user_id, material_id, created_at) VALUES (?, ?, ?)
+    ''', favorite_rows())
+    
+    # Events in time order, as the application would have written them
+    def event_rows():
+        step = args.event_days / n_events
+        for i in range(n_events):
+            when = timestamp(now, args.event_days - i * step)
+            if rng.random() < 0.9:
+                yield (rng.randint(1, n_users), 'material_view',
+                       f"material_id:{pick_material()}", when)
+            else:
+                yield (rng.randint(1, n_users), 'login', None, when)
+    
+    insert(conn, report, 'analytics_events', '''
+        INSERT INTO analytics_events (user_id, event_type, event_data, created_at)
+        VALUES (?, ?, ?, ?)
+    ''', event_rows())
+    
+    # Deferred index builds
+    started = time.monotonic()
+    for sql in index_ddl:
+        conn.execute(sql)
+    print(f"   {len(index_ddl)} indexes built in {time.monotonic() - started:.1f}s")
+    
+    conn.execute('ANALYZE')
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.close()
+    
+    # Derived tables go through the application's own rebuild
+    database = Database(args.db, pool_size=1)
+    database.rebuild_course_progress()
+    database.close()
+    
+    print(f"✅ Dataset ready in {time.monotonic() - report.started:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--db', default='loadtest.db', help="database file to create")
+    parser.add_argument('--force', action='store_true', help="replace an existing file")
+    parser.add_argument('--seed', type=int, default=42, help="random seed")
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help="multiply every size below (e.g. 0.01 for a quick run)")
+    parser.add_argument('--directions', type=int, default=200)
+    parser.add_argument('--courses', type=int, default=5_000)
+    parser.add_argument('--materials', type=int, default=100_000)
+    parser.add_argument('--users', type=int, default=500_000)
+    parser.add_argument('--progress', type=int, default=20_000_000,
+                        help="approximate user_progress rows")
+    parser.add_argument('--favorites', type=int, default=1_000_000)
+    parser.add_argument('--events', type=int, default=5_000_000, help="analytics events")
+    parser.add_argument('--event-days', type=int, default=90,
+                        help="days of history the analytics events cover")
+    parser.add_argument('--zipf', type=float, default=1.1,
+                        help="Zipf exponent of material popularity")
+    parser.add_argument('--completion-rate', type=float, default=0.6,
+                        help="share of progress rows that are completed")
+    
+    generate(parser.parse_args())
@@ -0,0 +1,33 @@
+"""
+Bulk import directions, courses and materials from a JSON, JSON Lines or CSV file
+"""
+import argparse
+
+from app.crud.importer import IMPORT_BATCH_SIZE, IMPORT_FORMATS, detect_format, import_content
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('path', help="content file to import")
+    parser.add_argument('--format', choices=IMPORT_FORMATS,
+                        help="file format (default: from the file extension)")
+    parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE,
+                        help="rows written per transaction")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="validate and report without saving anything")
+    args = parser.parse_args()
+    
+    format = args.format or detect_format(args.path)
+    if format is None:
+        parser.error("can't tell the format from the file name, pass --format")
+    
+    print(f"📦 Importing {args.path}{' (dry run)' if args.dry_run else ''}...")
+    
+    with open(args.path, encoding='utf-8-sig', newline='') as f:
+        report = import_content(f, format, dry_run=args.dry_run, batch_size=args.batch_size)
+    
+    for table in ('directions', 'courses', 'materials'):
+        print(f"   {table}: {report[table]['created']} created, {report[table]['updated']} updated")
+    for error in report['errors']:
+        print(f"   ⚠️ row {error['row']}: {error['error']}")
+    
+    print(f"✅ {report['rows']} rows in {report['seconds']}s, {report['skipped']} skipped")
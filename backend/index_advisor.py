@@ -0,0 +1,253 @@
+"""
+Check the query plans of the crud workload against a populated database
+
+Runs the hot crud functions with ids sampled from the database, captures
+every statement they execute (writes are rolled back) and prints its
+EXPLAIN QUERY PLAN, flagging full table scans, temp B-trees and automatic
+indexes. Use it on a realistic dataset (see generate_dataset.py) after
+changing a query or the schema:
+
+    python index_advisor.py --db loadtest.db --fail
+
+Opening the database applies pending schema migrations.
+"""
+import argparse
+import os
+import re
+import sys
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+# Statements worth planning; PRAGMAs and transaction control are skipped
+PLANNED_VERBS = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+TABLE_ALIAS = re.compile(
+    r'\b(?:FROM|JOIN|UPDATE|INTO)\s+([A-Za-z_]\w*)(?:\s+(?:AS\s+)?([A-Za-z_]\w*))?',
+    re.IGNORECASE
+)
+# Literals in traced statements, replaced so each statement shape is planned once
+LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+# Words that can follow a table name but are not aliases
+NOT_ALIASES = {'on', 'where', 'group', 'order', 'limit', 'join', 'left', 'inner', 'cross',
+               'set', 'values', 'select', 'using', 'natural', 'union', 'default'}
+
+
+# Reported, but never fail the run: scans of child tables that SQLite
+# plans for foreign keys only run when a parent row is deleted or rekeyed
+ADVISORY = {'foreign key scan'}
+
+
+class Call(NamedTuple):
+    name: str
+    func: Callable
+    args: tuple
+    # Periodic jobs (snapshots, rollups) are expected to scan; they are
+    # reported but never fail the run
+    background: bool = False
+    # Finding kinds accepted for this call, e.g. sorting a handful of rows
+    accept: frozenset = frozenset()
+
+
+class Finding(NamedTuple):
+    kind: str
+    detail: str
+
+
+def sample_ids(db) -> Optional[Dict[str, int]]:
+    """A busy user and a material, course and direction they have used"""
+    with db.get_connection() as conn:
+        user = conn.execute('''
+            SELECT id, telegram_id FROM users ORDER BY xp_points DESC LIMIT 1
+        ''').fetchone()
+        if user is None:
+            return None
+        material = conn.execute('''
+            SELECT m.id, m.course_id, c.direction_id
+            FROM user_progress p
+            JOIN materials m ON p.material_id = m.id
+            JOIN courses c ON m.course_id = c.id
+            WHERE p.user_id = ?
+            LIMIT 1
+        ''', (user['id'],)).fetchone() or conn.execute('''
+            SELECT m.id, m.course_id, c.direction_id
+            FROM materials m JOIN courses c ON m.course_id = c.id
+            LIMIT 1
+        ''').fetchone()
+        if material is None:
+            return None
+        return {
+            'user_id': user['id'],
+            'telegram_id': user['telegram_id'],
+            'material_id': material['id'],
+            'course_id': material['course_id'],
+            'direction_id': material['direction_id'],
+        }
+
+
+TEMP_SORT = frozenset({'temp b-tree'})
+
+
+def workload(crud, ids: Dict[str, int]) -> List[Call]:
+    """The crud calls behind the API's hot endpoints and background jobs"""
+    tg, user = ids['telegram_id'], ids['user_id']
+    material, course, direction = ids['material_id'], ids['course_id'], ids['direction_id']
+    return [
+        Call('get_user_by_telegram_id', crud.get_user_by_telegram_id, (tg,)),
+        Call('touch_user', crud.touch_user, (tg,)),
+        Call('get_user_stats', crud.get_user_stats, (tg,)),
+        Call('get_leaderboard', crud.get_leaderboard, (10,)),
+        Call('get_user_rank', crud.get_user_rank, (user,)),
+        # A few dozen rows, cached in the catalog cache
+        Call('get_all_directions', crud.get_all_directions, (), accept=TEMP_SORT),
+        Call('get_direction_progress', crud.get_direction_progress, (user,)),
+        Call('get_courses_by_direction', crud.get_courses_by_direction, (direction,)),
+        Call('get_courses_with_progress', crud.get_courses_with_progress, (direction, user)),
+        Call('get_course_with_progress', crud.get_course_with_progress, (course, user)),
+        Call('get_materials_by_course', crud.get_materials_by_course, (course,)),
+        Call('get_material_by_id', crud.get_material_by_id, (material,)),
+        # One user's rows; an index on updated_at would be rewritten on
+        # every progress heartbeat
+        Call('get_user_progress', crud.get_user_progress, (tg,), accept=TEMP_SORT),
+        Call('get_user_progress (course)', crud.get_user_progress, (tg, course)),
+        Call('update_progress', crud.update_progress, (tg, material, 50, False, 30, 10)),
+        Call('update_progress (complete)', crud.update_progress, (tg, material, 100, True, 0, 10)),
+        Call('update_progress_batch', crud.update_progress_batch,
+             (tg, [{'material_id': material, 'progress_percent': 60, 'time_spent': 5}])),
+        Call('add_to_favorites', crud.add_to_favorites, (tg, material)),
+        Call('remove_from_favorites', crud.remove_from_favorites, (tg, material)),
+        Call('get_user_favorites', crud.get_user_favorites, (tg,)),
+        Call('check_and_award_achievements', crud.check_and_award_achievements, (tg,)),
+        Call('get_user_achievements', crud.get_user_achievements, (tg,), accept=TEMP_SORT),
+        # Admin dashboard; groups days of rollups, never raw events
+        Call('get_analytics_summary', crud.get_analytics_summary, (30,), accept=TEMP_SORT),
+        Call('get_admin_stats', crud.get_admin_stats, (), background=True),
+        Call('rollup_analytics', crud.rollup_analytics, (), background=True),
+    ]
+
+
+def capture(db, call: Call) -> List[str]:
+    """Run a call in a unit of work that is rolled back; returns its statements"""
+    statements: List[str] = []
+    with db.unit_of_work() as uow:
+        conn = uow.connection()
+        conn.set_trace_callback(statements.append)
+        try:
+            call.func(*call.args)
+        finally:
+            conn.set_trace_callback(None)
+            uow.rollback()
+    return [sql for sql in statements
+            if sql.lstrip().split(None, 1)[0].upper() in PLANNED_VERBS]
+
+
+def table_names(sql: str) -> Dict[str, str]:
+    """Map the names used in query plans (aliases included) to tables"""
+    names = {}
+    for table, alias in TABLE_ALIAS.findall(sql):
+        names[table] = table
+        if alias and alias.lower() not in NOT_ALIASES:
+            names[alias] = table
+    return names
+
+
+def plan(conn, sql: str) -> List[str]:
+    return [row[-1] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}').fetchall()]
+
+
+def findings(sql: str, steps: List[str], row_counts: Dict[str, int],
+             min_rows: int) -> List[Finding]:
+    names = table_names(sql)
+    found = []
+    for step in steps:
+        if step.startswith('SCAN ') and ' USING ' not in step:
+            name = step.split()[1]
+            table = names.get(name, name)
+            if row_counts.get(table, 0) >= min_rows:
+                kind = 'full scan' if name in names else 'foreign key scan'
+                found.append(Finding(kind, f"{table} ({row_counts[table]:,} rows)"))
+        elif 'TEMP B-TREE' in step:
+            found.append(Finding('temp b-tree', step))
+        elif 'AUTOMATIC' in step:
+            found.append(Finding('automatic index', step))
+    return found
+
+
+def advise(args) -> int:
+    # The app reads its configuration at import time
+    os.environ['DATABASE_PATH'] = args.db
+    os.environ.setdefault('BOT_TOKEN', 'index-advisor')
+    
+    from app.crud import crud
+    from app.models.database import db
+    
+    if not os.path.exists(args.db):
+        sys.exit(f"❌ {args.db} does not exist")
+    
+    schema = db.migrate()
+    ids = sample_ids(db)
+    if ids is None:
+        sys.exit(f"❌ {args.db} has no users or materials to sample")
+    
+    with db.get_connection() as conn:
+        tables = [row['name'] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+        )]
+        row_counts = {t: conn.execute(f'SELECT COUNT(*) FROM "{t}"').fetchone()[0] for t in tables}
+    
+    print(f"🔍 Checking query plans in {args.db} (schema v{schema['version']}, "
+          f"user {ids['user_id']}, course {ids['course_id']})")
+    
+    failures = 0
+    seen = set()
+    for call in workload(crud, ids):
+        started = time.perf_counter()
+        statements = capture(db, call)
+        elapsed = (time.perf_counter() - started) * 1000
+        print(f"\n{call.name}: {len(statements)} statements, {elapsed:.1f}ms"
+              + (" (background)" if call.background else ""))
+        
+        with db.get_connection() as conn:
+            for sql in statements:
+                key = LITERAL.sub('?', ' '.join(sql.split()))
+                if key in seen:
+                    continue
+                seen.add(key)
+                
+                steps = plan(conn, sql)
+                found = findings(sql, steps, row_counts, args.min_rows)
+                if not found and not args.verbose:
+                    continue
+                
+                failing = [f for f in found if not call.background
+                           and f.kind not in ADVISORY and f.kind not in call.accept]
+                marker = '❌ ' if failing else '⚠️ ' if found else '   '
+                print(f"  {marker}{key[:args.width]}")
+                for step in steps:
+                    print(f"        {step}")
+                for finding in found:
+                    note = '' if finding in failing else ' (accepted)'
+                    print(f"      → {finding.kind}: {finding.detail}{note}")
+                if failing:
+                    failures += 1
+    
+    if failures:
+        print(f"\n❌ {failures} request-path statements with full scans or temp B-trees")
+    else:
+        print("\n✅ No full scans or temp B-trees on the request path")
+    return 1 if failures and args.fail else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--db', default=os.getenv("DATABASE_PATH", "oriental_miniapp.db"),
+                        help="populated database to check")
+    parser.add_argument('--min-rows', type=int, default=1000,
+                        help="ignore full scans of tables smaller than this")
+    parser.add_argument('--fail', action='store_true',
+                        help="exit with status 1 when a request-path statement is flagged")
+    parser.add_argument('--verbose', action='store_true', help="print every plan")
+    parser.add_argument('--width', type=int, default=160, help="truncate statements to this")
+    
+    sys.exit(advise(parser.parse_args()))
@@ -1,15 +1,31 @@
 """
 Database migration script - migrate from old bot database to new mini app database
 """
-from app.models.database import db
+from app.models.database import db, MIGRATION_BATCH_SIZE
+import argparse
+import logging
 import sys
 
 if __name__ == "__main__":
-    old_db_path = sys.argv[1] if len(sys.argv) > 1 else '../bot_data.db'
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('old_db_path', nargs='?', default='../bot_data.db',
+                        help="old bot database (default: ../bot_data.db)")
+    parser.add_argument('--batch-size', type=int, default=MIGRATION_BATCH_SIZE,
+                        help="source rows copied per transaction")
+    parser.add_argument('--resume', action='store_true',
+                        help="continue an interrupted migration from its checkpoints")
+    args = parser.parse_args()
     
-    print(f"🔄 Starting migration from {old_db_path}")
+    # Show per-chunk progress (rows/sec) from the migration
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     
-    success = db.migrate_from_old_db(old_db_path)
+    print(f"🔄 Starting migration from {args.old_db_path}")
+    
+    success = db.migrate_from_old_db(
+        args.old_db_path,
+        batch_size=args.batch_size,
+        resume=args.resume
+    )
     
     if success:
         print("✅ Migration completed successfully!")
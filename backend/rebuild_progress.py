@@ -0,0 +1,11 @@
+"""
+Rebuild per-user course progress counters from user_progress
+"""
+from app.models.database import db
+
+if __name__ == "__main__":
+    print("🔄 Rebuilding user_course_progress...")
+    
+    result = db.rebuild_course_progress()
+    
+    print(f"✅ {result['rows']} rows rebuilt, {result['mismatched']} were out of date")
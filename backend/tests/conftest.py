@@ -0,0 +1,8 @@
+"""
+Shared test setup: the app reads DATABASE_PATH at import time, so every
+test module runs against one throwaway database
+"""
+import os
+import tempfile
+
+os.environ['DATABASE_PATH'] = os.path.join(tempfile.mkdtemp(), 'test.db')
@@ -0,0 +1,47 @@
+"""
+Batched progress updates, as queued by the client, must not undo a
+completion
+"""
+from app.crud import crud
+from app.models.database import db
+from app.schemas import ProgressBatch
+
+
+def course_counter(user_id: int, course_id: int) -> int:
+    with db.get_connection() as conn:
+        return conn.execute('''
+            SELECT completed_materials FROM user_course_progress
+            WHERE user_id = ? AND course_id = ?
+        ''', (user_id, course_id)).fetchone()['completed_materials']
+
+
+def test_heartbeat_after_completion_keeps_it():
+    telegram_id = 555000333
+    crud.create_user(telegram_id, 'listener', 'Listener')
+    direction_id = crud.create_direction('Heartbeats')
+    course_id = crud.create_course(direction_id, 'Heartbeat course', 'english')
+    material_id = crud.create_material(course_id, 'Lesson', 'audio', xp_reward=10)
+    
+    with db.unit_of_work():
+        assert crud.update_progress(telegram_id, material_id, 100, True, 300, 30)['newly_completed']
+    
+    # A heartbeat queued by the client leaves completed out
+    batch = ProgressBatch(updates=[{'material_id': material_id, 'progress_percent': 40,
+                                    'last_position': 120, 'time_spent': 15}])
+    with db.unit_of_work():
+        result = crud.update_progress_batch(
+            telegram_id, [update.model_dump() for update in batch.updates]
+        )
+    assert result == {'applied': 1, 'skipped': [], 'newly_completed': [], 'new_achievements': []}
+    
+    user = crud.get_user_by_telegram_id(telegram_id)
+    progress = crud.get_user_progress(telegram_id, course_id)[0]
+    assert progress['completed']
+    assert progress['last_position'] == 120
+    assert course_counter(user['id'], course_id) == 1
+    
+    # Completing it again awards nothing
+    with db.unit_of_work():
+        assert not crud.update_progress(telegram_id, material_id, 100, True, 300, 5)['newly_completed']
+    earned = sum(a['xp_reward'] for a in crud.get_user_achievements(telegram_id))
+    assert crud.get_user_by_telegram_id(telegram_id)['xp_points'] == user['xp_points'] == 10 + earned
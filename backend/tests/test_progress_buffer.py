@@ -0,0 +1,138 @@
+"""
+Buffered playback progress racing completions that are written through
+must never move a completion or a playback position backwards
+"""
+import threading
+
+from app.crud import crud
+from app.crud.progress import ProgressBuffer
+from app.models.database import db
+
+ROUNDS = 40
+
+
+def setup_course(telegram_id: int, name: str, materials: int):
+    crud.create_user(telegram_id, name.lower(), name)
+    direction_id = crud.create_direction(f'{name} direction')
+    course_id = crud.create_course(direction_id, f'{name} course', 'english')
+    return course_id, [crud.create_material(course_id, f'Lesson {i}', 'video', xp_reward=10)
+                       for i in range(materials)]
+
+
+def complete_through(buffer: ProgressBuffer, telegram_id: int, material_id: int,
+                     position: int):
+    """What the progress endpoint does for a completion"""
+    with db.unit_of_work():
+        taken = buffer.take(telegram_id, material_id)
+        db.after_rollback(lambda: buffer.restore(telegram_id, taken))
+        time_spent = sum(entry['time_spent'] for entry in taken)
+        return crud.update_progress(telegram_id, material_id, 100, True, position, time_spent)
+
+
+def stored(telegram_id: int, course_id: int, material_id: int):
+    progress = crud.get_user_progress(telegram_id, course_id)
+    return next(p for p in progress if p['material_id'] == material_id)
+
+
+def course_counter(telegram_id: int, course_id: int) -> int:
+    user = crud.get_user_by_telegram_id(telegram_id)
+    with db.get_connection() as conn:
+        return conn.execute('''
+            SELECT completed_materials FROM user_course_progress
+            WHERE user_id = ? AND course_id = ?
+        ''', (user['id'], course_id)).fetchone()['completed_materials']
+
+
+def test_flush_racing_a_completion():
+    telegram_id = 555000555
+    course_id, materials = setup_course(telegram_id, 'Racer', ROUNDS)
+    buffer = ProgressBuffer(flush_ms=1000)
+    
+    for material_id in materials:
+        buffer.add(telegram_id, material_id, progress_percent=40, last_position=100, time_spent=5)
+        
+        barrier = threading.Barrier(2)
+        
+        def flush():
+            barrier.wait()
+            buffer.flush()
+        
+        def complete():
+            barrier.wait()
+            assert complete_through(buffer, telegram_id, material_id, 300)['newly_completed']
+        
+        threads = [threading.Thread(target=flush), threading.Thread(target=complete)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        buffer.flush()
+        
+        progress = stored(telegram_id, course_id, material_id)
+        assert progress['completed']
+        assert (progress['progress_percent'], progress['last_position']) == (100, 300)
+        assert progress['time_spent'] == 5
+    
+    assert course_counter(telegram_id, course_id) == ROUNDS
+
+
+def test_failed_flush_restores_only_time_of_completed_entries(monkeypatch):
+    telegram_id = 555000666
+    course_id, (material_id,) = setup_course(telegram_id, 'Retry', 1)
+    buffer = ProgressBuffer(flush_ms=1000)
+    buffer.add(telegram_id, material_id, progress_percent=40, last_position=100, time_spent=5)
+    
+    # A completion takes the entry while the flush is writing it; then the
+    # flush fails and its entries go back to the buffer
+    taken = []
+    
+    def failing_batch(telegram_id, updates):
+        taken.extend(buffer.take(telegram_id, material_id))
+        return None
+    
+    monkeypatch.setattr(crud, 'update_progress_batch', failing_batch)
+    assert buffer.flush() == 0
+    monkeypatch.undo()
+    
+    assert taken == []
+    with db.unit_of_work():
+        assert crud.update_progress(telegram_id, material_id, 100, True, 300, 0)['newly_completed']
+    
+    assert buffer.peek(telegram_id, material_id)['last_position'] is None
+    assert buffer.flush() == 1
+    
+    progress = stored(telegram_id, course_id, material_id)
+    assert progress['completed']
+    assert (progress['progress_percent'], progress['last_position']) == (100, 300)
+    assert progress['time_spent'] == 5
+    assert course_counter(telegram_id, course_id) == 1
+
+
+def test_rolled_back_completion_restores_under_newer_updates():
+    telegram_id = 555000777
+    course_id, (material_id,) = setup_course(telegram_id, 'Restore', 1)
+    buffer = ProgressBuffer(flush_ms=1000)
+    assert complete_through(buffer, telegram_id, material_id, 300)['newly_completed']
+    
+    buffer.add(telegram_id, material_id, progress_percent=60, last_position=350, time_spent=5)
+    try:
+        with db.unit_of_work():
+            taken = buffer.take(telegram_id, material_id)
+            db.after_rollback(lambda: buffer.restore(telegram_id, taken))
+            crud.update_progress(telegram_id, material_id, 100, True, 400, 5)
+            # Playback went on while this request was failing
+            buffer.add(telegram_id, material_id, progress_percent=65, last_position=360,
+                       time_spent=5)
+            raise RuntimeError("request failed")
+    except RuntimeError:
+        pass
+    
+    pending = buffer.peek(telegram_id, material_id)
+    assert (pending['last_position'], pending['time_spent']) == (360, 10)
+    assert buffer.flush() == 1
+    
+    progress = stored(telegram_id, course_id, material_id)
+    assert progress['completed']
+    assert (progress['progress_percent'], progress['last_position']) == (65, 360)
+    assert progress['time_spent'] == 10
+    assert course_counter(telegram_id, course_id) == 1
@@ -0,0 +1,79 @@
+"""
+Concurrent progress writers must keep user_course_progress and XP in step
+with user_progress
+"""
+import threading
+
+from app.crud import crud
+from app.models.database import db
+
+WRITERS = 4
+ROUNDS = 40
+
+
+def run_together(target, *args):
+    """Start WRITERS threads on the same call at the same moment"""
+    barrier = threading.Barrier(WRITERS)
+    results = []
+    
+    def writer():
+        barrier.wait()
+        with db.unit_of_work():
+            results.append(target(*args))
+    
+    threads = [threading.Thread(target=writer) for _ in range(WRITERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def achievement_xp(telegram_id: int) -> int:
+    return sum(a['xp_reward'] for a in crud.get_user_achievements(telegram_id))
+
+
+def test_concurrent_completions_count_once():
+    telegram_id = 555000111
+    crud.create_user(telegram_id, 'writer', 'Writer')
+    direction_id = crud.create_direction('Concurrency')
+    course_id = crud.create_course(direction_id, 'Concurrency course', 'english')
+    materials = [crud.create_material(course_id, f'Lesson {i}', 'video', xp_reward=10)
+                 for i in range(ROUNDS)]
+    
+    newly_completed = 0
+    for material_id in materials:
+        results = run_together(crud.update_progress, telegram_id, material_id, 100, True)
+        assert all(results)
+        newly_completed += sum(r['newly_completed'] for r in results)
+    
+    user = crud.get_user_by_telegram_id(telegram_id)
+    with db.get_connection() as conn:
+        counter = conn.execute('''
+            SELECT completed_materials FROM user_course_progress
+            WHERE user_id = ? AND course_id = ?
+        ''', (user['id'], course_id)).fetchone()['completed_materials']
+    
+    assert newly_completed == ROUNDS
+    assert counter == ROUNDS
+    assert user['xp_points'] == 10 * ROUNDS + achievement_xp(telegram_id)
+
+
+def test_concurrent_batches_count_once():
+    telegram_id = 555000222
+    crud.create_user(telegram_id, 'batcher', 'Batcher')
+    direction_id = crud.create_direction('Concurrency batches')
+    course_id = crud.create_course(direction_id, 'Batch course', 'english')
+    materials = [crud.create_material(course_id, f'Lesson {i}', 'video', xp_reward=10)
+                 for i in range(ROUNDS)]
+    
+    for material_id in materials:
+        results = run_together(crud.update_progress_batch, telegram_id,
+                               [{'material_id': material_id, 'progress_percent': 100,
+                                 'completed': True}])
+        assert all(r is not None for r in results)
+        assert sum(len(r['newly_completed']) for r in results) == 1
+    
+    assert crud.get_user_stats(telegram_id)['completed_materials'] == ROUNDS
+    assert (crud.get_user_by_telegram_id(telegram_id)['xp_points']
+            == 10 * ROUNDS + achievement_xp(telegram_id))
@@ -0,0 +1,54 @@
+"""
+A unit of work that a failed step marked rollback-only must not pass for
+committed
+"""
+import asyncio
+import sqlite3
+
+import pytest
+
+from app.crud import acrud, crud
+from app.models.database import db, RollbackOnlyError
+
+
+def failing_step():
+    """A crud-style call that logs and swallows its database error"""
+    try:
+        with db.get_connection() as conn:
+            conn.execute('SELECT * FROM no_such_table')
+    except sqlite3.Error:
+        return None
+
+
+def test_commit_of_rollback_only_unit_raises():
+    rolled_back = []
+    with pytest.raises(RollbackOnlyError):
+        with db.unit_of_work() as uow:
+            crud.create_user(555000444, 'rolled', 'Rolled Back')
+            uow.after_rollback(lambda: rolled_back.append(True))
+            failing_step()
+            assert uow.rollback_only
+    
+    assert rolled_back == [True]
+    assert crud.get_user_by_telegram_id(555000444) is None
+
+
+def test_request_steps_commit_and_release_their_connection():
+    async def request():
+        async with acrud.unit_of_work() as uow:
+            await acrud.create_user(555000888, 'stepper', 'Stepper')
+            # Committed and visible to others, with nothing left checked out
+            assert uow.conn is None
+            with sqlite3.connect(db.db_path) as other:
+                assert other.execute('SELECT 1 FROM users WHERE telegram_id = 555000888'
+                                     ).fetchone()
+            
+            await acrud.run_db(failing_step)
+            await acrud.create_user(555000999, 'discarded', 'Discarded')
+    
+    with pytest.raises(RollbackOnlyError):
+        asyncio.run(request())
+    acrud.shutdown()
+    
+    assert crud.get_user_by_telegram_id(555000888) is not None
+    assert crud.get_user_by_telegram_id(555000999) is None
@@ -44,6 +44,7 @@ export const coursesAPI = {
 export const materialsAPI = {
   getOne: (id) => api.get(`/materials/${id}`),
   updateProgress: (id, data) => api.post(`/materials/${id}/progress`, data),
+  updateProgressBatch: (updates) => api.post('/progress/batch', { updates }),
   create: (data) => api.post('/materials', data),
   update: (id, data) => api.put(`/materials/${id}`, data),
   delete: (id) => api.delete(`/materials/${id}`),